@@ -0,0 +1,97 @@
+"""Compares the streaming directory listing parser against the BeautifulSoup based
+scraping that GodotBinariesCache used to do.
+
+usage: python benchmarks/bench_dir_listing.py [--rows N] [--repeat N]
+"""
+
+import os, sys, time, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "godot-toolkit"))
+
+from godot_dir_listing import GodotDirListingParser
+
+
+def gen_listing(rows):
+	'''Generates a lighttpd style index page with `rows` entries, alternating
+	between release directories and archives like the real mirror.
+	'''
+	out = ['<html><head><title>Index of /godotengine/</title></head><body><h2>Index of /godotengine/</h2>'
+	       '<div class="list"><table summary="Directory Listing" cellpadding="0" cellspacing="0">'
+	       '<thead><tr><th class="n">Name</th><th class="m">Last Modified</th><th class="s">Size</th><th class="t">Type</th></tr></thead><tbody>\n'
+	       '<tr><td class="n"><a href="../">Parent Directory</a>/</td><td class="m">&nbsp;</td><td class="s">- &nbsp;</td><td class="t">Directory</td></tr>\n']
+	for i in range(rows):
+		if i % 2 == 0:
+			out.append('<tr><td class="n"><a href="3.{i}/">3.{i}</a>/</td><td class="m">2019-Jul-{d:02d} 12:47:40</td>'
+			           '<td class="s">- &nbsp;</td><td class="t">Directory</td></tr>\n'.format(i=i, d=i % 28 + 1))
+		else:
+			out.append('<tr><td class="n"><a href="Godot_v3.{i}-stable_x11.64.zip">Godot_v3.{i}-stable_x11.64.zip</a></td>'
+			           '<td class="m">2019-Jul-{d:02d} 12:47:40</td><td class="s">30.1M</td><td class="t">application/zip</td></tr>\n'.format(i=i, d=i % 28 + 1))
+	out.append('</tbody></table></div><div class="foot">lighttpd/1.4.35</div></body></html>')
+
+	return "".join(out).encode("utf-8")
+
+
+def parse_streaming(data, chunk_size=64 * 1024):
+	rows = []
+	parser = GodotDirListingParser(rows.append)
+	for i in range(0, len(data), chunk_size):
+		parser.feed(data[i:i + chunk_size])
+	parser.close()
+
+	return [(r.name, r.href, r.type, r.mtime, r.size) for r in rows]
+
+
+def parse_bs4(data):
+	from bs4 import BeautifulSoup
+
+	soup = BeautifulSoup(data, 'html.parser')
+
+	rows = []
+	for tr in soup.find_all("tr"):
+		elem_n = tr.find("td", {"class": "n"})
+		elem_a = elem_n.a if elem_n else None
+		elem_t = tr.find("td", {"class": "t"})
+		elem_m = tr.find("td", {"class": "m"})
+		elem_s = tr.find("td", {"class": "s"})
+
+		if elem_a and elem_t:
+			rows.append((elem_a.get_text(), elem_a.get('href'), elem_t.get_text(), elem_m.get_text(), elem_s.get_text()))
+
+	return rows
+
+
+def bench(fn, data, repeat):
+	best = None
+	for i in range(repeat):
+		start = time.perf_counter()
+		result = fn(data)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best == None else min(best, elapsed)
+
+	return best, result
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(prog='bench_dir_listing')
+	parser.add_argument('--rows',   type=int, default=20000, help='Rows in the generated listing')
+	parser.add_argument('--repeat', type=int, default=3,     help='Runs per parser, the best one is reported')
+	args = parser.parse_args()
+
+	data = gen_listing(args.rows)
+	print("[+] Listing of {rows} rows ({size:.1f} KiB)".format(rows=args.rows, size=len(data) / 1024))
+
+	streaming_time, streaming_rows = bench(parse_streaming, data, args.repeat)
+	print("[+] streaming: {t:.4f}s".format(t=streaming_time))
+
+	try:
+		import bs4
+	except ImportError:
+		print("[-] bs4 not installed, skipping the BeautifulSoup comparison")
+		sys.exit(0)
+
+	bs4_time, bs4_rows = bench(parse_bs4, data, args.repeat)
+	print("[+] bs4:       {t:.4f}s ({x:.1f}x slower)".format(t=bs4_time, x=bs4_time / streaming_time))
+
+	if bs4_rows != streaming_rows:
+		print("[-] Parsers disagree on the listing contents!")
+		sys.exit(1)
\ No newline at end of file
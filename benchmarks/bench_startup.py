@@ -0,0 +1,116 @@
+"""Measures how long godot-cli takes to start and what it imports on the way.
+
+usage: python benchmarks/bench_startup.py [--repeat N] [--budget-ms MS] [-- ARGS...]
+
+Runs `godot_manager.py ARGS` (default: --version, then --help) in fresh
+interpreters and reports the wall time, the modules the CLI imports on top of
+a bare interpreter, the slowest of them and any heavy modules (HTTP stacks,
+compression, distutils) that a local command shouldn't need. With --budget-ms
+it exits with 1 if a command takes that much longer than starting a bare
+interpreter.
+"""
+
+import os, sys, time, argparse, statistics, subprocess
+
+benchmarks_dir = os.path.dirname(os.path.realpath(__file__))
+godot_cli_path = os.path.join(benchmarks_dir, "..", "godot-toolkit", "godot_manager.py")
+
+heavy_modules = ("requests", "urllib3", "bs4", "distutils", "setuptools", "http.client", "email.parser", "zipfile", "bz2", "lzma", "concurrent.futures")
+
+default_commands = [["--version"], ["--help"]]
+
+
+def wall_times(args, repeat):
+	samples = []
+	for i in range(repeat):
+		start = time.perf_counter()
+		subprocess.run([sys.executable, godot_cli_path] + args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		samples.append(time.perf_counter() - start)
+
+	return samples
+
+
+def bare_wall_times(repeat):
+	samples = []
+	for i in range(repeat):
+		start = time.perf_counter()
+		subprocess.run([sys.executable, "-c", "pass"])
+		samples.append(time.perf_counter() - start)
+
+	return samples
+
+
+def import_times(args):
+	'''Returns {module: (self seconds, cumulative seconds, depth)} from
+	`python -X importtime`.
+	'''
+	command = [sys.executable, "-X", "importtime"] + ([godot_cli_path] + args if args != None else ["-c", "pass"])
+	result  = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+	modules = {}
+	for line in result.stderr.decode("utf-8", errors="replace").splitlines():
+		if not line.startswith("import time:") or "|" not in line:
+			continue
+
+		fields = line[len("import time:"):].split("|")
+		if len(fields) != 3 or not fields[0].strip().isdigit():
+			continue
+
+		name  = fields[2].rstrip()
+		depth = (len(name) - len(name.lstrip())) // 2
+		modules[name.strip()] = (int(fields[0]) / 1e6, int(fields[1]) / 1e6, depth)
+
+	return modules
+
+
+def profile(args, repeat):
+	'''Wall time and import graph of one godot-cli command. Modules a bare
+	interpreter already imports (site, .pth files) are left out.
+	'''
+	baseline = import_times(None)
+	modules  = { name: times for name, times in import_times(args).items() if name not in baseline }
+	samples  = wall_times(args, repeat)
+
+	slowest = sorted(((times[1], name) for name, times in modules.items() if times[2] == 0), reverse=True)
+
+	return {
+		"command":         " ".join(args),
+		"median":          statistics.median(samples),
+		"min":             min(samples),
+		"samples":         samples,
+		"imported":        len(modules),
+		"import_seconds":  sum(times[0] for times in modules.values()),
+		"heavy_imports":   sorted(name for name in modules if name in heavy_modules),
+		"slowest_imports": [{ "module": name, "seconds": seconds } for seconds, name in slowest[:10]],
+	}
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(prog='bench_startup')
+	parser.add_argument('--repeat',    type=int,   default=10, help='Runs per command, the median is reported')
+	parser.add_argument('--budget-ms', type=float,             help='Fail if a command takes this much longer than a bare interpreter')
+	parser.add_argument('command',     nargs=argparse.REMAINDER, help='godot-cli arguments to measure, after --')
+	args = parser.parse_args()
+
+	command  = [arg for arg in args.command if arg != "--"]
+	commands = [command] if command else default_commands
+
+	bare = statistics.median(bare_wall_times(args.repeat))
+	print("[+] Bare interpreter: median {median:.1f} ms".format(median=bare * 1000))
+
+	over_budget = False
+	for command in commands:
+		result = profile(command, args.repeat)
+		print("[+] godot-cli {command}: median {median:.1f} ms (+{overhead:.1f} ms), {imported} modules imported in {imports:.1f} ms".format(
+			command=result["command"], median=result["median"] * 1000, overhead=(result["median"] - bare) * 1000,
+			imported=result["imported"], imports=result["import_seconds"] * 1000))
+		for entry in result["slowest_imports"][:5]:
+			print(" ├── {module}: {ms:.1f} ms".format(module=entry["module"], ms=entry["seconds"] * 1000))
+		print(" └── heavy imports: " + (", ".join(result["heavy_imports"]) or "none"))
+
+		if args.budget_ms != None and (result["median"] - bare) * 1000 > args.budget_ms:
+			over_budget = True
+
+	if over_budget:
+		print("[-] Startup is over the budget of {budget:.0f} ms".format(budget=args.budget_ms))
+		sys.exit(1)
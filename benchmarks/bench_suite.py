@@ -0,0 +1,481 @@
+"""Offline benchmark suite for godot-toolkit. Everything runs against local
+fixtures: recorded mirror listings served from localhost, synthetic manifests,
+generated zips and a stub Godot executable (benchmarks/stub_godot.py).
+
+usage: python benchmarks/bench_suite.py list
+       python benchmarks/bench_suite.py run [--only NAME ...] [--repeat N] [--out PATH] [--save-baseline]
+       python benchmarks/bench_suite.py compare CURRENT [--baseline PATH] [--threshold 0.10]
+
+`run` writes its results as JSON, `--save-baseline` also stores them as the
+baseline (benchmarks/baselines/baseline.json). `compare` checks results
+against a baseline and exits with 1 if any benchmark got slower by more than
+the threshold.
+"""
+
+import os, sys, io, abc, json, time, shutil, inspect, zipfile, argparse, platform, tempfile, datetime, threading, statistics, contextlib
+from http.server import ThreadingHTTPServer
+
+benchmarks_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_dir, "..", "godot-toolkit"))
+sys.path.insert(0, benchmarks_dir)
+
+from godot_toolkit_config import GodotToolkitConfig
+from godot_sys_arch import GodotSystemArch
+from fixture_support import QuietHandler, fixtures_dir, stub_godot_path, make_stub_project
+
+default_baseline = os.path.join(benchmarks_dir, "baselines", "baseline.json")
+
+
+class BenchEnv():
+	'''Scratch data directory, toolkit config pointing into it and a local HTTP
+	server for the recorded listings. Shared by all benchmarks of a run.
+	'''
+
+	def __init__(self, args):
+		self.args = args
+		self.path = tempfile.mkdtemp(prefix="godot-toolkit-bench-")
+
+		handler = lambda *a, **kw: QuietHandler(*a, directory=fixtures_dir, **kw)
+		self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+		self.base_url = "http://127.0.0.1:{port}".format(port=self.server.server_address[1])
+
+		config = GodotToolkitConfig()
+		config.set("godot_cli", "base_dl_url",                self.base_url + "/godotengine")
+		config.set("godot_cli", "godot_catalogue_cache_path", os.path.join(self.path, "cache.json"))
+		config.set("godot_cli", "godot_binaries_path",        os.path.join(self.path, "godot_bin"))
+		config.set("godot_cli", "download_tmp",               os.path.join(self.path, "tmp"))
+		config.set("godot_nightly", "manifest_url",           self.base_url + "/nightly.json")
+
+		# A fresh catalogue so nothing tries to rebuild it during the run
+		with open(os.path.join(self.path, "cache.json"), 'w') as f:
+			json.dump({ "versions": {}, "last_cache_datetime": datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%MZ") }, f)
+
+	def close(self):
+		self.server.shutdown()
+		self.server.server_close()
+		shutil.rmtree(self.path, ignore_errors=True)
+
+
+class Benchmark(abc.ABC):
+	'''One benchmark. setup() runs once, before_each() ahead of every timed run()
+	and teardown() at the end. run() may return a dict of extra metrics.
+	'''
+
+	name        = None
+	description = None
+
+	def setup(self, env):
+		self.env = env
+
+	def before_each(self):
+		pass
+
+	@abc.abstractmethod
+	def run(self):
+		pass
+
+	def teardown(self):
+		pass
+
+
+class ScrapeVersionsBench(Benchmark):
+	name        = "scrape_versions"
+	description = "GodotBinariesCache.scrape_versions() of the recorded mirror index, 20 times"
+
+	def setup(self, env):
+		super().setup(env)
+		from godot_binaries_cache import GodotBinariesCache
+		self.cache = GodotBinariesCache()
+
+	def run(self):
+		for i in range(20):
+			versions = self.cache.scrape_versions()
+		return { "versions": len(versions) }
+
+	def teardown(self):
+		self.cache.http.close()
+
+
+class ScrapeVersionReleasesBench(ScrapeVersionsBench):
+	name        = "scrape_version_releases"
+	description = "GodotBinariesCache.scrape_version_releases('3.2') of the recorded listing, 20 times"
+
+	def run(self):
+		for i in range(20):
+			releases = self.cache.scrape_version_releases("3.2")
+		return { "releases": len(releases) }
+
+
+class _ManifestBench(Benchmark):
+	releases = ("stable", "rc1", "rc2", "beta1", "alpha1")
+	arches   = [arch for arch in GodotSystemArch if arch not in (GodotSystemArch.OS_UNKNOWN, GodotSystemArch.OS_AUTO)]
+
+	def setup(self, env):
+		super().setup(env)
+		from godot_binaries_manifest import GodotBinariesManifest
+
+		self.manifest_class = GodotBinariesManifest
+		self.binaries_dir   = os.path.join(env.path, "godot_bin")
+		self.keys           = self.synthetic_keys(env.args.manifest_entries)
+
+		os.makedirs(os.path.join(self.binaries_dir, "blobs", "00"), exist_ok=True)
+		with open(os.path.join(self.binaries_dir, "blobs", "00", "00" * 32), 'wb') as f:
+			f.write(b"\0" * 1024)
+
+		self.write_manifest()
+
+	def synthetic_keys(self, count):
+		keys = []
+		i = 0
+		while len(keys) < count:
+			version = "{major}.{minor}.{patch}".format(major=1 + i // 100, minor=i // 10 % 10, patch=i % 10)
+			for release in self.releases:
+				for arch in self.arches:
+					keys.append((version, release, arch))
+			i += 1
+
+		return keys[:count]
+
+	def write_manifest(self):
+		versions = {}
+		for n, (version, release, arch) in enumerate(self.keys):
+			versions.setdefault(version, {}).setdefault(release, {})[arch.name] = {
+				"added_timestamp": "2019-07-14 15:33Z",
+				"bin":             "blobs/00/" + "00" * 32,
+				"sha256":          "{n:064x}".format(n=n),
+				"source_sha256":   "{n:064x}".format(n=n + len(self.keys)),
+				"size":            1024,
+			}
+
+		with open(os.path.join(self.binaries_dir, "manifest.json"), 'w') as f:
+			json.dump({ "versions": versions }, f, indent=4)
+
+
+class ManifestLoadBench(_ManifestBench):
+	name        = "manifest_load"
+	description = "Loading and indexing a synthetic manifest"
+
+	def run(self):
+		self.manifest_class()
+		return { "entries": len(self.keys) }
+
+
+class ManifestLookupBench(_ManifestBench):
+	name        = "manifest_lookup"
+	description = "get_binary_info() and find_binary_by_sha256() for every entry of a synthetic manifest"
+
+	def setup(self, env):
+		super().setup(env)
+		self.manifest = self.manifest_class()
+
+	def run(self):
+		for n, (version, release, arch) in enumerate(self.keys):
+			self.manifest.get_binary_info(version, release, arch)
+			self.manifest.find_binary_by_sha256(sha256="{n:064x}".format(n=n))
+		return { "lookups": 2 * len(self.keys) }
+
+
+class ManifestSaveBench(_ManifestBench):
+	name        = "manifest_save"
+	description = "Registering 50 binaries in one batch on top of a synthetic manifest"
+
+	def before_each(self):
+		self.write_manifest()
+		self.manifest = self.manifest_class()
+
+	def run(self):
+		with self.manifest.batch():
+			for i in range(50):
+				self.manifest.add_installed_binary("9.{i}".format(i=i), "stable", GodotSystemArch.OS_LINUX64, "blobs/00/" + "00" * 32)
+		return { "entries": len(self.keys) + 50 }
+
+
+class _ZipBench(Benchmark):
+	def setup(self, env):
+		super().setup(env)
+		from godot_manager import GodotManager
+
+		with contextlib.redirect_stdout(io.StringIO()):
+			self.manager = GodotManager()
+
+		self.zip_name = "Godot_v3.1.1-stable_x11.64.zip"
+		self.zip_path = os.path.join(self.manager.download_tmp, self.zip_name)
+		self.size     = env.args.zip_mb * 1024 * 1024
+
+		# Half random, half repetitive, roughly how an executable compresses
+		block = os.urandom(512 * 1024) + b"\x90" * 512 * 1024
+		with zipfile.ZipFile(self.zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+			with zip_ref.open("Godot_v3.1.1-stable_x11.64", 'w', force_zip64=True) as f:
+				for i in range(0, self.size, len(block)):
+					f.write(block[:self.size - i])
+			zip_ref.writestr("README.txt", "Godot Engine")
+
+
+class UnzipBench(_ZipBench):
+	name        = "unzip"
+	description = "GodotManager.unzip() of a generated Godot archive"
+
+	def before_each(self):
+		shutil.rmtree(self.zip_path + ".unzip", ignore_errors=True)
+
+	def run(self):
+		self.manager.unzip(self.zip_name)
+		return { "bytes": self.size }
+
+
+class InstallBench(_ZipBench):
+	name        = "install"
+	description = "GodotManager.install() of a generated Godot archive into an empty store"
+
+	def before_each(self):
+		shutil.rmtree(os.path.join(self.manager.binaries_dir, "blobs"), ignore_errors=True)
+		with open(self.manager.manifest.manifest_path, 'w') as f:
+			f.write("{}")
+		self.manager.manifest.load_manifest()
+
+	def run(self):
+		with contextlib.redirect_stdout(io.StringIO()):
+			stats = self.manager.install(self.zip_path, "3.1.1", "stable", GodotSystemArch.OS_LINUX64)
+		return { "bytes": stats["bytes_written"] }
+
+
+class _ExportBench(Benchmark):
+	def setup(self, env):
+		super().setup(env)
+
+		self.project_path  = os.path.join(env.path, "project")
+		self.template_path = os.path.join(env.path, "template.bin")
+		self.export_dest   = os.path.join(env.path, "export", "game.pck")
+
+		make_stub_project(self.project_path, self.template_path)
+
+		self.environ = dict(os.environ)
+		os.environ["STUB_GODOT_FILES"]  = str(env.args.export_files)
+		os.environ["STUB_GODOT_ERRORS"] = str(env.args.export_errors)
+		os.environ["STUB_GODOT_NOISE"]  = str(env.args.export_noise)
+
+	def teardown(self):
+		os.environ.clear()
+		os.environ.update(self.environ)
+
+
+class ExportBench(_ExportBench):
+	name        = "export"
+	description = "GodotExporter.export() driving the stub Godot, without the export cache"
+
+	def run(self):
+		from godot_exporter import GodotExporter
+
+		exporter = GodotExporter(godot_bin_path=stub_godot_path, export_template_bin_path=self.template_path,
+		                         project_path=self.project_path, preset="Linux/X11", export_dest=self.export_dest)
+		with contextlib.redirect_stdout(io.StringIO()):
+			exporter.export()
+		return { "processed_files": len(exporter.processed_files), "godot_errors": len(exporter.godot_errors) }
+
+
+class ExportLogParseBench(_ExportBench):
+	name        = "export_log_parse"
+	description = "GodotExporter.parse_godot_line() over recorded stub Godot output"
+
+	def setup(self, env):
+		super().setup(env)
+		import subprocess
+
+		self.lines = []
+		result = subprocess.run([sys.executable, stub_godot_path, os.path.join(env.path, "parse.pck")], capture_output=True)
+		for stream_name, data in (("stdout", result.stdout), ("stderr", result.stderr)):
+			self.lines += [(stream_name, line) for line in data.decode("utf-8").splitlines()]
+
+	def run(self):
+		from godot_exporter import GodotExporter
+
+		exporter = GodotExporter()
+		for stream_name, line in self.lines:
+			exporter.parse_godot_line(stream_name, line)
+		return { "lines": len(self.lines) }
+
+
+class StartupBench(Benchmark):
+	name        = "cli_startup"
+	description = "godot-cli --version in a fresh interpreter, with its import graph"
+
+	def setup(self, env):
+		super().setup(env)
+		import bench_startup
+		self.bench_startup = bench_startup
+
+		profile = bench_startup.profile(["--version"], 1)
+		self.metrics = { "imported": profile["imported"], "import_seconds": profile["import_seconds"], "heavy_imports": profile["heavy_imports"] }
+
+	def run(self):
+		self.bench_startup.wall_times(["--version"], 1)
+		return self.metrics
+
+
+benchmarks = [
+	ScrapeVersionsBench,
+	ScrapeVersionReleasesBench,
+	ManifestLoadBench,
+	ManifestLookupBench,
+	ManifestSaveBench,
+	UnzipBench,
+	InstallBench,
+	ExportBench,
+	ExportLogParseBench,
+	StartupBench,
+]
+
+# A benchmark without run() would only fail once the ones before it ran
+for bench_class in benchmarks:
+	if inspect.isabstract(bench_class):
+		raise TypeError("Benchmark {name} doesn't implement {methods}".format(
+			name=bench_class.__name__, methods=", ".join(sorted(bench_class.__abstractmethods__))))
+
+
+def run_benchmarks(args):
+	selected = [bench for bench in benchmarks if not args.only or bench.name in args.only]
+	if not selected:
+		print("[-] No benchmarks match " + ", ".join(args.only))
+		sys.exit(1)
+
+	results = {}
+	env = BenchEnv(args)
+	try:
+		for bench_class in selected:
+			bench = bench_class()
+			bench.setup(env)
+			try:
+				samples = []
+				metrics = {}
+				for i in range(args.repeat):
+					bench.before_each()
+					start = time.perf_counter()
+					metrics = bench.run() or {}
+					samples.append(time.perf_counter() - start)
+			finally:
+				bench.teardown()
+
+			results[bench.name] = {
+				"median":  statistics.median(samples),
+				"min":     min(samples),
+				"max":     max(samples),
+				"samples": samples,
+				"metrics": metrics,
+			}
+			print("[+] {name:<24} median {median:.4f}s  min {min:.4f}s".format(name=bench.name, **results[bench.name]))
+	finally:
+		env.close()
+
+	return {
+		"meta": {
+			"created":  datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%MZ"),
+			"python":   platform.python_version(),
+			"platform": platform.platform(),
+			"repeat":   args.repeat,
+			"params":   {
+				"manifest_entries": args.manifest_entries,
+				"zip_mb":           args.zip_mb,
+				"export_files":     args.export_files,
+				"export_errors":    args.export_errors,
+				"export_noise":     args.export_noise,
+			},
+		},
+		"results": results,
+	}
+
+
+def compare_results(baseline, current, threshold):
+	'''Returns the rows of the comparison and whether anything regressed.
+	'''
+	if baseline["meta"].get("params") != current["meta"].get("params"):
+		print("[!] Baseline was recorded with different parameters, timings may not be comparable")
+
+	rows      = []
+	regressed = False
+	for name in sorted(set(baseline["results"]) | set(current["results"])):
+		if name not in current["results"]:
+			rows.append((name, baseline["results"][name]["median"], None, None, "missing"))
+			continue
+		if name not in baseline["results"]:
+			rows.append((name, None, current["results"][name]["median"], None, "new"))
+			continue
+
+		before = baseline["results"][name]["median"]
+		after  = current["results"][name]["median"]
+		ratio  = after / before if before else float("inf")
+
+		if ratio > 1 + threshold:
+			status = "REGRESSION"
+			regressed = True
+		elif ratio < 1 - threshold:
+			status = "improved"
+		else:
+			status = "ok"
+		# Modules a local command shouldn't need creeping back into the startup path
+		new_heavy = set(current["results"][name]["metrics"].get("heavy_imports", [])) - set(baseline["results"][name]["metrics"].get("heavy_imports", []))
+		if new_heavy:
+			status = "REGRESSION (imports " + ", ".join(sorted(new_heavy)) + ")"
+			regressed = True
+
+		rows.append((name, before, after, ratio, status))
+
+	return rows, regressed
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(prog='bench_suite')
+	subparsers = parser.add_subparsers(dest='command', required=True)
+
+	subparsers.add_parser('list', help='List the benchmarks')
+
+	run_parser = subparsers.add_parser('run', help='Run the benchmarks')
+	run_parser.add_argument('--only',             nargs='+',                    help='Only run these benchmarks')
+	run_parser.add_argument('--repeat',           type=int, default=5,          help='Timed runs per benchmark, the median is compared')
+	run_parser.add_argument('--out',              type=str,                     help='Write the results to this JSON file')
+	run_parser.add_argument('--save-baseline',    action='store_true',          help='Store the results as the baseline')
+	run_parser.add_argument('--manifest-entries', type=int, default=5000,       help='Entries in the synthetic manifest')
+	run_parser.add_argument('--zip-mb',           type=int, default=32,         help='Size of the binary in the generated zip')
+	run_parser.add_argument('--export-files',     type=int, default=2000,       help='Files the stub Godot stores per export')
+	run_parser.add_argument('--export-errors',    type=int, default=20,         help='ERROR lines the stub Godot prints per export')
+	run_parser.add_argument('--export-noise',     type=int, default=2000,       help='Unrelated lines the stub Godot prints per export')
+
+	compare_parser = subparsers.add_parser('compare', help='Compare results against a baseline')
+	compare_parser.add_argument('current',                                      help='Results of `run --out`')
+	compare_parser.add_argument('--baseline',     type=str, default=default_baseline, help='Baseline results')
+	compare_parser.add_argument('--threshold',    type=float, default=0.10,     help='Relative slowdown that counts as a regression')
+
+	args = parser.parse_args()
+
+	if args.command == 'list':
+		for bench in benchmarks:
+			print("{name:<24} {description}".format(name=bench.name, description=bench.description))
+
+	elif args.command == 'run':
+		report = run_benchmarks(args)
+
+		paths = ([args.out] if args.out else []) + ([default_baseline] if args.save_baseline else [])
+		for path in paths:
+			if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+				os.makedirs(os.path.dirname(path))
+			with open(path, 'w') as f:
+				json.dump(report, f, indent=4)
+			print("[+] Results written to " + path)
+
+	elif args.command == 'compare':
+		with open(args.baseline, 'r') as f:
+			baseline = json.load(f)
+		with open(args.current, 'r') as f:
+			current = json.load(f)
+
+		rows, regressed = compare_results(baseline, current, args.threshold)
+
+		fmt = lambda seconds: "{s:.4f}s".format(s=seconds) if seconds != None else "-"
+		print("{name:<24} {before:>10} {after:>10} {ratio:>7}  status".format(name="benchmark", before="baseline", after="current", ratio="ratio"))
+		for name, before, after, ratio, status in rows:
+			print("{name:<24} {before:>10} {after:>10} {ratio:>7}  {status}".format(
+				name=name, before=fmt(before), after=fmt(after), ratio="{r:.2f}x".format(r=ratio) if ratio != None else "-", status=status))
+
+		if regressed:
+			print("[-] Performance regressed, see above (threshold {t:.0%})".format(t=args.threshold))
+			sys.exit(1)
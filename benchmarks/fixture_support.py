@@ -0,0 +1,60 @@
+"""Local fixtures shared by the benchmark suite and the tests: the recorded
+mirror listings, the stub Godot executable, a quiet HTTP handler to serve
+them and a Godot project to export with the stub.
+"""
+
+import os
+from http.server import SimpleHTTPRequestHandler
+
+benchmarks_dir  = os.path.dirname(os.path.realpath(__file__))
+fixtures_dir    = os.path.join(benchmarks_dir, "fixtures")
+stub_godot_path = os.path.join(benchmarks_dir, "stub_godot.py")
+
+# A single Linux/X11 preset exporting everything
+export_presets = '''[preset.0]
+
+name="Linux/X11"
+platform="Linux/X11"
+runnable=true
+custom_features=""
+export_filter="all_resources"
+include_filter=""
+exclude_filter=""
+export_path=""
+patch_list=PoolStringArray(  )
+script_export_mode=1
+script_encryption_key=""
+
+[preset.0.options]
+
+texture_format/bptc=false
+custom_template/debug=""
+custom_template/release=""
+'''
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+	'''Keep-alive static file handler that doesn't log every request.
+	'''
+
+	protocol_version        = "HTTP/1.1"
+	disable_nagle_algorithm = True
+
+	def log_message(self, format, *args):
+		pass
+
+
+def make_stub_project(project_path, template_path, assets=100):
+	'''Writes a project with `export_presets` and `assets` random sprites, and a
+	dummy export template, for exporting with the stub Godot.
+	'''
+	os.makedirs(os.path.join(project_path, "assets"), exist_ok=True)
+	with open(os.path.join(project_path, "export_presets.cfg"), 'w') as f:
+		f.write(export_presets)
+	with open(os.path.join(project_path, "project.godot"), 'w') as f:
+		f.write("config_version=4\n")
+	for i in range(assets):
+		with open(os.path.join(project_path, "assets", "sprite_{i}.png".format(i=i)), 'wb') as f:
+			f.write(os.urandom(1024))
+	with open(template_path, 'wb') as f:
+		f.write(b"\0" * 1024)
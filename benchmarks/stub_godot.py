@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""Stands in for `godot --export <preset> <dest>` in benchmarks and tests.
+Prints the output of a Godot 3 export and writes a dummy pack.
+
+The volume is set through the environment:
+  STUB_GODOT_FILES  files "stored" into the pack (default 2000)
+  STUB_GODOT_ERRORS ERROR lines spread over the export (default 20)
+  STUB_GODOT_NOISE  unrelated lines written to stderr (default 2000)
+  STUB_GODOT_SLEEP  seconds to hang before exiting (default 0)
+  STUB_GODOT_EXIT   exit code (default 0)
+"""
+
+import os, sys, time
+
+files  = int(os.environ.get("STUB_GODOT_FILES", "2000"))
+errors = int(os.environ.get("STUB_GODOT_ERRORS", "20"))
+noise  = int(os.environ.get("STUB_GODOT_NOISE", "2000"))
+sleep  = float(os.environ.get("STUB_GODOT_SLEEP", "0"))
+code   = int(os.environ.get("STUB_GODOT_EXIT", "0"))
+
+out = sys.stdout
+err = sys.stderr
+
+out.write("Godot Engine v3.1.1.stable.official - https://godotengine.org\n")
+out.write("OpenGL ES 3.0 Renderer: llvmpipe (LLVM 9.0.0, 256 bits)\n\n")
+for i in range(noise):
+	err.write("WARNING: _update_root_rect: Font oversampling only works with the resize modes 'Keep Width', 'Keep Height', and 'Expand'.\n"
+	          "   At: scene/main/scene_tree.cpp:{line}.\n".format(line=1150 + i % 7))
+
+out.write("savepack: begin: Packing steps: 102\n")
+error_every = files // errors if errors else 0
+for i in range(files):
+	out.write("savepack: step {step}: Storing File: res://assets/{dir}/sprite_{i}.png\n".format(step=i * 100 // max(1, files), dir=i % 17, i=i))
+	out.write("savepack: step {step}: Storing File: res://.import/sprite_{i}.png-{i:032x}.stex\n".format(step=i * 100 // max(1, files), i=i))
+	if error_every and i % error_every == 0:
+		err.write("ERROR: load_interactive: Failed loading resource: res://assets/missing_{i}.tres\n".format(i=i))
+		err.write("   At: core/io/resource_loader.cpp:285.\n")
+out.write("savepack: end\n")
+
+with open(sys.argv[-1], 'wb') as f:
+	f.write(b"GDPC" + b"\0" * 4096)
+
+out.flush()
+time.sleep(sleep)
+sys.exit(code)
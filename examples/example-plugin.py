@@ -5,7 +5,13 @@ import time
 
 
 class ExportPlugin():
+	# These hooks don't touch anything the other plugins or the export rely on,
+	# so they may run on a thread of their own while Godot keeps packing
+	independent_hooks = ("on_file_packed",)
+
 	def __init__(self):
+		self.version_file_packed = False
+
 		self.windows_bin_properties = {
 			"CompanyName":     "My Company",
 			"FileDescription": "Description of file",
@@ -32,10 +38,14 @@ class ExportPlugin():
 	def modify_export_config(self, godot_exporter, section, export_config):
 		export_config.set(section, "include_filter", r'"version.json"')
 
+	def on_file_packed(self, godot_exporter, path):
+		if path == "res://version.json":
+			self.version_file_packed = True
+
 	def post_export(self, godot_exporter):
 		if len(godot_exporter.processed_files) > 0:
 			# Ensure that version.json is included in the export
-			if "res://version.json" not in godot_exporter.processed_files:
+			if not self.version_file_packed:
 				print("[-] Version file was not included in the export!")
 
 			# Now increase the build number
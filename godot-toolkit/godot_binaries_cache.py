@@ -1,77 +1,292 @@
-import re, os, json, datetime, urllib
+import re, os, sys, json, time, datetime, subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 from godot_toolkit_config import GodotToolkitConfig
 from godot_sys_arch import GodotSystemArch
-
-try:
-	from bs4 import BeautifulSoup
-except:
-	print("[-] bs4 Python module needs to be installed. Install it with `pip install bs4`")
-	exit()
+from godot_http import GodotHttpPool
+from godot_dir_listing import GodotDirListingParser
+from godot_file_lock import GodotFileLock
+from godot_version_index import GodotVersionIndex, VersionSpecError
 
 class VersionOrReleaseError(Exception):
 	pass
 
 
 class GodotBinariesCache():
-	def __init__(self, suppress_recache=False):
-		self.__cache = None
+	version_re           = re.compile(r'(\d+\.\d+\.*\d*\.*\d*)')
+	ignored_release_dirs = ("Parent Directory", "mono", "fixup")
+
+	# Catalogue kept loaded by the daemon for the commands it runs, see GodotDaemon
+	resident = None
+
+	def __init__(self, suppress_recache=False, sync=False):
+		self.__cache         = None
+		self.__version_index = None
 
 		self.time_format          = "%Y-%m-%d %H:%MZ"
 		self.godot_toolkit_config = GodotToolkitConfig()
 
 		self.cache_path = self.godot_toolkit_config.get_adjusted_path("godot_cli", "godot_catalogue_cache_path")
 
-		# Construct cache file if it doesn't exist
+		self.scrape_concurrency = max(1, self.godot_toolkit_config.get_int("godot_cli", "scrape_concurrency", 1))
+		self.http = GodotHttpPool(
+			timeout = self.godot_toolkit_config.get_float("godot_cli", "scrape_timeout", 30),
+			retries = self.godot_toolkit_config.get_int("godot_cli", "scrape_retries", 3),
+			backoff = self.godot_toolkit_config.get_float("godot_cli", "scrape_retry_backoff", 0.5))
+
+		# A catalogue older than stale_after is refreshed in the background while
+		# callers keep using it, past max_staleness they wait for the refresh.
+		self.stale_after      = self.godot_toolkit_config.get_float("godot_cli", "catalogue_stale_after", 24 * 60 * 60)
+		self.max_staleness    = self.godot_toolkit_config.get_float("godot_cli", "catalogue_max_staleness", 7 * 24 * 60 * 60)
+		self.refresh_interval = self.godot_toolkit_config.get_float("godot_cli", "catalogue_refresh_interval", 10 * 60)
+
+		self.lock               = GodotFileLock(self.cache_path + ".lock")
+		self.refresh_stamp_path = self.cache_path + ".refresh"
+		self.refresh_log_path   = self.cache_path + ".refresh.log"
+
+		# Construct cache file if it doesn't exist. Another process may be writing
+		# its first catalogue right now, only create it while holding the lock.
 		if not os.path.exists(self.cache_path):
-			with open(self.cache_path, 'w') as f:	
-				f.write("{}")
-		
+			with self.lock:
+				if not os.path.exists(self.cache_path):
+					self.__cache = {}
+					self.save_changes_to_cache()
+
+		self.load_cache()
+
+		if not suppress_recache:
+			self.revalidate(sync)
+
+	def get_cache(self):
+		return self.__cache
+
+	def load_cache(self):
 		with open(self.cache_path, 'r') as f:
 			self.__cache = json.load(f)
 
-		# Check the last time the catalog was written to, if it's been a day then
-		# rewrite with latest Godot releases versions.
-		recache_catalogue = False
-		if self.__cache != None:
-			if "last_cache_datetime" in self.__cache:
-				last_catalogue_time = datetime.datetime.strptime(self.__cache["last_cache_datetime"], self.time_format)
-				if (datetime.datetime.utcnow() - last_catalogue_time) > datetime.timedelta(days=1):
-					recache_catalogue = True
+		self.__version_index = None
+		self.__validators = dict(self.__cache.get("validators", {}))
+
+	@property
+	def version_index(self):
+		'''The GodotVersionIndex stored with the catalogue. Catalogues written before
+		there was an index get one built when it's first needed.
+		'''
+		if self.__version_index == None:
+			stored = self.__cache.get("index")
+			if stored and stored.get("format") == GodotVersionIndex.format_version:
+				self.__version_index = GodotVersionIndex(stored)
 			else:
-				recache_catalogue = True
+				self.__version_index = GodotVersionIndex.build(self.__cache)
+
+		return self.__version_index
 
-		if recache_catalogue == True:
+	def age(self):
+		'''Seconds since the catalogue was refreshed, None if it never was.
+		'''
+		if self.__cache == None or "last_cache_datetime" not in self.__cache:
+			return None
+
+		last_catalogue_time = datetime.datetime.strptime(self.__cache["last_cache_datetime"], self.time_format)
+		return (datetime.datetime.utcnow() - last_catalogue_time).total_seconds()
+
+	def is_stale(self):
+		age = self.age()
+		return age == None or age > self.stale_after
+
+	def revalidate(self, sync=False):
+		'''Stale-while-revalidate: a stale catalogue is still answered from and gets
+		refreshed by a detached process. The caller only waits for the refresh
+		when there is no catalogue yet, when it is older than `max_staleness` or
+		when `sync` is set.
+		'''
+		if not self.is_stale():
+			return
+
+		age = self.age()
+		if age == None or age > self.max_staleness or sync:
 			print("[+] Outdated cache, rebuilding")
-			self.recache()
+			self.recache(only_if_stale=True)
+		else:
+			self.refresh_in_background()
+
+	def refresh_in_background(self):
+		'''Starts a detached process that refreshes the catalogue, unless a refresh
+		is running right now or one was started less than `refresh_interval`
+		seconds ago. Returns whether a process was started.
+		'''
+		# Holding the lock while checking and stamping keeps concurrent callers
+		# from starting a refresh each. If it's taken a refresh is running.
+		if not self.lock.acquire(blocking=False):
+			return False
+
+		try:
+			if os.path.exists(self.refresh_stamp_path) and time.time() - os.path.getmtime(self.refresh_stamp_path) < self.refresh_interval:
+				return False
+
+			with open(self.refresh_stamp_path, 'w') as f:
+				f.write(str(os.getpid()))
+		finally:
+			self.lock.release()
+
+		env = dict(os.environ)
+		env[GodotToolkitConfig.overrides_env] = json.dumps(self.godot_toolkit_config.overrides())
+
+		# The refresh outlives this command, detach it from the terminal and the
+		# process group so it isn't killed along with it.
+		kwargs = {}
+		if os.name == "nt":
+			kwargs["creationflags"] = getattr(subprocess, "DETACHED_PROCESS", 0) | getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0)
+		else:
+			kwargs["start_new_session"] = True
+
+		with open(self.refresh_log_path, 'a') as log:
+			subprocess.Popen([sys.executable, os.path.realpath(__file__), "--refresh"],
+				stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, env=env, close_fds=True, **kwargs)
+
+		print("[+] Catalogue is {hours:.0f} hours old, refreshing it in the background".format(hours=self.age() / 3600))
+		return True
+
+	def recache(self, full=False, only_if_stale=False, blocking=True):
+		'''Refreshes the catalogue. Unless `full` is set the refresh is incremental,
+		version directories whose listing timestamp hasn't moved are carried over
+		from the existing cache and every page is fetched with a conditional GET.
+
+		Only one process refreshes at a time. Others wait for it and, with
+		`only_if_stale`, pick up its result instead of refreshing again. Without
+		`blocking` they give up right away and False is returned.
+		'''
+		if not self.lock.acquire(blocking=False):
+			if not blocking:
+				return False
 
-	def get_cache(self):
-		return self.__cache
+			print("[+] Waiting for another process to finish refreshing the catalogue")
+			self.lock.acquire()
+
+		try:
+			self.load_cache()
+			if only_if_stale and not self.is_stale():
+				print("[+] Catalogue was refreshed by another process")
+				return True
+
+			self.__recache(full)
+			return True
+		finally:
+			self.lock.release()
+
+	def __recache(self, full):
+		previous          = {} if full or self.__cache == None else self.__cache
+		previous_versions = previous.get("versions", {})
+
+		if previous_versions:
+			print("[+] Refreshing cache")
+		else:
+			print("[+] Building cache")
+
+		self.__validators = dict(previous.get("validators", {}))
+		requests_before   = self.http.request_count
 
-	def recache(self):
-		print("[+] Building cache")
 		self.__cache = { "versions": {} }
 
-		# Fetch all the versions available and insert them into the cache
-		self.__cache['versions'] = self.scrape_versions()
-		for version in self.__cache['versions']:
-			self.__cache['versions'][version]['releases'] = {}
+		# Fetch all the versions available and insert them into the cache. If the
+		# index page itself is unchanged then so is every directory below it.
+		versions = self.scrape_versions(conditional=bool(previous_versions))
+		if versions == None:
+			versions = { version: previous_versions[version] for version in previous_versions if version != "nightly" }
+
+		stale_versions = []
+		for version in versions:
+			previous_version = previous_versions.get(version)
+			if previous_version and "releases" in previous_version \
+			   and previous_version.get("last_modified") == versions[version]["last_modified"]:
+				versions[version]["releases"] = previous_version["releases"]
+			else:
+				stale_versions.append(version)
+
+		self.__cache['versions'] = versions
+		all_versions = list(versions.keys())
 
-			releases = self.scrape_version_releases(version)
+		# Release pages are independent of each other so they can be scraped
+		# concurrently. Results are collected in version order so the cache is
+		# identical to a serial scrape.
+		if self.scrape_concurrency > 1 and len(stale_versions) > 1:
+			with ThreadPoolExecutor(max_workers=self.scrape_concurrency) as executor:
+				all_releases = list(executor.map(lambda v: self.__refresh_version_releases(v, previous_versions), stale_versions))
+		else:
+			all_releases = [self.__refresh_version_releases(v, previous_versions) for v in stale_versions]
+
+		for version, releases in zip(stale_versions, all_releases):
+			self.__cache['versions'][version]['releases'] = {}
 			for release in releases:
 				self.__cache['versions'][version]['releases'][release] = releases[release]
 
 		now = datetime.datetime.utcnow()
 		self.__cache['last_cache_datetime'] = now.strftime(self.time_format)
 
-		self.cache_nightly_manifest()
+		self.cache_nightly_manifest(previous_nightly=previous_versions.get("nightly"))
+		self.http.close()
+
+		# Forget validators of pages that are no longer part of the catalogue
+		base_url = self.godot_toolkit_config.get("godot_cli", "base_dl_url") + "/"
+		live_urls = set([base_url, self.godot_toolkit_config.get("godot_nightly", "manifest_url")])
+		live_urls.update(base_url + version + "/" for version in all_versions)
+		self.__cache['validators'] = { url: self.__validators[url] for url in self.__validators if url in live_urls }
+
+		self.__version_index = GodotVersionIndex.build(self.__cache)
+		self.__cache['index'] = self.__version_index.index
 
 		self.save_changes_to_cache()
-		
+
+		print("[+] Cache refreshed with {n} requests, {stale}/{total} version directories rescraped".format(
+			n=self.http.request_count - requests_before, stale=len(stale_versions), total=len(all_versions)))
+
+	def __refresh_version_releases(self, version, previous_versions):
+		previous_releases = previous_versions.get(version, {}).get("releases")
+
+		releases = self.scrape_version_releases(version, conditional=previous_releases != None)
+		if releases == None:
+			return previous_releases
+
+		return releases
+
+	def __fetch(self, url, conditional=False, on_chunk=None, on_headers=None):
+		'''Fetches `url` and returns the response. When `conditional` is set the
+		validators from the last fetch are sent along and None is returned if the
+		page is unchanged.
+		'''
+		headers = {}
+		if conditional and url in self.__validators:
+			validators = self.__validators[url]
+			if "etag" in validators:
+				headers["If-None-Match"] = validators["etag"]
+			if "last_modified" in validators:
+				headers["If-Modified-Since"] = validators["last_modified"]
+
+		response = self.http.request(url, headers, on_chunk, on_headers)
+		if response.status == 304 and headers:
+			return None
+
+		validators = {}
+		if response.header("etag"):
+			validators["etag"] = response.header("etag")
+		if response.header("last-modified"):
+			validators["last_modified"] = response.header("last-modified")
+
+		if validators:
+			self.__validators[url] = validators
+		else:
+			self.__validators.pop(url, None)
+
+		return response
+
 	def save_changes_to_cache(self):
-		with open(self.cache_path, 'w') as f:
+		# Other processes may be reading the cache right now, swap it in atomically
+		tmp_path = "{path}.{pid}.tmp".format(path=self.cache_path, pid=os.getpid())
+		with open(tmp_path, 'w') as f:
 			json.dump(self.__cache, f, indent=4)
 
+		os.replace(tmp_path, self.cache_path)
+
 	def construct_download_url(self, version, release="stable", sys_arch=GodotSystemArch.from_current_os()):
 		# If nightly is specified we need to do some specific stuff
 		if version == "nightly":
@@ -83,25 +298,11 @@ class GodotBinariesCache():
 
 			return full_url, file_name
 
-		# Figure out what the latest version is in the cache
-		if version == "latest":
-			versions = list(self.__cache['versions'].keys())
-			versions.remove("nightly")
-
-			from distutils.version import LooseVersion
-			versions.sort(key=LooseVersion)
-
-			version = versions[-1]
-		
-		if version not in self.__cache['versions']:
-			raise VersionOrReleaseError("{version} not available. If this is a new version then you may need to --recache".format(version=version))
-
-		version_info = self.__cache['versions'][version]
-		releases     = version_info['releases']
+		version, release = self.resolve(version, release)
 
-		# Check to see if release is valid
-		if release != "stable" and release not in releases:
-			raise VersionOrReleaseError("{release} not available in {version}. If this is a new version/release then you may need to --recache".format(release=release, version=version))
+		arches = self.version_index.arches(version, release)
+		if arches != None and sys_arch.to_file_suffix() not in arches:
+			raise VersionOrReleaseError("{version} {release} is not published for {arch}".format(version=version, release=release, arch=sys_arch.to_file_suffix()))
 
 		# Construct default URLs
 		base_url = self.godot_toolkit_config.get("godot_cli", "base_dl_url")
@@ -117,71 +318,122 @@ class GodotBinariesCache():
 
 		return "{extended_base_url}/{file_name}".format(extended_base_url=extended_base_url, file_name=download_file_name), download_file_name
 
-	def scrape_versions(self):
-		base_url = self.godot_toolkit_config.get("godot_cli", "base_dl_url") + "/"
-		f = urllib.request.urlopen(base_url)
+	def construct_templates_url(self, version, release="stable"):
+		'''URL and file name of the export templates archive (.tpz) of a version,
+		published next to its binaries.
+		'''
+		if version == "nightly":
+			raise VersionOrReleaseError("Export templates aren't published for nightly builds")
+
+		version, release = self.resolve(version, release)
+
+		base_url = self.godot_toolkit_config.get("godot_cli", "base_dl_url")
+		extended_base_url = "{base_url}/{version}/{release}".format(base_url=base_url, version=version, release=release)
+		if release == "stable":
+			extended_base_url = "{base_url}/{version}".format(base_url=base_url, version=version)
+
+		file_name = "Godot_v{version}-{release}_export_templates.tpz".format(version=version, release=release)
+
+		return "{extended_base_url}/{file_name}".format(extended_base_url=extended_base_url, file_name=file_name), file_name
+
+	def resolve(self, version, release="stable"):
+		'''Resolves a version spec (`latest`, `3.1.x`, `>=3.0,<3.2`, see
+		GodotVersionIndex) and a release, channel or `latest` to the version and
+		release they currently stand for.
+		'''
+		if version == "nightly":
+			return version, release
+
+		try:
+			resolved_version = self.version_index.resolve_version(version)
+		except VersionSpecError as e:
+			raise VersionOrReleaseError(str(e))
+
+		if resolved_version == None:
+			raise VersionOrReleaseError("{version} not available. If this is a new version then you may need to --recache".format(version=version))
 
-		soup = BeautifulSoup(f.read(), 'html.parser')
+		# Stable builds live in the version directory itself and catalogues
+		# scraped before it was listed don't know about them, always allow them
+		resolved_release = "stable" if release == "stable" else self.version_index.resolve_release(resolved_version, release)
+		if resolved_release == None:
+			raise VersionOrReleaseError("{release} not available in {version}. If this is a new version/release then you may need to --recache".format(release=release, version=resolved_version))
+
+		return resolved_version, resolved_release
+
+	def get_download_sha256(self, version, sys_arch=GodotSystemArch.from_current_os()):
+		'''Returns the published SHA-256 of the download for `version`, if known. Only
+		the nightly manifest publishes one, and it describes the Linux build.
+		'''
+		if version == "nightly" and sys_arch == GodotSystemArch.OS_LINUX64:
+			return self.__cache['versions'].get('nightly', {}).get('sha256')
+
+		return None
+
+	def scrape_versions(self, conditional=False):
+		base_url = self.godot_toolkit_config.get("godot_cli", "base_dl_url") + "/"
 
 		# Hunt for table rows that have versions
 		version_list = {}
-		for tr in soup.find_all("tr"):
-			elem_n = tr.find("td", {"class": "n"})
-			elem_a = elem_n.a if elem_n else None
-			elem_t = tr.find("td", {"class": "t"})
-			elem_m = tr.find("td", {"class": "m"})
-			elem_s = tr.find("td", {"class": "s"})
-
-			if elem_n and elem_t.get_text() == "Directory":
-				matches = re.finditer(r'(\d+\.\d+\.*\d*\.*\d*)', elem_a.get_text(), re.MULTILINE)
-				for matchNum, match in enumerate(matches, start=1):
+		def on_row(row):
+			if row.type == "Directory":
+				for match in self.version_re.finditer(row.name):
 					version = match.group(1)
 					version_list[version] = {
-						"link": elem_a.get('href'),
-						"last_modified": elem_m.get_text(),
-						#"downloads": {}
+						"link": row.href,
+						"last_modified": row.mtime,
 					}
 
-					#file_suffix_map_reverse = GodotSystemArch.get_file_suffix_map_reverse()
-					#for sys_arch in file_suffix_map_reverse:
-					#	version_list[version]['downloads'][sys_arch.name] = sys_arch.get_formatted_binary_name(version, "stable") + ".zip"
+		parser = GodotDirListingParser(on_row)
+		if self.__fetch(base_url, conditional, parser.feed, parser.set_headers) == None:
+			return None
+		parser.close()
 
 		return version_list
 
-	def scrape_version_releases(self, version):
+	def scrape_version_releases(self, version, conditional=False):
 		base_url = self.godot_toolkit_config.get("godot_cli", "base_dl_url") + "/"
-		f = urllib.request.urlopen(base_url + version)
 
-		soup = BeautifulSoup(f.read(), 'html.parser')
+		# Stable builds sit next to the release directories, note which
+		# architectures they are published for
+		stable_prefix = "Godot_v{version}-stable_".format(version=version)
+		file_suffixes = GodotSystemArch.get_file_suffix_map()
 
 		releases = {}
-		for tr in soup.find_all("tr"):
-			elem_n = tr.find("td", {"class": "n"})
-			elem_a = elem_n.a if elem_n else None
-			elem_t = tr.find("td", {"class": "t"})
-			elem_m = tr.find("td", {"class": "m"})
-			elem_s = tr.find("td", {"class": "s"})
-
-			if elem_a and elem_t:
-				release_name = elem_a.get_text()
-				if elem_t.get_text() == "Directory" and release_name != "Parent Directory" and release_name != "mono" and release_name != "fixup":
-					releases[release_name] = {
-						"link": elem_a.get('href'),
-						"last_modified": elem_m.get_text(),
-						#"downloads": {}
-					}
-
-					#file_suffix_map_reverse = GodotSystemArch.get_file_suffix_map_reverse()
-					#for sys_arch in file_suffix_map_reverse:
-					#	releases[release_name]['downloads'][sys_arch.name] = sys_arch.get_formatted_binary_name(version, release_name) + ".zip"
+		stable   = { "link": "", "last_modified": "", "arches": [] }
+		def on_row(row):
+			if row.type == "Directory" and row.name not in self.ignored_release_dirs:
+				releases[row.name] = {
+					"link": row.href,
+					"last_modified": row.mtime,
+				}
+			elif row.name.startswith(stable_prefix) and row.name.endswith(".zip") and row.name[len(stable_prefix):-len(".zip")] in file_suffixes:
+				stable["arches"].append(row.name[len(stable_prefix):-len(".zip")])
+				stable["last_modified"] = row.mtime
+
+		# With the trailing slash, or the server answers with a redirect to it first
+		parser = GodotDirListingParser(on_row)
+		if self.__fetch(base_url + version + "/", conditional, parser.feed, parser.set_headers) == None:
+			return None
+		parser.close()
+
+		if stable["arches"]:
+			stable["arches"].sort()
+			releases["stable"] = stable
 
 		return releases
 
-	def cache_nightly_manifest(self, save_cache=False):
-		'''Caches latest nightly commit hash to disk
+	def cache_nightly_manifest(self, save_cache=False, previous_nightly=None):
+		'''Caches latest nightly commit hash to disk. If `previous_nightly` is given
+		the manifest is fetched conditionally and kept as is when unchanged.
 		'''
-		f = urllib.request.urlopen(self.godot_toolkit_config.get("godot_nightly", "manifest_url"))
-		manifest = json.loads(f.read())
+		response = self.__fetch(self.godot_toolkit_config.get("godot_nightly", "manifest_url"), conditional=previous_nightly != None)
+		if response == None:
+			self.__cache['versions']['nightly'] = previous_nightly
+			if save_cache == True:
+				self.save_changes_to_cache()
+			return
+
+		manifest = json.loads(response.body)
 		
 		self.__cache['versions']['nightly'] = {
 			"commit": manifest['commit'],
@@ -196,4 +448,12 @@ class GodotBinariesCache():
 		}
 
 		if save_cache == True:
-			self.save_changes_to_cache()
\ No newline at end of file
+			self.save_changes_to_cache()
+
+
+if __name__ == '__main__':
+	# Entry point of the background refresh started by refresh_in_background()
+	if sys.argv[1:] == ["--refresh"]:
+		print("[+] Background refresh started at " + datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%SZ"))
+		if not GodotBinariesCache(suppress_recache=True).recache(only_if_stale=True, blocking=False):
+			print("[+] Another process is refreshing the catalogue")
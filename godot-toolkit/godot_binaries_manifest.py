@@ -1,90 +1,253 @@
-import os, json, shutils
+import os, json, time, shutil, hashlib, datetime, threading
+from contextlib import contextmanager
 
 from godot_toolkit_config import GodotToolkitConfig
 from godot_sys_arch import GodotSystemArch
+from godot_file_lock import GodotFileLock
 
 
 class GodotBinariesManifest():
 	"""
 	"""
 
+	# Manifest kept loaded by the daemon for the commands it runs, see GodotDaemon
+	resident = None
+
 	def __init__(self):
 		self.__manifest = None
 
+		# (version, release, arch name) -> entry, plus reverse lookups by hash
+		self.__index            = {}
+		self.__by_sha256        = {}
+		self.__by_source_sha256 = {}
+		self.__bin_refs         = {}
+
+		# (version, release) -> export templates entry
+		self.__templates = {}
+
+		self.__batch_depth = 0
+		self.__dirty       = False
+
+		# Changes made by this process since the last save, replayed on top of
+		# whatever other processes have written in the meantime.
+		self.__pending = []
+
+		# Guards the structures above when several threads install at once
+		self.__thread_lock = threading.RLock()
+
 		self.godot_toolkit_config = GodotToolkitConfig()
 		self.binaries_dir         = self.godot_toolkit_config.get_adjusted_path("godot_cli", "godot_binaries_path")
 		self.manifest_path        = os.path.join(self.binaries_dir, "manifest.json")
+		self.compact              = str(self.godot_toolkit_config.get("godot_cli", "manifest_compact")).lower() in ("1", "true", "yes")
+		self.blob_gc_grace_period = float(self.godot_toolkit_config.get("godot_cli", "blob_gc_grace_period"))
+		self.lock_path            = self.manifest_path + ".lock"
 
 		if not os.path.exists(self.binaries_dir):
 			os.makedirs(self.binaries_dir)
 
-		# Construct manifest file that holds references to each downloaded binary file
+		# Construct manifest file that holds references to each downloaded binary
+		# file, under the lock so it can't replace one another process just saved
 		if not os.path.exists(self.manifest_path):
-			with open(self.manifest_path, 'w') as f:
-				f.write("{}")
+			with GodotFileLock(self.lock_path):
+				if not os.path.exists(self.manifest_path):
+					tmp_path = "{path}.{pid}.tmp".format(path=self.manifest_path, pid=os.getpid())
+					with open(tmp_path, 'w') as f:
+						f.write("{}")
+
+					os.replace(tmp_path, self.manifest_path)
 
 		self.load_manifest()
 
 	def load_manifest(self):
-		'''Loads the manifest file contents into structured memory.
+		'''Loads the manifest file contents into structured memory. Changes that
+		haven't been saved yet are kept.
 		'''
-		with open(self.manifest_path, 'r') as f:
-			self.__manifest = json.load(f)
+		with self.__thread_lock:
+			with open(self.manifest_path, 'r') as f:
+				self.__manifest = json.load(f)
+
+			for key_path, entry, previous_bin in self.__pending:
+				parent = self.__manifest
+				for key in key_path[:-1]:
+					parent = parent.setdefault(key, {})
+				parent[key_path[-1]] = entry
+
+			self.__rebuild_index()
 
 	def save_manifest(self):
-		with open(self.manifest_path, 'w') as f:
-			json.dump(self.__manifest, f, indent=4)
+		'''Persists the manifest. The new contents are written to a temporary file
+		which then atomically replaces manifest.json, so a crash mid-write leaves
+		either the old or the new manifest, never a torn one. Inside a batch() the
+		write is deferred until the outermost batch ends.
+		'''
+		with self.__thread_lock:
+			if self.__batch_depth > 0:
+				self.__dirty = True
+				return
+
+			# Other processes may have saved since we loaded, merge our changes into
+			# their latest version while holding the lock so nobody's entries get lost.
+			with GodotFileLock(self.lock_path):
+				self.load_manifest()
+
+				# Blobs replaced by our changes, and those a previous save had to leave
+				# alone, are collected against everybody's references. Recent ones are
+				# remembered in the manifest for a later save to collect.
+				candidates = set(self.__manifest.pop('unreferenced_blobs', []))
+				candidates.update(previous_bin for key_path, entry, previous_bin in self.__pending if previous_bin and previous_bin != entry["bin"])
+				unreferenced = [path for path in candidates if not path in self.__bin_refs]
+				recent       = sorted(path for path in unreferenced if self.__is_recent(path))
+				if recent:
+					self.__manifest['unreferenced_blobs'] = recent
+
+				tmp_path = "{path}.{pid}.tmp".format(path=self.manifest_path, pid=os.getpid())
+				with open(tmp_path, 'w') as f:
+					if self.compact:
+						json.dump(self.__manifest, f, separators=(",", ":"))
+					else:
+						json.dump(self.__manifest, f, indent=4)
+					f.flush()
+					os.fsync(f.fileno())
+
+				os.replace(tmp_path, self.manifest_path)
+
+				self.__pending = []
+				for binary_relative_path in unreferenced:
+					if not binary_relative_path in recent:
+						self.__remove_binary_file(binary_relative_path)
+
+			self.__dirty = False
+
+	@contextmanager
+	def batch(self):
+		'''Groups several manifest changes into a single write, e.g. for bulk installs.
+
+			with manifest.batch():
+				manifest.add_installed_binary(...)
+				manifest.add_installed_binary(...)
+		'''
+		with self.__thread_lock:
+			self.__batch_depth += 1
+		try:
+			yield self
+		finally:
+			with self.__thread_lock:
+				self.__batch_depth -= 1
+				if self.__batch_depth == 0 and self.__dirty:
+					self.save_manifest()
+
+	def blob_relative_path(self, sha256, extension=""):
+		'''Binaries are stored by content under blobs/<first two hex digits>/<sha256>,
+		keeping the extension the OS needs to run them.
+		'''
+		return "/".join(["blobs", sha256[:2], sha256 + extension])
+
+	def has_blob(self, sha256, extension=""):
+		return os.path.isfile(os.path.join(self.binaries_dir, self.blob_relative_path(sha256, extension)))
+
+	def add_blob(self, file_path, sha256, extension=""):
+		'''Moves `file_path` into the blob store under its hash and returns the blob's
+		path relative to the binaries directory. If an identical blob is already
+		stored the file is dropped instead.
+
+		The blob isn't referenced by the saved manifest until the entry using it
+		is saved, so it's stamped with the current time under the manifest lock:
+		other processes collecting unreferenced blobs leave it alone for
+		`blob_gc_grace_period` seconds.
+		'''
+		blob_relative_path = self.blob_relative_path(sha256, extension)
+		blob_path = os.path.join(self.binaries_dir, blob_relative_path)
+
+		with GodotFileLock(self.lock_path):
+			if os.path.isfile(blob_path):
+				os.remove(file_path)
+			else:
+				os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+				os.replace(file_path, blob_path)
+
+			os.utime(blob_path)
+
+		return blob_relative_path
 
 	def add_binary(self, version, release, sys_arch: GodotSystemArch, binary_path):
-		'''Adds a binary to the manifest. Copies the binary into location defined by the config.
+		'''Adds a binary to the manifest. Copies the binary into the blob store, hashing
+		it on the way.
+		'''
+		binary_name = sys_arch.get_formatted_binary_name(version, release)
+		tmp_path    = os.path.join(self.binaries_dir, "{name}.{pid}.tmp".format(name=binary_name, pid=os.getpid()))
+
+		if not os.path.exists(binary_path):
+			return False
+
+		hasher = hashlib.sha256()
+		with open(binary_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+			for data in iter(lambda: src.read(1024*1024), b""):
+				hasher.update(data)
+				dst.write(data)
+		shutil.copymode(binary_path, tmp_path)
+
+		sha256 = hasher.hexdigest()
+		blob_relative_path = self.add_blob(tmp_path, sha256, self.binary_extension(binary_name))
+
+		return self.add_installed_binary(version, release, sys_arch, blob_relative_path, sha256=sha256)
+
+	def add_installed_binary(self, version, release, sys_arch: GodotSystemArch, binary_relative_path, sha256=None, source_sha256=None):
+		'''Adds a binary that already sits in the binaries directory to the manifest,
+		replacing whatever was registered for the same version, release and arch.
 		'''
-		new_binary_name = sys_arch.get_formatted_binary_name(version, release)
-		binary_dest_path = os.path.join(self.binaries_dir, new_binary_name)
+		with self.__thread_lock:
+			binary_dest_path = os.path.join(self.binaries_dir, binary_relative_path)
 
-		# Move the binary to the right location
-		if os.path.exists(binary_path):
-			shutils.copyfile(binary_path, binary_dest_path)
+			if os.path.exists(binary_dest_path):
+				if not 'versions' in self.__manifest:
+					self.__manifest['versions'] = {}
 
-		# If successfully moved then add it to the manifest
-		if os.path.exists(binary_dest_path):
-			if not 'versions' in self.__manifest:
-				self.__manifest['versions'] = {}
+				if not version in self.__manifest['versions']:
+					self.__manifest['versions'][version] = {}
 
-			if not version in self.__manifest['versions']:
-				self.__manifest['versions'][version] = {}
+				if not release in self.__manifest['versions'][version]:
+					self.__manifest['versions'][version][release] = {}
 
-			if not release in self.__manifest['versions'][version]:
-				self.__manifest['versions'][version][release] = {}
+				previous = self.__manifest['versions'][version][release].get(sys_arch.name)
+				if previous:
+					self.__unindex_entry(previous)
 
-			if not sys_arch.name in self.__manifest['versions'][version][release]:
-				self.__manifest['versions'][version][release][sys_arch.name] = {
-					"added_timestamp": "",
-					"bin": new_binary_name
+				entry = {
+					"added_timestamp": datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%MZ"),
+					"bin":             binary_relative_path,
+					"sha256":          sha256,
+					"source_sha256":   source_sha256,
+					"size":            os.path.getsize(binary_dest_path),
 				}
+				self.__manifest['versions'][version][release][sys_arch.name] = entry
+				self.__index_entry(version, release, sys_arch.name, entry)
 
-		self.save_manifest()
+				self.__pending.append((('versions', version, release, sys_arch.name), entry, previous.get("bin") if previous else None))
 
-		return True
+			self.save_manifest()
+
+			return True
 
 	def remove_binary(self, version, release, system_arch: GodotSystemArch):
 		pass
 
-	def get_binary_path(self, version, release, sys_arch: GodotSystemArch):
-		self.__verify_sys_arch(system_arch)
+	def find_binary_by_sha256(self, sha256=None, source_sha256=None):
+		'''Returns the first manifest entry whose binary or source archive has the given
+		hash, or None.
+		'''
+		if sha256 and sha256 in self.__by_sha256:
+			return self.__by_sha256[sha256]
+		if source_sha256 and source_sha256 in self.__by_source_sha256:
+			return self.__by_source_sha256[source_sha256]
 
-		if version == "latest":
-			raise Exception("Cannot request \"latest\" as version from manifest")
+		return None
 
-		binary_filename = None
-		if 'versions' in self.__manifest \
-			and version in self.__manifest['versions'] \
-			and release in self.__manifest['versions'][version] \
-			and system_arch.name in self.__manifest['versions'][version][release]:
-			binary_filename = self.__manifest['versions'][version][release][system_arch.name]
+	def get_binary_path(self, version, release, system_arch: GodotSystemArch):
+		bin_info = self.get_binary_info(version, release, system_arch)
 
 		# Combine binary filename into a full path
-		if binary_filename:
-			binary_path = os.path.join(self.binaries_dir, binary_filename)
+		if bin_info:
+			binary_path = os.path.join(self.binaries_dir, bin_info["bin"])
 			if os.path.exists(binary_path) and os.path.isfile(binary_path):
 				return binary_path
 
@@ -98,17 +261,125 @@ class GodotBinariesManifest():
 		if version == "latest":
 			raise Exception("Cannot request \"latest\" as version from manifest")
 
-		with open(self.manifest_path, 'r') as f:
-			manifest_json = json.load(f)
+		return self.__index.get((version, release, system_arch.name))
+
+	def add_installed_templates(self, version, release, templates_relative_path, sha256, members):
+		'''Registers the export templates archive (.tpz) of a version and release
+		that already sits in the binaries directory. `members` maps the names of
+		the files in the archive to their uncompressed sizes, so the templates a
+		version ships can be looked up without opening the archive.
+		'''
+		with self.__thread_lock:
+			templates_path = os.path.join(self.binaries_dir, templates_relative_path)
+			if not os.path.exists(templates_path):
+				return False
+
+			previous = self.__templates.get((version, release))
+			if previous:
+				self.__unindex_templates(previous)
+
+			entry = {
+				"added_timestamp": datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%MZ"),
+				"bin":             templates_relative_path,
+				"sha256":          sha256,
+				"size":            os.path.getsize(templates_path),
+				"members":         members,
+			}
+			self.__manifest.setdefault('templates', {}).setdefault(version, {})[release] = entry
+			self.__index_templates(version, release, entry)
+
+			self.__pending.append((('templates', version, release), entry, previous.get("bin") if previous else None))
+
+			self.save_manifest()
+
+			return True
+
+	def get_templates_info(self, version, release):
+		'''The export templates entry of a version and release, None if they
+		aren't downloaded.
+		'''
+		if version == "latest":
+			raise Exception("Cannot request \"latest\" as version from manifest")
 
-			if 'versions' in manifest_json \
-			   and version in manifest_json['versions'] \
-			   and release in manifest_json['versions'][version] \
-			   and system_arch.name in manifest_json['versions'][version][release]:
-				return manifest_json['versions'][version][release][system_arch.name]
+		return self.__templates.get((version, release))
+
+	def get_templates_path(self, version, release):
+		templates_info = self.get_templates_info(version, release)
+
+		if templates_info:
+			templates_path = os.path.join(self.binaries_dir, templates_info["bin"])
+			if os.path.isfile(templates_path):
+				return templates_path
 
 		return None
 
+	@staticmethod
+	def binary_extension(binary_name):
+		return ".exe" if binary_name.endswith(".exe") else ""
+
+	def __rebuild_index(self):
+		self.__index            = {}
+		self.__by_sha256        = {}
+		self.__by_source_sha256 = {}
+		self.__bin_refs         = {}
+		self.__templates        = {}
+
+		for version, releases in self.__manifest.get('versions', {}).items():
+			for release, arches in releases.items():
+				for arch_name, entry in arches.items():
+					self.__index_entry(version, release, arch_name, entry)
+
+		for version, releases in self.__manifest.get('templates', {}).items():
+			for release, entry in releases.items():
+				self.__index_templates(version, release, entry)
+
+	def __index_entry(self, version, release, arch_name, entry):
+		self.__index[(version, release, arch_name)] = entry
+
+		if entry.get("sha256"):
+			self.__by_sha256.setdefault(entry["sha256"], entry)
+		if entry.get("source_sha256"):
+			self.__by_source_sha256.setdefault(entry["source_sha256"], entry)
+		self.__bin_refs[entry["bin"]] = self.__bin_refs.get(entry["bin"], 0) + 1
+
+	def __unindex_entry(self, entry):
+		for index, key in ((self.__by_sha256, "sha256"), (self.__by_source_sha256, "source_sha256")):
+			if index.get(entry.get(key)) is entry:
+				del index[entry[key]]
+
+				# Another entry with the same hash may still be around
+				for other in self.__index.values():
+					if other is not entry and other.get(key) == entry[key]:
+						index[entry[key]] = other
+						break
+
+		self.__bin_refs[entry["bin"]] -= 1
+		if self.__bin_refs[entry["bin"]] <= 0:
+			del self.__bin_refs[entry["bin"]]
+
+	def __index_templates(self, version, release, entry):
+		self.__templates[(version, release)] = entry
+		self.__bin_refs[entry["bin"]] = self.__bin_refs.get(entry["bin"], 0) + 1
+
+	def __unindex_templates(self, entry):
+		self.__bin_refs[entry["bin"]] -= 1
+		if self.__bin_refs[entry["bin"]] <= 0:
+			del self.__bin_refs[entry["bin"]]
+
+	def __is_recent(self, binary_relative_path):
+		'''Whether a binary was added within the grace period, in which case it may
+		belong to an entry another process hasn't saved yet.
+		'''
+		try:
+			return time.time() - os.path.getmtime(os.path.join(self.binaries_dir, binary_relative_path)) < self.blob_gc_grace_period
+		except FileNotFoundError:
+			return False
+
+	def __remove_binary_file(self, binary_relative_path):
+		binary_path = os.path.join(self.binaries_dir, binary_relative_path)
+		if os.path.isfile(binary_path):
+			os.remove(binary_path)
+
 	def __verify_sys_arch(self, sys_arch):
 		if not isinstance(sys_arch, GodotSystemArch):
 			raise Exception("system_arch argument is not of type {} but instead of type {}".format(GodotSystemArch.__name__, sys_arch.__class__.__name__))
\ No newline at end of file
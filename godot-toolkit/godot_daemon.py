@@ -0,0 +1,648 @@
+"""Resident process running godot-cli and godot-exporter commands.
+"""
+
+import os, sys, json, time, socket, signal
+
+from godot_toolkit_config import GodotToolkitConfig
+
+
+# The scripts behind the commands the daemon runs
+tools = {
+	"godot-cli":      "godot_manager.py",
+	"godot-exporter": "godot_exporter.py",
+}
+
+
+def exit_code(e):
+	'''The exit code a SystemExit stands for.
+	'''
+	if e.code == None:
+		return 0
+	if isinstance(e.code, int):
+		return e.code
+
+	print(e.code, file=sys.stderr)
+	return 1
+
+
+class GodotDaemonClient():
+	'''Runs commands in the daemon when it's running and in this process when
+	it isn't. This is all bin/godot-cli and bin/godot-exporter load before they
+	know which, so the daemon saves them the imports, the catalogue and the
+	manifest.
+
+	The command gets this process' stdin, stdout and stderr, passed over the
+	socket, and its working directory and environment. Ctrl-C is forwarded.
+	'''
+
+	no_daemon_env = "GODOT_TOOLKIT_NO_DAEMON"
+
+	def __init__(self, socket_path=None):
+		self.socket_path = socket_path or GodotToolkitConfig().get_adjusted_path("godot_daemon", "daemon_socket_path")
+
+	@staticmethod
+	def supported():
+		return hasattr(socket, "AF_UNIX") and hasattr(socket, "send_fds") and hasattr(os, "fork")
+
+	def connect(self):
+		'''A connection to the daemon, None if it isn't running.
+		'''
+		if not self.supported() or not os.path.exists(self.socket_path):
+			return None
+
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			sock.connect(self.socket_path)
+		except OSError:
+			sock.close()
+			return None
+
+		return sock
+
+	def request(self, message):
+		'''Sends a message without file descriptors (status, stop) and returns the
+		reply, None if the daemon isn't running.
+		'''
+		sock = self.connect()
+		if sock == None:
+			return None
+
+		with sock:
+			sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+			line = sock.makefile('r', encoding="utf-8").readline()
+
+		return json.loads(line) if line else None
+
+	def run(self, tool, argv):
+		'''Runs `tool` with `argv` and returns its exit code.
+		'''
+		code = None
+		if not os.environ.get(self.no_daemon_env):
+			code = self.run_in_daemon(tool, argv)
+
+		if code == None:
+			code = self.run_in_process(tool, argv)
+
+		return code
+
+	def run_in_daemon(self, tool, argv):
+		'''Returns the exit code, None if the daemon didn't take the command.
+		'''
+		sock = self.connect()
+		if sock == None:
+			return None
+
+		with sock:
+			sys.stdout.flush()
+			sys.stderr.flush()
+
+			message = { "op": "run", "tool": tool, "argv": list(argv), "cwd": os.getcwd(), "env": dict(os.environ) }
+			data    = json.dumps(message).encode("utf-8") + b"\n"
+			try:
+				sent = socket.send_fds(sock, [data], [sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()])
+				sock.sendall(data[sent:])
+			except (OSError, ValueError, AttributeError):
+				return None
+
+			reader = sock.makefile('r', encoding="utf-8")
+			while True:
+				try:
+					line = reader.readline()
+					break
+				except KeyboardInterrupt:
+					# The command gets the interrupt and cleans up before exiting
+					sock.sendall(json.dumps({ "op": "cancel" }).encode("utf-8") + b"\n")
+
+		if not line:
+			print("[-] Lost the connection to the daemon", file=sys.stderr)
+			return 1
+
+		reply = json.loads(line)
+		if "fallback" in reply:
+			print("[!] The daemon can't run this command ({reason}), running it here".format(reason=reply["fallback"]), file=sys.stderr)
+			return None
+
+		return reply["exit"]
+
+	@staticmethod
+	def run_in_process(tool, argv):
+		import runpy
+
+		script = os.path.join(os.path.dirname(os.path.realpath(__file__)), tools[tool])
+		sys.argv = [script] + list(argv)
+		try:
+			runpy.run_path(script, run_name="__main__")
+		except SystemExit as e:
+			return exit_code(e)
+
+		return 0
+
+
+class _Handshake():
+	'''A connection the daemon accepted and is reading the request line of.
+	'''
+
+	def __init__(self, deadline):
+		self.deadline = deadline
+		self.data     = b""
+		self.fds      = []
+
+
+class GodotDaemon():
+	'''Keeps what every command loads in memory: the modules, the catalogue
+	with its version index, the binaries manifest and the exporter plugins
+	that were used, and runs the commands GodotDaemonClient sends it in a
+	forked child of itself. Children start with all of it loaded, write to
+	the client's terminal directly and can't disturb the daemon or each
+	other. The daemon reloads the catalogue and the manifest when a command,
+	or anybody else, changed them.
+
+	Commands run with the daemon's configuration. A client with different
+	configuration overrides is told to run the command itself.
+	'''
+
+	# Listed in `godot-daemon --status`
+	ops = ("download", "resolve", "list", "export", "other")
+
+	# Seconds a client gets to send its request once connected
+	handshake_timeout = 5
+
+	def __init__(self, socket_path=None):
+		self.godot_toolkit_config = GodotToolkitConfig()
+		self.socket_path          = socket_path or self.godot_toolkit_config.get_adjusted_path("godot_daemon", "daemon_socket_path")
+
+		self.started = None
+		self.served  = { op: 0 for op in self.ops }
+
+		self.__listener = None
+		self.__selector = None
+		self.__wakeup   = None
+		self.__children   = {}
+		self.__handshakes = {}
+		self.__running    = False
+		self.__stamps   = {}
+
+		self.__overrides = json.loads(os.environ.get(GodotToolkitConfig.overrides_env, "{}"))
+
+	def preload(self):
+		'''Imports the commands and loads the catalogue and the manifest.
+		'''
+		import godot_manager, godot_exporter
+		from godot_binaries_manifest import GodotBinariesManifest
+		from godot_binaries_cache import GodotBinariesCache
+
+		GodotBinariesManifest.resident = GodotBinariesManifest()
+		GodotBinariesCache.resident    = GodotBinariesCache(suppress_recache=True)
+		self.__refresh()
+
+	@staticmethod
+	def classify(tool, argv):
+		if tool == "godot-exporter":
+			return "export"
+
+		for flags, op in ((("--download", "--batch", "--batch-file", "--download-templates"), "download"),
+		                  (("--resolve",), "resolve"),
+		                  (("--avail-versions", "--avail-releases"), "list")):
+			if any(arg.split("=", 1)[0] in flags for arg in argv):
+				return op
+
+		return "other"
+
+	def serve(self):
+		'''Runs the daemon until it's stopped. Returns False if another daemon is
+		running already.
+		'''
+		import selectors
+
+		if GodotDaemonClient(self.socket_path).request({ "op": "status" }) != None:
+			print("[-] A daemon is already running on " + self.socket_path)
+			return False
+
+		# Left behind by a daemon that didn't shut down cleanly
+		if os.path.exists(self.socket_path):
+			os.remove(self.socket_path)
+
+		if not os.path.isdir(os.path.dirname(self.socket_path)):
+			os.makedirs(os.path.dirname(self.socket_path))
+
+		self.preload()
+
+		self.__listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.__listener.bind(self.socket_path)
+		os.chmod(self.socket_path, 0o600)
+		self.__listener.listen(64)
+
+		self.__selector = selectors.DefaultSelector()
+		self.__selector.register(self.__listener, selectors.EVENT_READ)
+
+		# Signals wake the loop up through a pipe, a finished command is
+		# answered right away rather than at the next timeout
+		self.__wakeup = os.pipe()
+		for fd in self.__wakeup:
+			os.set_blocking(fd, False)
+		signal.set_wakeup_fd(self.__wakeup[1])
+		self.__selector.register(self.__wakeup[0], selectors.EVENT_READ)
+
+		signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+		signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+		signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+
+		self.started   = time.time()
+		self.__running = True
+		print("[+] Daemon {pid} listening on {path}".format(pid=os.getpid(), path=self.socket_path))
+		sys.stdout.flush()
+
+		# Single threaded, forking is only safe without other threads around
+		while self.__running or self.__children:
+			for key, events in self.__selector.select(timeout=0.5):
+				if key.fileobj is self.__listener:
+					if self.__running:
+						self.__accept()
+				elif key.fileobj == self.__wakeup[0]:
+					try:
+						while os.read(self.__wakeup[0], 512):
+							pass
+					except BlockingIOError:
+						pass
+				elif isinstance(key.data, _Handshake):
+					self.__read_handshake(key.fileobj, key.data)
+				else:
+					self.__read_client(key.fileobj, key.data)
+			self.__expire_handshakes()
+			self.__reap()
+
+		for conn in list(self.__handshakes):
+			self.__drop_handshake(conn)
+
+		self.__selector.close()
+		signal.set_wakeup_fd(-1)
+		for fd in self.__wakeup:
+			os.close(fd)
+		print("[+] Daemon stopped after {count} commands".format(count=sum(self.served.values())))
+		return True
+
+	def stop(self):
+		'''Stops taking commands, the daemon exits once the running ones finished.
+		'''
+		if not self.__running:
+			return
+
+		self.__running = False
+		self.__selector.unregister(self.__listener)
+		self.__listener.close()
+		if os.path.exists(self.socket_path):
+			os.remove(self.socket_path)
+
+	def status(self):
+		from godot_binaries_manifest import GodotBinariesManifest
+		from godot_binaries_cache import GodotBinariesCache
+
+		return {
+			"pid":       os.getpid(),
+			"socket":    self.socket_path,
+			"uptime":    time.time() - self.started,
+			"running":   len(self.__children),
+			"served":    self.served,
+			"catalogue": GodotBinariesCache.resident.get_cache().get("last_cache_datetime"),
+			"manifest":  GodotBinariesManifest.resident.manifest_path,
+		}
+
+	def __accept(self):
+		'''Takes a connection. Its request is read as it arrives, alongside
+		everybody else, so a slow client doesn't hold up the others.
+		'''
+		import selectors
+
+		try:
+			conn, address = self.__listener.accept()
+		except BlockingIOError:
+			return
+
+		conn.setblocking(False)
+		handshake = self.__handshakes[conn] = _Handshake(time.monotonic() + self.handshake_timeout)
+		self.__selector.register(conn, selectors.EVENT_READ, handshake)
+
+	def __read_handshake(self, conn, handshake):
+		try:
+			data, fds, flags, address = socket.recv_fds(conn, 64 * 1024, 3)
+		except BlockingIOError:
+			return
+		except OSError:
+			data, fds = b"", []
+
+		handshake.fds += fds
+		if not data:
+			self.__drop_handshake(conn)
+			return
+
+		handshake.data += data
+		if not handshake.data.endswith(b"\n"):
+			return
+
+		self.__selector.unregister(conn)
+		del self.__handshakes[conn]
+		conn.setblocking(True)
+		conn.settimeout(self.handshake_timeout)
+
+		try:
+			message = json.loads(handshake.data)
+		except ValueError:
+			for fd in handshake.fds:
+				os.close(fd)
+			conn.close()
+			return
+
+		self.__dispatch(conn, message, handshake.fds)
+
+	def __expire_handshakes(self):
+		now = time.monotonic()
+		for conn, handshake in list(self.__handshakes.items()):
+			if now > handshake.deadline:
+				self.__drop_handshake(conn)
+
+	def __drop_handshake(self, conn):
+		handshake = self.__handshakes.pop(conn)
+		for fd in handshake.fds:
+			os.close(fd)
+		self.__selector.unregister(conn)
+		conn.close()
+
+	def __dispatch(self, conn, message, fds):
+		op = message.get("op")
+		if op == "run":
+			reason = self.__refuse(message, fds)
+			if reason:
+				for fd in fds:
+					os.close(fd)
+				self.__reply(conn, { "fallback": reason })
+				conn.close()
+				return
+
+			self.__run(conn, message, fds)
+			return
+
+		if op == "status":
+			self.__reply(conn, self.status())
+		elif op == "stop":
+			self.__reply(conn, { "pid": os.getpid(), "running": len(self.__children) })
+			self.stop()
+		else:
+			self.__reply(conn, { "error": "unknown op {op}".format(op=op) })
+		conn.close()
+
+	def __refuse(self, message, fds):
+		'''Why the daemon can't run a command, None if it can.
+		'''
+		if message.get("tool") not in tools:
+			return "unknown command {tool}".format(tool=message.get("tool"))
+		if len(fds) != 3:
+			return "no terminal passed"
+		if json.loads(message["env"].get(GodotToolkitConfig.overrides_env, "{}")) != self.__overrides:
+			return "different configuration overrides"
+		if message["tool"] == "godot-cli" and "--serve" in message["argv"]:
+			return "the mirror runs for good"
+
+		return None
+
+	def __run(self, conn, message, fds):
+		import selectors
+
+		self.__refresh()
+		if message["tool"] == "godot-exporter":
+			self.__preload_plugins(message)
+
+		pid = os.fork()
+		if pid == 0:
+			self.__run_child(message, fds)
+
+		for fd in fds:
+			os.close(fd)
+
+		conn.setblocking(False)
+		self.__children[pid] = { "conn": conn, "op": self.classify(message["tool"], message["argv"]) }
+		self.__selector.register(conn, selectors.EVENT_READ, pid)
+
+	def __run_child(self, message, fds):
+		import traceback
+
+		code = 1
+		try:
+			signal.set_wakeup_fd(-1)
+			signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+			signal.signal(signal.SIGTERM, signal.SIG_DFL)
+			signal.signal(signal.SIGINT, signal.default_int_handler)
+
+			self.__selector.close()
+			for fd in self.__wakeup:
+				os.close(fd)
+			if self.__listener.fileno() != -1:
+				self.__listener.close()
+			for child in self.__children.values():
+				if child["conn"] != None:
+					child["conn"].close()
+			for conn, handshake in self.__handshakes.items():
+				conn.close()
+				for fd in handshake.fds:
+					os.close(fd)
+
+			# The client's terminal becomes this process' stdin, stdout and stderr
+			for target, fd in enumerate(fds):
+				os.dup2(fd, target)
+				os.close(fd)
+			sys.stdin  = open(0, 'r', closefd=False)
+			sys.stdout = open(1, 'w', buffering=1, encoding="utf-8", errors="replace", closefd=False)
+			sys.stderr = open(2, 'w', buffering=1, encoding="utf-8", errors="replace", closefd=False)
+
+			os.chdir(message["cwd"])
+			os.environ.clear()
+			os.environ.update(message["env"])
+
+			code = GodotDaemonClient.run_in_process(message["tool"], message["argv"])
+		except KeyboardInterrupt:
+			code = 130
+		except BaseException:
+			traceback.print_exc()
+		finally:
+			try:
+				sys.stdout.flush()
+				sys.stderr.flush()
+			finally:
+				os._exit(code)
+
+	def __preload_plugins(self, message):
+		'''Imports the exporter's plugins here so that the next export using them
+		finds them imported.
+		'''
+		from godot_exporter_plugins import GodotExporterPlugins
+
+		argv = message["argv"]
+		for i, arg in enumerate(argv):
+			path = None
+			if arg == "--plugin" and i + 1 < len(argv):
+				path = argv[i + 1]
+			elif arg.startswith("--plugin="):
+				path = arg[len("--plugin="):]
+
+			if path == None or not os.path.isfile(os.path.join(message["cwd"], path)):
+				continue
+
+			try:
+				GodotExporterPlugins.load_module(os.path.join(message["cwd"], path))
+			except Exception:
+				# The export reports it when it loads the plugin itself
+				pass
+
+	def __refresh(self):
+		'''Reloads the catalogue and the manifest if their files changed.
+		'''
+		from godot_binaries_manifest import GodotBinariesManifest
+		from godot_binaries_cache import GodotBinariesCache
+
+		manifest = GodotBinariesManifest.resident
+		cache    = GodotBinariesCache.resident
+
+		for path, load in ((manifest.manifest_path, manifest.load_manifest), (cache.cache_path, cache.load_cache)):
+			try:
+				stamp = os.stat(path).st_mtime_ns
+			except OSError:
+				continue
+
+			if self.__stamps.get(path) != stamp:
+				load()
+				self.__stamps[path] = stamp
+
+		# Built once here rather than in every command
+		cache.version_index
+
+	def __read_client(self, conn, pid):
+		try:
+			data = conn.recv(4096)
+		except BlockingIOError:
+			return
+		except OSError:
+			data = b""
+
+		# A cancel, or the client went away, interrupts the command
+		if not data or b"cancel" in data:
+			try:
+				os.kill(pid, signal.SIGINT)
+			except ProcessLookupError:
+				pass
+
+		if not data:
+			self.__selector.unregister(conn)
+			self.__children[pid]["conn"] = None
+			conn.close()
+
+	def __reap(self):
+		while self.__children:
+			try:
+				pid, status = os.waitpid(-1, os.WNOHANG)
+			except ChildProcessError:
+				return
+			if pid == 0:
+				return
+
+			child = self.__children.pop(pid, None)
+			if child == None:
+				continue
+
+			code = os.waitstatus_to_exitcode(status)
+			if code < 0:
+				code = 128 - code
+			self.served[child["op"]] += 1
+
+			conn = child["conn"]
+			if conn != None:
+				self.__selector.unregister(conn)
+				conn.setblocking(True)
+				try:
+					self.__reply(conn, { "exit": code })
+				except OSError:
+					pass
+				conn.close()
+
+	def __reply(self, conn, reply):
+		conn.sendall(json.dumps(reply).encode("utf-8") + b"\n")
+
+
+if __name__ == '__main__':
+	# What bin/godot-cli and bin/godot-exporter run, kept clear of argparse and
+	# everything else the daemon itself needs
+	if len(sys.argv) > 2 and sys.argv[1] == "--client":
+		sys.exit(GodotDaemonClient().run(sys.argv[2], sys.argv[3:]))
+
+	import argparse, subprocess
+	parser = argparse.ArgumentParser(prog='godot-daemon', description='Keeps the catalogue, the binaries manifest and exporter plugins loaded and runs godot-cli and godot-exporter commands for them.')
+	group = parser.add_mutually_exclusive_group(required=True)
+	group.add_argument('--start',      action='store_true', help='Start the daemon in the background.')
+	group.add_argument('--stop',       action='store_true', help='Stop the daemon once the commands it runs finished.')
+	group.add_argument('--status',     action='store_true', help='Print what the daemon is doing.')
+	group.add_argument('--foreground', action='store_true', help='Run the daemon in this terminal.')
+	parser.add_argument('--json',      action='store_true', help='Print --status as JSON.')
+	args = parser.parse_args()
+
+	if not GodotDaemonClient.supported():
+		print("[-] The daemon needs Unix domain sockets and fork(), commands run without it")
+		sys.exit(1)
+
+	client = GodotDaemonClient()
+
+	if args.foreground == True:
+		sys.exit(0 if GodotDaemon(client.socket_path).serve() else 1)
+
+	if args.start == True:
+		status = client.request({ "op": "status" })
+		if status != None:
+			print("[+] Daemon {pid} is already running".format(**status))
+			quit()
+
+		if not os.path.isdir(os.path.dirname(client.socket_path)):
+			os.makedirs(os.path.dirname(client.socket_path))
+
+		with open(client.socket_path + ".log", 'a') as log:
+			subprocess.Popen([sys.executable, os.path.realpath(__file__), "--foreground"],
+				stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, close_fds=True, start_new_session=True)
+
+		timeout    = GodotToolkitConfig().get_float("godot_daemon", "daemon_start_timeout", 10)
+		start_time = time.monotonic()
+		while status == None and time.monotonic() - start_time < timeout:
+			time.sleep(0.1)
+			status = client.request({ "op": "status" })
+
+		if status == None:
+			print("[-] The daemon didn't start, see " + client.socket_path + ".log")
+			sys.exit(1)
+		print("[+] Daemon {pid} listening on {socket}".format(**status))
+
+	if args.stop == True:
+		reply = client.request({ "op": "stop" })
+		if reply == None:
+			print("[+] The daemon isn't running")
+			quit()
+
+		if reply["running"]:
+			print("[+] Waiting for {running} commands to finish".format(**reply))
+		while True:
+			try:
+				os.kill(reply["pid"], 0)
+			except ProcessLookupError:
+				break
+			time.sleep(0.1)
+		print("[+] Daemon stopped")
+
+	if args.status == True:
+		status = client.request({ "op": "status" })
+		if status == None:
+			print("[+] The daemon isn't running")
+			sys.exit(1)
+
+		if args.json == True:
+			print(json.dumps(status, indent=4))
+			quit()
+
+		print("[+] Daemon {pid} on {socket}, up {uptime:.0f}s, {running} commands running".format(**status))
+		print(" ├── catalogue from {catalogue}".format(**status))
+		print(" ├── manifest {manifest}".format(**status))
+		for op in GodotDaemon.ops:
+			print((" └── " if op == GodotDaemon.ops[-1] else " ├── ") + "{op}: {count} served".format(op=op, count=status["served"][op]))
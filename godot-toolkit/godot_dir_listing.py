@@ -0,0 +1,145 @@
+"""Incremental parser for the directory listings served by the download mirror.
+"""
+
+import re, codecs, html
+from collections import namedtuple
+
+
+GodotDirListingRow = namedtuple("GodotDirListingRow", ["name", "href", "type", "mtime", "size"])
+
+
+class GodotDirListingParser():
+	'''Parses lighttpd (`<td class="n|m|s|t">`) and Apache (positional `<td>`) style
+	index pages. Bytes can be fed as they arrive off the socket, every complete
+	table row is turned into a GodotDirListingRow straight away and handed to
+	`on_row`, or kept in `rows` if no callback was given.
+
+	Bytes are decoded with the charset of the response, see set_content_type(),
+	or `encoding` when it's given. Listings without a charset are latin-1, the
+	HTTP default for text and what the mirror's pages declare.
+	'''
+
+	default_encoding = "iso-8859-1"
+
+	_row_end_re  = re.compile(r'</tr\s*>', re.IGNORECASE)
+	_cell_re     = re.compile(r'<td([^>]*)>(.*?)</td\s*>', re.IGNORECASE | re.DOTALL)
+	_class_re    = re.compile(r'class\s*=\s*["\']?([\w-]+)', re.IGNORECASE)
+	_anchor_re   = re.compile(r'<a\s[^>]*?href\s*=\s*["\']([^"\']*)["\'][^>]*>(.*?)</a\s*>', re.IGNORECASE | re.DOTALL)
+	_tag_re      = re.compile(r'<[^>]*>')
+	_charset_re  = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+
+	def __init__(self, on_row=None, encoding=None):
+		self.on_row   = on_row
+		self.rows     = []
+		self.encoding = encoding
+
+		self.__decoder = None
+		self.__buffer  = ""
+
+	def set_content_type(self, content_type):
+		'''Takes the encoding from the Content-Type of the response, call it before
+		the first bytes are fed. Unknown charsets fall back to latin-1.
+		'''
+		match = self._charset_re.search(content_type or "")
+		if match:
+			try:
+				self.encoding = codecs.lookup(match.group(1)).name
+			except LookupError:
+				self.encoding = None
+
+	def set_headers(self, headers):
+		'''set_content_type() for the headers of a GodotHttpResponse.
+		'''
+		self.set_content_type(headers.get("content-type"))
+
+	def __decode(self, data, final=False):
+		if self.__decoder == None:
+			self.__decoder = codecs.getincrementaldecoder(self.encoding or self.default_encoding)(errors="replace")
+
+		return self.__decoder.decode(data, final)
+
+	def feed(self, data):
+		'''Feeds a chunk of bytes (or text) into the parser.
+		'''
+		if isinstance(data, bytes):
+			data = self.__decode(data)
+
+		self.__buffer += data
+
+		start = 0
+		for match in self._row_end_re.finditer(self.__buffer):
+			self.__parse_row(self.__buffer[start:match.start()])
+			start = match.end()
+
+		if start:
+			self.__buffer = self.__buffer[start:]
+
+	def close(self):
+		'''Flushes whatever is left in the buffer and returns all rows that weren't
+		handed to a callback.
+		'''
+		self.feed(self.__decode(b"", final=True))
+
+		# Some listings don't bother closing their last row
+		if "<td" in self.__buffer.lower():
+			self.__parse_row(self.__buffer)
+		self.__buffer = ""
+
+		return self.rows
+
+	def __parse_row(self, chunk):
+		cells = self._cell_re.findall(chunk)
+		if not cells:
+			return
+
+		by_class = {}
+		for attrs, content in cells:
+			class_match = self._class_re.search(attrs)
+			if class_match:
+				by_class[class_match.group(1)] = content
+
+		if "n" in by_class:
+			row = self.__lighttpd_row(by_class)
+		else:
+			row = self.__apache_row([content for attrs, content in cells])
+
+		if row == None:
+			return
+
+		if self.on_row:
+			self.on_row(row)
+		else:
+			self.rows.append(row)
+
+	def __lighttpd_row(self, by_class):
+		anchor = self._anchor_re.search(by_class["n"])
+		if not anchor:
+			return None
+
+		return GodotDirListingRow(
+			name  = self.__text(anchor.group(2)),
+			href  = html.unescape(anchor.group(1)),
+			type  = self.__text(by_class.get("t", "")),
+			mtime = self.__text(by_class.get("m", "")),
+			size  = self.__text(by_class.get("s", "")))
+
+	def __apache_row(self, cells):
+		for i in range(len(cells)):
+			anchor = self._anchor_re.search(cells[i])
+			if anchor:
+				href  = html.unescape(anchor.group(1))
+				rest  = [self.__text(cell).strip() for cell in cells[i + 1:]]
+				mtime = rest[0] if len(rest) > 0 else ""
+				size  = rest[1] if len(rest) > 1 else ""
+
+				return GodotDirListingRow(
+					name  = self.__text(anchor.group(2)).rstrip("/"),
+					href  = href,
+					type  = "Directory" if href.endswith("/") else "",
+					mtime = mtime,
+					size  = size)
+
+		return None
+
+	def __text(self, fragment):
+		return html.unescape(self._tag_re.sub("", fragment))
\ No newline at end of file
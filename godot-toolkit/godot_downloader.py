@@ -0,0 +1,323 @@
+"""Resumable, optionally multi-connection file downloader.
+"""
+
+import os, json, time, threading, hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+	import requests
+except:
+	print("[-] requests Python module needs to be installed. Install it with `pip install requests`")
+	exit()
+
+
+class DownloadError(Exception):
+	pass
+
+
+class _RestartDownload(Exception):
+	'''Raised when the remote file changed under a partial download.
+	'''
+	pass
+
+
+class _OrderedHasher():
+	'''SHA-256 of a file that is being written in several segments at once. Bytes
+	of the segment at the hash cursor are hashed as they arrive, bytes that land
+	further ahead are picked up from disk once the cursor reaches them, which is
+	normally straight out of the page cache.
+	'''
+
+	def __init__(self, part_path, segments):
+		self.part_path = part_path
+		self.segments  = segments
+		self.hasher    = hashlib.sha256()
+		self.current   = 0
+		self.hashed    = 0
+
+		self.__catch_up()
+
+	def update(self, segment, data):
+		if self.current < len(self.segments) and segment is self.segments[self.current] \
+		   and self.hashed + len(data) == segment["done"]:
+			self.hasher.update(data)
+			self.hashed += len(data)
+
+		self.__catch_up()
+
+	def hexdigest(self):
+		self.__catch_up()
+		return self.hasher.hexdigest()
+
+	def __catch_up(self):
+		while self.current < len(self.segments):
+			segment = self.segments[self.current]
+			if self.hashed < segment["done"]:
+				with open(self.part_path, 'rb') as f:
+					f.seek(segment["start"] + self.hashed)
+					left = segment["done"] - self.hashed
+					while left > 0:
+						data = f.read(min(left, 1024*1024))
+						if not data:
+							break
+						self.hasher.update(data)
+						left -= len(data)
+				self.hashed = segment["done"] - left
+
+			if self.hashed < segment["end"] - segment["start"] + 1:
+				return
+
+			self.current += 1
+			self.hashed   = 0
+
+
+class GodotDownloader():
+	'''Downloads a URL to disk, always streaming so nothing is held in memory.
+
+	When the server honours `Range` requests the file is fetched into `<dest>.part`
+	in up to `connections` parallel segments. Progress of every segment is kept in
+	`<dest>.part.json` so an interrupted download picks up where it left off. Servers
+	without range support get a plain single connection download.
+	'''
+
+	# How often the progress in <dest>.part.json is written while segments
+	# download, an interrupted download fetches at most this much again
+	state_save_interval = 1.0
+
+	def __init__(self, connections=4, min_segment_size=8*1024*1024, chunk_size=1024*1024, timeout=60, retries=3):
+		self.connections      = max(1, connections)
+		self.min_segment_size = max(1, min_segment_size)
+		self.chunk_size       = chunk_size
+		self.timeout          = timeout
+		self.retries          = retries
+
+	def download(self, url, dest_path, progress=None, expected_sha256=None):
+		'''Downloads `url` into `dest_path`. `progress(downloaded, total)` is called
+		as data arrives, total is None when the size isn't known up front.
+
+		The SHA-256 of the file is computed while it downloads and, when
+		`expected_sha256` is given, checked before the file is moved into place.
+		Returns a dict with the `sha256`, `size` and bytes `fetched` over the
+		network during this call.
+		'''
+		part_path  = dest_path + ".part"
+		state_path = part_path + ".json"
+
+		for attempt in range(2):
+			session = requests.Session()
+			try:
+				probe = session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=self.timeout)
+				probe.raise_for_status()
+
+				total = self.__parse_content_range_total(probe)
+				if probe.status_code == 206 and total != None:
+					validator = probe.headers.get("etag") or probe.headers.get("last-modified")
+					probe.close()
+					fetched, sha256 = self.__download_ranged(url, part_path, state_path, total, validator, progress)
+				else:
+					# No usable range support. A 200 to the probe is the download,
+					# a partial answer that doesn't tell the size is asked again in full.
+					if probe.status_code != 200:
+						probe.close()
+						probe = session.get(url, stream=True, timeout=self.timeout)
+						probe.raise_for_status()
+						if probe.status_code != 200:
+							probe.close()
+							raise DownloadError("Unexpected HTTP {status} while downloading {url}".format(status=probe.status_code, url=url))
+					fetched, sha256 = self.__download_single(probe, part_path, progress)
+					self.__remove(state_path)
+			except _RestartDownload:
+				print("[!] Remote file changed during download, starting over")
+				self.__remove(part_path)
+				self.__remove(state_path)
+				continue
+			except requests.RequestException as e:
+				raise DownloadError("Failed to download {url}: {error}".format(url=url, error=e))
+			finally:
+				session.close()
+
+			if expected_sha256 and sha256 != expected_sha256.lower():
+				self.__remove(part_path)
+				raise DownloadError("Checksum mismatch for {url}: expected {expected}, got {actual}".format(url=url, expected=expected_sha256, actual=sha256))
+
+			os.replace(part_path, dest_path)
+			return {
+				"fetched": fetched,
+				"sha256":  sha256,
+				"size":    os.path.getsize(dest_path),
+			}
+
+		raise DownloadError("{url} keeps changing while being downloaded".format(url=url))
+
+	def __download_single(self, response, part_path, progress):
+		total = response.headers.get('content-length')
+		total = int(total) if total != None else None
+
+		downloaded = 0
+		hasher     = hashlib.sha256()
+		with open(part_path, 'wb') as f:
+			for data in response.iter_content(chunk_size=self.chunk_size):
+				f.write(data)
+				hasher.update(data)
+				downloaded += len(data)
+				if progress:
+					progress(downloaded, total)
+
+		response.close()
+
+		return downloaded, hasher.hexdigest()
+
+	def __download_ranged(self, url, part_path, state_path, total, validator, progress):
+		state = self.__load_state(state_path, part_path, total, validator)
+		if state == None:
+			state = {
+				"url":       url,
+				"total":     total,
+				"validator": validator,
+				"segments":  self.__plan_segments(total),
+			}
+
+			with open(part_path, 'wb') as f:
+				f.truncate(total)
+		else:
+			print("[+] Resuming partial download")
+
+		segments = state["segments"]
+		lock     = threading.Lock()
+
+		already_done = sum(segment["done"] for segment in segments)
+		counters     = { "downloaded": already_done, "saved": 0.0 }
+
+		def save_state():
+			with open(state_path + ".tmp", 'w') as f:
+				json.dump(state, f)
+			os.replace(state_path + ".tmp", state_path)
+			counters["saved"] = time.monotonic()
+
+		hasher = _OrderedHasher(part_path, segments)
+
+		def on_data(segment, data):
+			with lock:
+				segment["done"] += len(data)
+				counters["downloaded"] += len(data)
+				hasher.update(segment, data)
+				if time.monotonic() - counters["saved"] >= self.state_save_interval:
+					save_state()
+				if progress:
+					progress(counters["downloaded"], total)
+
+		pending = [segment for segment in segments if segment["done"] < segment["end"] - segment["start"] + 1]
+
+		with lock:
+			save_state()
+		if progress:
+			progress(already_done, total)
+
+		try:
+			if len(pending) > 1:
+				with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+					futures = [executor.submit(self.__fetch_segment, url, part_path, segment, validator, on_data) for segment in pending]
+					for future in futures:
+						future.result()
+			else:
+				for segment in pending:
+					self.__fetch_segment(url, part_path, segment, validator, on_data)
+		except BaseException:
+			# Keep everything that made it to disk for the next attempt
+			with lock:
+				if os.path.exists(part_path):
+					save_state()
+			raise
+
+		self.__remove(state_path)
+
+		return counters["downloaded"] - already_done, hasher.hexdigest()
+
+	def __fetch_segment(self, url, part_path, segment, validator, on_data):
+		session = requests.Session()
+		try:
+			last_error = None
+			for attempt in range(self.retries + 1):
+				if attempt > 0:
+					time.sleep(0.5 * (2 ** (attempt - 1)))
+
+				start = segment["start"] + segment["done"]
+				end   = segment["end"]
+				if start > end:
+					return
+
+				headers = { "Range": "bytes={start}-{end}".format(start=start, end=end) }
+				if validator:
+					headers["If-Range"] = validator
+
+				try:
+					with session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+						# A 200 to an If-Range request means the file changed, the
+						# bytes we already have are worthless.
+						if response.status_code == 200:
+							raise _RestartDownload()
+						response.raise_for_status()
+
+						with open(part_path, 'r+b') as f:
+							f.seek(start)
+							for data in response.iter_content(chunk_size=self.chunk_size):
+								if len(data) > end - start + 1:
+									data = data[:end - start + 1]
+								f.write(data)
+								# The hasher may read this range back through its own handle
+								f.flush()
+								start += len(data)
+								on_data(segment, data)
+								if start > end:
+									break
+
+					if start > end:
+						return
+				except requests.RequestException as e:
+					last_error = e
+
+			raise DownloadError("Segment {start}-{end} failed: {error}".format(start=segment["start"], end=segment["end"], error=last_error))
+		finally:
+			session.close()
+
+	def __plan_segments(self, total):
+		count = max(1, min(self.connections, total // self.min_segment_size))
+		size  = total // count
+
+		segments = []
+		for i in range(count):
+			start = i * size
+			end   = total - 1 if i == count - 1 else start + size - 1
+			segments.append({ "start": start, "end": end, "done": 0 })
+
+		return segments
+
+	def __load_state(self, state_path, part_path, total, validator):
+		if not os.path.isfile(state_path) or not os.path.isfile(part_path):
+			return None
+
+		try:
+			with open(state_path, 'r') as f:
+				state = json.load(f)
+		except ValueError:
+			return None
+
+		if state.get("total") != total or state.get("validator") != validator or os.path.getsize(part_path) != total:
+			return None
+
+		return state
+
+	def __parse_content_range_total(self, response):
+		content_range = response.headers.get("content-range", "")
+		if "/" not in content_range:
+			return None
+
+		total = content_range.rsplit("/", 1)[1].strip()
+		if not total.isdigit():
+			return None
+
+		return int(total)
+
+	def __remove(self, path):
+		if os.path.exists(path):
+			os.remove(path)
\ No newline at end of file
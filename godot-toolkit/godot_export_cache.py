@@ -0,0 +1,223 @@
+"""Cache of export artifacts keyed on everything that goes into an export.
+"""
+
+import os, json, time, shutil, hashlib, threading
+from godot_file_index import GodotFileIndex
+from godot_file_lock import GodotFileLock
+
+
+class GodotExportCache():
+	'''Stores the artifacts of finished exports under a key made of:
+
+	  * the content of every input file in the project
+	  * the resolved preset section, after the exporter and plugin changes
+	  * the Godot binary and the export template
+	  * the file name of the export, Godot picks the format from its extension
+
+	so an export whose inputs match a previous one can be restored instead of
+	running Godot again. File hashes go through a GodotFileIndex, only files whose
+	stat changed since the last export are read.
+
+	Every (project, preset, file name) also remembers the inputs of its latest
+	export, explain() compares against those to say why a lookup missed.
+	'''
+
+	ignored_dirs  = (".git", ".svn", ".hg", ".import", ".godot")
+	ignored_files = ("export_presets.cfg",)
+
+	def __init__(self, cache_path, hash_jobs=8, max_entries=20):
+		self.cache_path  = cache_path
+		self.max_entries = max_entries
+
+		self.file_index = GodotFileIndex(os.path.join(cache_path, "file_index.json"), jobs=hash_jobs)
+
+		self.__thread_lock = threading.Lock()
+
+	def fingerprint(self, project_path, preset_options, godot_bin_path, template_bin_path, export_dest, exclude_paths=()):
+		'''Collects and hashes the inputs of an export. Returns a dict with the
+		cache `key` and the `inputs` it was computed from.
+		'''
+		project_path  = os.path.realpath(project_path)
+		exclude_paths = [os.path.realpath(path) for path in exclude_paths]
+
+		paths = []
+		for root, dirs, files in os.walk(project_path):
+			dirs[:] = sorted(d for d in dirs if d not in self.ignored_dirs and os.path.join(root, d) not in exclude_paths)
+			for f in files:
+				path = os.path.join(root, f)
+				if root == project_path and f in self.ignored_files:
+					continue
+				if path in exclude_paths:
+					continue
+				paths.append(path)
+
+		tool_paths = [path for path in (godot_bin_path, template_bin_path) if path and os.path.isfile(path)]
+		hashes = self.file_index.hash_files(paths + tool_paths)
+		self.file_index.save()
+
+		inputs = {
+			"files":    { os.path.relpath(path, project_path).replace(os.sep, "/"): hashes[path] for path in paths },
+			"preset":   preset_options,
+			"godot":    hashes.get(godot_bin_path),
+			"template": hashes.get(template_bin_path),
+			"dest":     os.path.basename(export_dest),
+		}
+
+		hasher = hashlib.sha256()
+		hasher.update(json.dumps(inputs, sort_keys=True, separators=(',', ':')).encode("utf-8"))
+
+		return {
+			"key":     hasher.hexdigest(),
+			"inputs":  inputs,
+			"last_id": self.__last_id(project_path, inputs),
+		}
+
+	def lookup(self, fingerprint):
+		'''Returns the stored entry for a fingerprint, None on a miss.
+		'''
+		entry_path = os.path.join(self.__entry_dir(fingerprint["key"]), "entry.json")
+		if not os.path.isfile(entry_path):
+			return None
+
+		try:
+			with open(entry_path, 'r') as f:
+				entry = json.load(f)
+		except ValueError:
+			return None
+
+		for artifact in entry["artifacts"]:
+			if not os.path.isfile(os.path.join(self.__entry_dir(fingerprint["key"]), "artifacts", artifact)):
+				return None
+
+		return entry
+
+	def restore(self, entry, export_dest):
+		'''Copies the artifacts of a cache entry next to `export_dest`.
+		'''
+		artifacts_dir = os.path.join(self.__entry_dir(entry["key"]), "artifacts")
+		dest_dir      = os.path.dirname(os.path.realpath(export_dest))
+		if not os.path.isdir(dest_dir):
+			os.makedirs(dest_dir)
+
+		for artifact in entry["artifacts"]:
+			dest_path = os.path.join(dest_dir, artifact)
+			tmp_path  = dest_path + ".tmp"
+			shutil.copy2(os.path.join(artifacts_dir, artifact), tmp_path)
+			os.replace(tmp_path, dest_path)
+
+	def store(self, fingerprint, artifact_paths, processed_files, godot_errors):
+		'''Saves the artifacts of a finished export under its fingerprint.
+		'''
+		key       = fingerprint["key"]
+		entry_dir = self.__entry_dir(key)
+
+		with GodotFileLock(os.path.join(self.cache_path, "entries.lock")):
+			tmp_dir = entry_dir + ".{pid}.{thread}.tmp".format(pid=os.getpid(), thread=threading.get_ident())
+			if os.path.isdir(tmp_dir):
+				shutil.rmtree(tmp_dir)
+			os.makedirs(os.path.join(tmp_dir, "artifacts"))
+
+			for path in artifact_paths:
+				shutil.copy2(path, os.path.join(tmp_dir, "artifacts", os.path.basename(path)))
+
+			entry = {
+				"key":             key,
+				"created":         time.time(),
+				"artifacts":       [os.path.basename(path) for path in artifact_paths],
+				"processed_files": processed_files,
+				"godot_errors":    godot_errors,
+				"inputs":          fingerprint["inputs"],
+			}
+			with open(os.path.join(tmp_dir, "entry.json"), 'w') as f:
+				json.dump(entry, f)
+
+			if os.path.isdir(entry_dir):
+				shutil.rmtree(entry_dir)
+			os.replace(tmp_dir, entry_dir)
+
+			self.__write_last(fingerprint["last_id"], key)
+			self.__prune()
+
+		return entry
+
+	def explain(self, fingerprint):
+		'''Lists the reasons a fingerprint differs from the latest export of the
+		same project, preset and file name.
+		'''
+		last_key = self.__read_last(fingerprint["last_id"])
+		if last_key == None:
+			return ["no previous export of this preset in the cache"]
+
+		if last_key == fingerprint["key"]:
+			return ["cache entry is missing or incomplete"]
+
+		last_entry = self.lookup({ "key": last_key })
+		if last_entry == None:
+			return ["previous export was evicted from the cache"]
+
+		old = last_entry["inputs"]
+		new = fingerprint["inputs"]
+
+		reasons = []
+		if old["godot"] != new["godot"]:
+			reasons.append("Godot binary changed")
+		if old["template"] != new["template"]:
+			reasons.append("export template changed")
+
+		old_preset = old["preset"]
+		new_preset = new["preset"]
+		for option in sorted(set(old_preset) | set(new_preset)):
+			if old_preset.get(option) != new_preset.get(option):
+				reasons.append("preset option {option}: {old} -> {new}".format(option=option, old=old_preset.get(option), new=new_preset.get(option)))
+
+		old_files = old["files"]
+		new_files = new["files"]
+		for path in sorted(set(old_files) | set(new_files)):
+			if path not in old_files:
+				reasons.append("added " + path)
+			elif path not in new_files:
+				reasons.append("removed " + path)
+			elif old_files[path] != new_files[path]:
+				reasons.append("modified " + path)
+
+		return reasons or ["inputs match but the cache key changed"]
+
+	def __entry_dir(self, key):
+		return os.path.join(self.cache_path, "entries", key)
+
+	def __last_id(self, project_path, inputs):
+		preset_name = inputs["preset"].get("name", "")
+		return hashlib.sha256("\0".join([project_path, preset_name, inputs["dest"]]).encode("utf-8")).hexdigest()
+
+	def __read_last(self, last_id):
+		last_path = os.path.join(self.cache_path, "last", last_id)
+		if not os.path.isfile(last_path):
+			return None
+
+		with open(last_path, 'r') as f:
+			return f.read().strip()
+
+	def __write_last(self, last_id, key):
+		last_dir = os.path.join(self.cache_path, "last")
+		if not os.path.isdir(last_dir):
+			os.makedirs(last_dir)
+
+		tmp_path = os.path.join(last_dir, last_id + ".tmp")
+		with open(tmp_path, 'w') as f:
+			f.write(key)
+		os.replace(tmp_path, os.path.join(last_dir, last_id))
+
+	def __prune(self):
+		'''Evicts the oldest entries beyond `max_entries`.
+		'''
+		entries_dir = os.path.join(self.cache_path, "entries")
+		entries = []
+		for name in os.listdir(entries_dir):
+			entry_path = os.path.join(entries_dir, name, "entry.json")
+			if name.endswith(".tmp") or not os.path.isfile(entry_path):
+				continue
+			entries.append((os.path.getmtime(entry_path), name))
+
+		entries.sort(reverse=True)
+		for mtime, name in entries[self.max_entries:]:
+			shutil.rmtree(os.path.join(entries_dir, name), ignore_errors=True)
@@ -0,0 +1,270 @@
+"""Streaming parser of the output of a Godot export.
+"""
+
+import os, re, sqlite3, threading
+from collections.abc import Sequence
+
+
+class GodotPackedFiles(Sequence):
+	'''Insertion ordered set of the files Godot stored in the pack. Lives in
+	memory, or in an SQLite table at `db_path` so that huge projects don't keep
+	every path in memory. Membership tests are indexed lookups either way:
+
+		if "res://version.json" not in exporter.processed_files:
+			...
+
+	It reads like the list processed_files used to be: files come in the order
+	they were packed, and indexing, slicing and comparing with a list work.
+	'''
+
+	fetch_size = 1000
+
+	def __init__(self, db_path=None):
+		self.db_path = db_path
+
+		self.__files = [] if db_path == None else None
+		self.__known = set()
+		self.__count = 0
+		self.__db    = None
+		self.__lock  = threading.Lock()
+
+		if db_path != None:
+			if os.path.exists(db_path):
+				os.remove(db_path)
+
+			# Nothing has to survive a crash, skip the journal and the fsyncs. The
+			# rowid keeps the order files were stored in.
+			self.__db = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+			self.__db.execute("PRAGMA journal_mode=OFF")
+			self.__db.execute("PRAGMA synchronous=OFF")
+			self.__db.execute("CREATE TABLE files (path TEXT PRIMARY KEY)")
+			self.__db.execute("BEGIN")
+
+	def add(self, path):
+		if self.__db == None:
+			if path not in self.__known:
+				self.__known.add(path)
+				self.__files.append(path)
+				self.__count += 1
+			return
+
+		# Rowids count up from 1 in the order files were added, so they double as
+		# list indices
+		with self.__lock:
+			if self.__db.execute("INSERT OR IGNORE INTO files (rowid, path) VALUES (?, ?)", (self.__count + 1, path)).rowcount == 1:
+				self.__count += 1
+
+	def update(self, paths):
+		for path in paths:
+			self.add(path)
+
+	def flush(self):
+		'''Commits what was added so far when the set lives on disk.
+		'''
+		with self.__lock:
+			if self.__db != None:
+				self.__db.execute("COMMIT")
+				self.__db.execute("BEGIN")
+
+	def __contains__(self, path):
+		if self.__db == None:
+			return path in self.__known
+
+		with self.__lock:
+			return self.__db.execute("SELECT 1 FROM files WHERE path = ?", (path,)).fetchone() != None
+
+	def __len__(self):
+		return self.__count
+
+	def __iter__(self):
+		if self.__db == None:
+			return iter(list(self.__files))
+
+		return self.__iter_db()
+
+	def __getitem__(self, index):
+		if self.__db == None:
+			return self.__files[index]
+
+		if isinstance(index, slice):
+			indices = range(*index.indices(self.__count))
+			if not indices:
+				return []
+
+			first = min(indices)
+			with self.__lock:
+				rows = self.__db.execute("SELECT path FROM files WHERE rowid > ? AND rowid <= ? ORDER BY rowid", (first, max(indices) + 1)).fetchall()
+			return [rows[i - first][0] for i in indices]
+
+		if index < 0:
+			index += self.__count
+		if index < 0 or index >= self.__count:
+			raise IndexError("packed file index out of range")
+
+		with self.__lock:
+			return self.__db.execute("SELECT path FROM files WHERE rowid = ?", (index + 1,)).fetchone()[0]
+
+	def __eq__(self, other):
+		if isinstance(other, (GodotPackedFiles, list, tuple)):
+			return len(self) == len(other) and list(self) == list(other)
+
+		return NotImplemented
+
+	def __repr__(self):
+		return "GodotPackedFiles({files!r})".format(files=list(self))
+
+	def __iter_db(self):
+		last_rowid = 0
+		while True:
+			with self.__lock:
+				rows = self.__db.execute("SELECT rowid, path FROM files WHERE rowid > ? ORDER BY rowid LIMIT ?", (last_rowid, self.fetch_size)).fetchall()
+			if not rows:
+				return
+
+			for rowid, path in rows:
+				yield path
+			last_rowid = rows[-1][0]
+
+
+class GodotExportLog():
+	'''Classifies the lines of `godot --export` as they arrive:
+
+	  * savepack: a file stored in the pack, added to `files`
+	  * error / warning: ERROR: and WARNING: messages
+	  * import: a step of the (re)import that runs before packing
+	  * other: anything else
+
+	and keeps track of the export's phase and step so `on_progress(log)` can draw
+	a progress bar. It is called whenever the phase or step changes.
+
+	Only the first `max_messages` errors and warnings are kept, the rest are
+	counted. Given a `spill_dir` the full output is written to godot.log in it
+	and the packed files go to files.db instead of memory.
+	'''
+
+	SAVEPACK = "savepack"
+	ERROR    = "error"
+	WARNING  = "warning"
+	IMPORT   = "import"
+	OTHER    = "other"
+
+	# Greedy [^\r]+ rather than a lazy (.+?)\r?$, which tries to end the match
+	# at every character of the path
+	savepack_re       = re.compile(r'savepack: step (\d+): Storing File: ([^\r]+)')
+	savepack_begin_re = re.compile(r'savepack: begin: [^\r]*?(\d+)\r?$')
+	import_re         = re.compile(r'reimport: step (\d+): ([^\r]+)')
+	import_begin_re   = re.compile(r'reimport: begin: [^\r]*?(\d+)\r?$')
+	error_re          = re.compile(r'ERROR: ([^\r]+)')
+	warning_re        = re.compile(r'WARNING: ([^\r]+)')
+
+	def __init__(self, spill_dir=None, max_messages=1000, on_progress=None):
+		self.spill_dir    = spill_dir
+		self.max_messages = max_messages
+		self.on_progress  = on_progress
+
+		self.log_path = None
+		self.__log    = None
+		if spill_dir != None:
+			if not os.path.isdir(spill_dir):
+				os.makedirs(spill_dir)
+			self.log_path = os.path.join(spill_dir, "godot.log")
+			self.__log    = open(self.log_path, 'w', encoding="utf-8")
+
+		self.files    = GodotPackedFiles(os.path.join(spill_dir, "files.db") if spill_dir != None else None)
+		self.errors   = []
+		self.warnings = []
+
+		self.lines         = 0
+		self.error_count   = 0
+		self.warning_count = 0
+		self.import_count  = 0
+
+		# startup, import, pack, done
+		self.phase = "startup"
+		self.step  = 0
+		self.steps = 0
+
+	def feed(self, stream_name, line):
+		'''Parses one line of output. Returns its kind and the file, message or
+		imported resource it carried (None for other lines).
+		'''
+		self.lines += 1
+		if self.__log:
+			self.__log.write(line + "\n")
+
+		# Cheap substring checks pick the one regex worth running, most lines
+		# are stored files or noise
+		if "savepack: " in line:
+			match = self.savepack_re.search(line)
+			if match:
+				self.files.add(match.group(2))
+				step = int(match.group(1))
+				if step != self.step or self.phase != "pack":
+					self.__progress("pack", step)
+				return self.SAVEPACK, match.group(2)
+
+			match = self.savepack_begin_re.search(line)
+			if match:
+				self.steps = int(match.group(1))
+				self.__progress("pack", 0)
+			elif "savepack: end" in line:
+				self.__progress("done", self.steps)
+			return self.OTHER, None
+
+		if "ERROR: " in line:
+			match = self.error_re.search(line)
+			if match:
+				self.error_count += 1
+				if len(self.errors) < self.max_messages:
+					self.errors.append(match.group(1))
+				return self.ERROR, match.group(1)
+
+		if "WARNING: " in line:
+			match = self.warning_re.search(line)
+			if match:
+				self.warning_count += 1
+				if len(self.warnings) < self.max_messages:
+					self.warnings.append(match.group(1))
+				return self.WARNING, match.group(1)
+
+		if "reimport: " in line:
+			match = self.import_re.search(line)
+			if match:
+				self.import_count += 1
+				self.__progress("import", int(match.group(1)))
+				return self.IMPORT, match.group(2)
+
+			match = self.import_begin_re.search(line)
+			if match:
+				self.steps = int(match.group(1))
+				self.__progress("import", 0)
+				return self.IMPORT, None
+
+		return self.OTHER, None
+
+	def restore(self, files, errors):
+		'''Fills the log from a previous export, e.g. one restored from the cache.
+		'''
+		self.files.update(files)
+		for error in errors:
+			self.error_count += 1
+			if len(self.errors) < self.max_messages:
+				self.errors.append(error)
+		self.phase = "done"
+
+	def finish(self):
+		'''Flushes whatever was spilled to disk once Godot is done.
+		'''
+		self.files.flush()
+		if self.__log:
+			self.__log.close()
+			self.__log = None
+
+	def __progress(self, phase, step):
+		if phase == self.phase and step == self.step:
+			return
+
+		self.phase = phase
+		self.step  = step
+		if self.on_progress:
+			self.on_progress(self)
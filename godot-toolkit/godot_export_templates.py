@@ -0,0 +1,134 @@
+"""Export templates read straight out of the downloaded .tpz archives.
+"""
+
+import os, stat, shutil, threading
+from godot_toolkit_config import GodotToolkitConfig
+from godot_file_lock import GodotFileLock
+
+
+class TemplateNotFound(Exception):
+	pass
+
+
+class GodotExportTemplates():
+	'''The export templates of the versions godot-cli downloaded them for. The
+	.tpz archives stay in the binaries store as they were downloaded, asking
+	for a template reads the archive's central directory and decompresses that
+	one member into templates/<archive sha256>/ next to them, where every later
+	export finds it. Within a process a template that was found once is
+	answered from memory, so exporting several presets, or the same preset
+	again, doesn't touch the disk.
+
+		templates = GodotExportTemplates()
+		path = templates.find("3.2", "stable", "linux_x11_64_release")
+	'''
+
+	members_dir = "templates"
+
+	# Template of the release build for the platform of an export preset, {bits}
+	# is 64 or 32 depending on binary_format/64_bits
+	platform_templates = {
+		"Linux/X11":       "linux_x11_{bits}_release",
+		"Windows Desktop": "windows_{bits}_release.exe",
+		"Mac OSX":         "osx.zip",
+		"HTML5":           "webassembly_release.zip",
+		"Android":         "android_release.apk",
+	}
+
+	# (version, release, template name) -> extracted path, shared by the
+	# exporters of the process
+	__found      = {}
+	__found_lock = threading.Lock()
+
+	def __init__(self, manifest=None):
+		self.godot_toolkit_config = GodotToolkitConfig()
+		self.binaries_dir         = self.godot_toolkit_config.get_adjusted_path("godot_cli", "godot_binaries_path")
+		self.extract_dir          = os.path.join(self.binaries_dir, "templates")
+
+		self.__manifest = manifest
+
+	@property
+	def manifest(self):
+		if self.__manifest == None:
+			from godot_binaries_manifest import GodotBinariesManifest
+			if GodotBinariesManifest.resident != None:
+				self.__manifest = GodotBinariesManifest.resident
+			else:
+				self.__manifest = GodotBinariesManifest()
+
+		return self.__manifest
+
+	@classmethod
+	def template_name(cls, platform, options):
+		'''Name of the release template a preset for `platform` exports with,
+		given the preset's options. None for platforms without a known template.
+		'''
+		template = cls.platform_templates.get(platform)
+		if template == None:
+			return None
+
+		bits = "32" if str(options.get("binary_format/64_bits", "true")).strip('"') == "false" else "64"
+
+		return template.format(bits=bits)
+
+	def find(self, version, release, name):
+		'''Path of the template `name` (e.g. linux_x11_64_release) of a downloaded
+		version and release, extracted on first use.
+		'''
+		key = (version, release, name)
+		with self.__found_lock:
+			if key in self.__found:
+				return self.__found[key]
+
+		templates_info = self.manifest.get_templates_info(version, release)
+		templates_path = self.manifest.get_templates_path(version, release)
+		if templates_info == None or templates_path == None:
+			raise TemplateNotFound("Export templates of {version} {release} aren't downloaded, get them with godot-cli --download-templates {version} {release}".format(
+				version=version, release=release))
+
+		member = self.members_dir + "/" + name
+		if member not in templates_info["members"]:
+			raise TemplateNotFound("Export templates of {version} {release} have no {name}".format(version=version, release=release, name=name))
+
+		path = self.extract(templates_path, templates_info["sha256"], member)
+		with self.__found_lock:
+			self.__found[key] = path
+
+		return path
+
+	def extract(self, templates_path, sha256, member):
+		'''Decompresses one member of the archive into the extracted templates,
+		unless it's there already. zipfile only reads the central directory at
+		the end of the archive and then seeks to the member, the rest of the
+		archive is never read.
+		'''
+		import zipfile
+
+		dest_path = os.path.join(self.extract_dir, sha256, os.path.basename(member))
+		if os.path.isfile(dest_path):
+			return dest_path
+
+		if not os.path.exists(os.path.dirname(dest_path)):
+			os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+
+		# Exports running at the same time wait for whoever extracts first
+		with GodotFileLock(dest_path + ".lock"):
+			if os.path.isfile(dest_path):
+				return dest_path
+
+			tmp_path = "{path}.{pid}.tmp".format(path=dest_path, pid=os.getpid())
+			try:
+				with zipfile.ZipFile(templates_path, 'r') as zip_ref:
+					with zip_ref.open(member) as src, open(tmp_path, 'wb') as dst:
+						shutil.copyfileobj(src, dst, 1024*1024)
+
+				mode = os.stat(tmp_path).st_mode
+				os.chmod(tmp_path, mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+				os.replace(tmp_path, dest_path)
+			finally:
+				if os.path.exists(tmp_path):
+					os.remove(tmp_path)
+
+		print("[+] Extracted {member} from {archive}".format(member=member, archive=os.path.basename(templates_path)))
+
+		return dest_path
@@ -3,43 +3,106 @@
 """Godot Exporter class and CLI application.
 """
 
-import sys, os, platform, subprocess, re, time
+import sys, os, platform, re, io, json, time, threading
+from concurrent.futures import ThreadPoolExecutor
 from godot_config_file import GodotConfigFile
+from godot_process import GodotProcessSupervisor, GodotProcessTimeout, GodotProcessCancelled
+from godot_workspace import GodotWorkspace
+from godot_export_cache import GodotExportCache
+from godot_import_cache import GodotImportCache
+from godot_toolkit_config import GodotToolkitConfig
+from godot_trace import GodotTracer
+from godot_export_log import GodotExportLog, GodotPackedFiles
+from godot_exporter_plugins import GodotExporterPlugins
+from godot_packager import GodotPackager
+from godot_export_templates import GodotExportTemplates, TemplateNotFound
 
 
 class GodotExporter:
 	version = "0.1"
 
-	def __init__(self, plugin_path=None, godot_bin_path=None, godot_version_string=None, export_template_bin_path=None, rcedit_bin_path=None,
-	             project_path=None, preset=None, pack_only=False, export_dest=None):
+	def __init__(self, plugin_paths=(), godot_bin_path=None, godot_version_string=None, export_template_bin_path=None, rcedit_bin_path=None,
+	             project_path=None, preset=None, pack_only=False, export_dest=None, timeout=None, isolated=True, workspace_mode="overlay",
+	             export_cache=None, explain_cache=False, import_cache=None, tracer=None, log_dir=None, progress=False,
+	             package=None, package_jobs=None, template_version=None, template_release="stable", template_name=None,
+	             plugins=None, project_hooks=True, exclude_paths=()):
 		self.godot_bin_path           = godot_bin_path
 		self.export_template_bin_path = export_template_bin_path
 		self.rcedit_bin_path          = rcedit_bin_path
 
-		self.project_path = project_path
-		self.preset       = preset
-		self.pack_only    = pack_only
-		self.export_dest  = export_dest
-
-		self.processed_files = []
-		self.godot_errors    = []
+		# Without an export template path the template comes out of the export
+		# templates godot-cli downloaded for this version, see GodotExportTemplates
+		self.template_version = template_version
+		self.template_release = template_release
+		self.template_name    = template_name
+
+		self.project_path   = project_path
+		self.preset         = preset
+		self.pack_only      = pack_only
+		self.export_dest    = export_dest
+		self.timeout        = timeout
+		self.isolated       = isolated
+		self.workspace_mode = workspace_mode
+		self.export_cache   = export_cache
+		self.explain_cache  = explain_cache
+		self.import_cache   = import_cache
+		self.tracer         = tracer or GodotTracer(enabled=False)
+		self.log_dir        = log_dir
+		self.progress       = progress
+		self.package        = package
+		self.package_jobs   = package_jobs
+
+		# Outputs written into the project by other exports, e.g. the other
+		# presets of a batch, aren't inputs of this one
+		self.exclude_paths = list(exclude_paths)
+
+		# Private view of the project that Godot runs in when isolated, the
+		# project itself is then never modified.
+		self.workspace = None
+
+		# Parsed output of the Godot run, processed_files and godot_errors come
+		# from it
+		self.export_log = GodotExportLog()
+		self.cached     = False
+
+		# What the import cache restored and stored for this export
+		self.import_stats = None
+
+		# Manifest of the package when packaging the export
+		self.package_manifest = None
+
+		self._supervisor = None
+
+		# When tracing, the timestamps of Godot's output lines
+		self._godot_timeline = None
 
 		self._original_export_presets = None
+		self._preset_options          = None
+		self._preset_export_paths     = []
+
+		# Exports of a batch share the plugins of their GodotMultiExporter, which
+		# runs the project wide pre_export and post_export hooks once for all of them
+		if plugins != None:
+			self.plugins = plugins
+		else:
+			self.plugins = GodotExporterPlugins(plugin_paths, tracer=self.tracer, trace_args={ "preset": preset })
+			self.plugins.call("on_load")
+		self.project_hooks = project_hooks
+		self._file_hooks   = self.plugins.has("on_file_packed")
 
-		self.plugin = None
-		if plugin_path:
-			print("[+] Attempting to load exporter plugin from " + plugin_path)
-			if plugin_path and os.path.isfile(plugin_path):
-				import imp
-				exporter_plugin_module = imp.load_source('ExporterPlugin', plugin_path)
-				if hasattr(exporter_plugin_module, "ExporterPlugin"):
-					print("[+] Successfully loaded exporter plugin")
-					self.plugin = exporter_plugin_module.ExporterPlugin()
-				else:
-					print("[-] Could not load exporter plugin. Module has no ExporterClass defined.")
-
-				if self.plugin and hasattr(self.plugin, "on_load"):
-					self.plugin.on_load()
+	@property
+	def processed_files(self):
+		'''Files Godot stored in the pack in packing order, see GodotPackedFiles.
+		'''
+		return self.export_log.files
+
+	@property
+	def godot_errors(self):
+		return self.export_log.errors
+
+	@staticmethod
+	def safe_preset_name(preset):
+		return re.sub(r'[^\w.-]+', "_", preset)
 
 	def validate(self):
 		if platform.system() == "Windows":
@@ -55,8 +118,12 @@ class GodotExporter:
 			print("[-] Could not find project path " + self.project_path)
 			return False
 
-		if not os.path.isfile(self.export_template_bin_path):
-			print("[-] Invalid export template bin path " + self.export_template_bin_path)
+		if self.export_template_bin_path != None:
+			if not os.path.isfile(self.export_template_bin_path):
+				print("[-] Invalid export template bin path " + self.export_template_bin_path)
+				return False
+		elif self.template_version == None and not self.pack_only:
+			print("[-] Either an export template path or a template version is needed")
 			return False
 
 		return True
@@ -70,10 +137,11 @@ class GodotExporter:
 			return None
 
 		# Take a copy of the file into memory since any modifications we make
-		# should be temporary.
-		with open(export_preset_file_path, 'r') as f:
-			self._original_export_presets = f.read()
-		
+		# should be temporary. Isolated exports write their copy to the workspace.
+		if not self.workspace:
+			with open(export_preset_file_path, 'r') as f:
+				self._original_export_presets = f.read()
+
 		config = GodotConfigFile()
 		config.read(export_preset_file_path)
 
@@ -90,88 +158,481 @@ class GodotExporter:
 			print("[-] Could not find preset " + self.preset + " in export_presets.cfg")
 			return preset_section
 
+		# Where the presets export to when run from the editor
+		self._preset_export_paths = []
+		for section in config.sections():
+			if not section.endswith(".options") and config.has_option(section, "export_path"):
+				export_path = config.get(section, "export_path").strip('"')
+				if export_path:
+					self._preset_export_paths.append(os.path.join(self.project_path, export_path))
+
 		# Set runnable to false if pack only is set to true
 		if self.pack_only == True:
 			config.set(preset_section, "runnable", "false")
 		else:
 			config.set(preset_section, "runnable", "true")
+			if self.export_template_bin_path == None:
+				try:
+					self.export_template_bin_path = self.find_template(config, preset_section, preset_options_section)
+				except TemplateNotFound as e:
+					print("[-] " + str(e))
+					return None
 			config.set(preset_options_section, "custom_template/release", "\"" + os.path.realpath(self.export_template_bin_path) + "\"")
 
-		# Allow the plugin the opportunity to modify the export config directly
-		if self.plugin and hasattr(self.plugin, "modify_export_config"):
-			self.plugin.modify_export_config(self, preset_section, config)
+		# Allow the plugins the opportunity to modify the export config directly
+		self.plugins.call("modify_export_config", self, preset_section, config)
 
-		with open(export_preset_file_path, 'w') as configfile:
+		# Everything Godot gets to see of the preset, for the export cache key
+		self._preset_options = dict(config.items(preset_section))
+		if config.has_section(preset_options_section):
+			for key, value in config.items(preset_options_section):
+				self._preset_options["options/" + key] = value
+
+		if self.workspace:
+			configfile = io.StringIO()
 			config.write(configfile)
+			self.workspace.replace_file("export_presets.cfg", configfile.getvalue())
+		else:
+			with open(export_preset_file_path, 'w') as configfile:
+				config.write(configfile)
 
 		return preset_section
 
+	def find_template(self, config, preset_section, preset_options_section):
+		'''Path of the release template the preset exports with, out of the export
+		templates of `template_version`. `template_name` overrides the template
+		picked for the preset's platform.
+		'''
+		name = self.template_name
+		if name == None:
+			options = dict(config.items(preset_options_section)) if config.has_section(preset_options_section) else {}
+			name = GodotExportTemplates.template_name(config.get(preset_section, "platform").strip('"'), options)
+			if name == None:
+				raise TemplateNotFound("No export template known for the platform of " + self.preset + ", name one with --template")
+
+		with self.tracer.span("export_template", preset=self.preset):
+			return GodotExportTemplates().find(self.template_version, self.template_release, name)
+
 	def restore_export_presets(self):
 		export_preset_file_path = os.path.join(self.project_path, "export_presets.cfg")
 
+		# Nothing in the project was touched, the workspace simply goes away
+		if self.workspace:
+			self.workspace.cleanup()
+			self.workspace = None
+			return
+
 		if self._original_export_presets:
 			with open(export_preset_file_path, 'w') as f:
 				f.seek(0)
 				f.write(self._original_export_presets)
 
 	def export(self):
-		# Inform the plugin that we are about to build, this will give
-		# the plugin an opportunity to modify values.
-		if self.plugin and hasattr(self.plugin, "pre_export"):
-			self.plugin.pre_export(self)
-
-		section_name = self.prep_export_preset()
+		try:
+			return self.__export()
+		except BaseException:
+			# A failing plugin hook mustn't leave the workspace or a modified
+			# export_presets.cfg behind
+			self.restore_export_presets()
+			raise
+		finally:
+			self.plugins.close()
+
+	def __export(self):
+		# Inform the plugins that we are about to build, this will give
+		# them an opportunity to modify values.
+		if self.project_hooks and self.plugins.has("pre_export"):
+			with self.tracer.span("pre_export", preset=self.preset):
+				self.plugins.call("pre_export", self)
+
+		if self.isolated:
+			with self.tracer.span("workspace", preset=self.preset):
+				self.workspace = GodotWorkspace(self.project_path, mode=self.workspace_mode)
+				self.workspace.create()
+			print("[+] Exporting {preset} from workspace {path} ({symlinks} symlinks, {linked} files linked, {copied} copied)".format(
+				preset=self.preset, path=self.workspace.path, symlinks=self.workspace.symlinks, linked=self.workspace.linked_files, copied=self.workspace.copied_files))
+
+		with self.tracer.span("prep_export_preset", preset=self.preset):
+			section_name = self.prep_export_preset()
 		if section_name == None:
+			self.restore_export_presets()
 			return False
 
 		godot_bin   = os.path.realpath(self.godot_bin_path)
-		working_dir = os.path.realpath(self.project_path)
+		working_dir = os.path.realpath(self.workspace.path if self.workspace else self.project_path)
 		dest        = os.path.realpath(self.export_dest)
 
-		print("[+] Packing assets using Godot")
-
-		# Run up Godot
-		process = subprocess.Popen([godot_bin, "--export", self.preset, dest], stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=working_dir)
-		while process.poll() is None:
-			for line in process.stdout:
-				line = line.decode('utf-8')
-
-				# Parse out packed files
-				matches = re.finditer(r'savepack: step \d+: Storing File: (.+)\r', line, re.MULTILINE)
-				for matchNum, match in enumerate(matches, start=1):
-					self.processed_files.append(match.group(1))
-
-				# Catch errors
-				err_matches = re.finditer(r'ERROR: (.+)\r', line, re.MULTILINE)
-				for matchNum, match in enumerate(err_matches, start=1):
-					self.godot_errors.append(match.group(1))
-
-			time.sleep(1)
+		# Presets exported in parallel may share their output directory
+		os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+		fingerprint = None
+		cache_entry = None
+		if self.export_cache:
+			with self.tracer.span("export_cache_lookup", preset=self.preset):
+				fingerprint = self.export_cache.fingerprint(self.project_path, self._preset_options, self.godot_bin_path,
+				                                            self.export_template_bin_path, dest, exclude_paths=self.output_paths(dest))
+				cache_entry = self.export_cache.lookup(fingerprint)
+			if cache_entry == None and self.explain_cache:
+				print("[+] Export cache miss:")
+				reasons = self.export_cache.explain(fingerprint)
+				for i, reason in enumerate(reasons):
+					print((" └── " if i == len(reasons) - 1 else " ├── ") + reason)
+
+		failed = False
+		if cache_entry:
+			print("[+] Export cache hit, restoring {count} artifacts".format(count=len(cache_entry["artifacts"])))
+			with self.tracer.span("export_cache_restore", preset=self.preset):
+				self.export_cache.restore(cache_entry, dest)
+			self.export_log.restore(cache_entry["processed_files"], cache_entry["godot_errors"])
+			self.cached = True
+			if self.plugins.has("on_file_packed"):
+				for path in cache_entry["processed_files"]:
+					self.plugins.file_packed(self, path)
+				self.plugins.wait()
+		else:
+			# Imports of unchanged assets come from the import cache, Godot only
+			# imports the rest
+			import_restore = None
+			if self.import_cache:
+				with self.tracer.span("import_cache_restore", preset=self.preset):
+					import_restore = self.import_cache.restore(self.project_path, working_dir, self.godot_bin_path)
+				if import_restore["assets"]:
+					print("[+] Import cache: {restored} of {total} imported assets restored, {current} already up to date, {missing} left to import ({seconds:.2f}s)".format(
+						total=len(import_restore["assets"]), **import_restore))
+
+			print("[+] Packing assets using Godot")
+
+			# Run up Godot
+			start_time = time.time()
+			self.export_log = GodotExportLog(
+				spill_dir   = os.path.join(self.log_dir, self.safe_preset_name(self.preset)) if self.log_dir else None,
+				on_progress = self.print_progress if self.progress else None)
+			if self.tracer.enabled:
+				self._godot_timeline = { "first_line": None, "files": [], "pack_end": None }
+			supervisor = self._supervisor = GodotProcessSupervisor([godot_bin, "--export", self.preset, dest], cwd=working_dir,
+			                                                       on_line=self.parse_godot_line, timeout=self.timeout)
+			try:
+				return_code = supervisor.run()
+			except (GodotProcessTimeout, GodotProcessCancelled) as e:
+				print("[-] " + str(e))
+				self.restore_export_presets()
+				return False
+			finally:
+				self._supervisor = None
+				self.export_log.finish()
+				if self.progress:
+					sys.stdout.write('\n')
+				if self._godot_timeline != None and supervisor.start_time != None:
+					self.__trace_godot_run(supervisor.start_time, time.perf_counter())
+
+			# Independent on_file_packed hooks may still be catching up
+			with self.tracer.span("plugins_on_file_packed", preset=self.preset):
+				self.plugins.wait()
+
+			if return_code != 0:
+				print("[-] Godot exited with code " + str(return_code))
+			elif import_restore and import_restore["missing"]:
+				with self.tracer.span("import_cache_store", preset=self.preset):
+					stored = self.import_cache.save(import_restore, working_dir)
+				if stored:
+					print("[+] Import cache: stored the imports of {stored} assets".format(stored=stored))
+
+			if import_restore:
+				self.import_stats = { key: import_restore[key] for key in ("restored", "current", "missing", "stored", "seconds") }
+
+			if return_code == 0 and fingerprint and os.path.isfile(dest):
+				with self.tracer.span("export_cache_store", preset=self.preset):
+					self.export_cache.store(fingerprint, self.export_artifacts(dest, start_time), list(self.processed_files), self.godot_errors)
+
+			failed = return_code != 0
 
 		print("[+] Packed files: " + str(len(self.processed_files)))
+		if self.export_log.log_path:
+			print("[+] Godot output written to " + self.export_log.log_path)
 
 		# Print out errors
-		print("[!] Godot errors: " + str(len(self.godot_errors)))
+		print("[!] Godot errors: " + str(self.export_log.error_count))
 		l = len(self.godot_errors)
 		for i in range(l):
-			if i >= l - 1:
+			if i >= l - 1 and self.export_log.error_count == l:
 				print(" └── " + self.godot_errors[i])
 			else:
 				print(" ├── " + self.godot_errors[i])
+		if self.export_log.error_count > l:
+			print(" └── ... {more} more".format(more=self.export_log.error_count - l))
 
+		# A failed export is neither handed to post_export nor packaged
+		if failed:
+			self.restore_export_presets()
+			return False
 
-		# Give the plugin a chance to do something post export
-		if self.plugin and hasattr(self.plugin, "post_export"):
-			self.plugin.post_export(self)
-
-		self.restore_export_presets()
+		# Give the plugins a chance to do something post export
+		if self.project_hooks and self.plugins.has("post_export"):
+			with self.tracer.span("post_export", preset=self.preset):
+				self.plugins.call("post_export", self)
+		self.plugins.print_timings()
+
+		# Package the output directory, after the plugins had their say about it
+		if self.package and os.path.isfile(dest):
+			with self.tracer.span("package", preset=self.preset):
+				self.package_manifest = GodotPackager(self.package, jobs=self.package_jobs).package(os.path.dirname(dest), extra={
+					"preset":          self.preset,
+					"cached":          self.cached,
+					"processed_files": len(self.processed_files),
+					"godot_errors":    self.export_log.error_count,
+				})
+			package_info = self.package_manifest["package"]
+			print("[+] Packaged {count} artifacts into {path} ({mib:.1f} MiB, sha256 {sha256:.16}) in {seconds:.2f}s".format(
+				count=len(self.package_manifest["artifacts"]), path=os.path.join(os.path.dirname(os.path.dirname(dest)), package_info["path"]),
+				mib=package_info["size"] / (1024*1024), sha256=package_info["sha256"], seconds=package_info["seconds"]))
+
+		with self.tracer.span("restore", preset=self.preset):
+			self.restore_export_presets()
 
 		return True
 
+	def __trace_godot_run(self, start, end):
+		'''Turns the timestamps of Godot's output into phases: startup until the
+		first line of output, importing until the first file is stored, then one
+		event per stored file lasting until the next one, and shutdown.
+		'''
+		timeline = self._godot_timeline
+		self._godot_timeline = None
+
+		files      = timeline["files"]
+		first_line = timeline["first_line"] or end
+		first_pack = files[0][1] if files else end
+		pack_end   = timeline["pack_end"] or end
+
+		self.tracer.complete("godot", start, end, args={ "preset": self.preset })
+		self.tracer.complete("godot_startup", start, first_line, args={ "preset": self.preset })
+		self.tracer.complete("import", first_line, first_pack, args={ "preset": self.preset })
+
+		if files:
+			self.tracer.complete("pack", first_pack, pack_end, args={ "preset": self.preset })
+			for i, (name, stored) in enumerate(files):
+				next_stored = files[i + 1][1] if i + 1 < len(files) else pack_end
+				self.tracer.complete(name, stored, next_stored, GodotTracer.file_category, { "preset": self.preset })
+
+		self.tracer.complete("godot_shutdown", pack_end, end, args={ "preset": self.preset })
+
+	def output_paths(self, dest):
+		'''Exports that may end up inside the project: this one, those in
+		`exclude_paths` and their directories, and the files at the export paths
+		of the presets in export_presets.cfg along with what's exported next to
+		them (e.g. game.pck next to game.exe).
+		'''
+		paths = []
+		for path in [dest] + self.exclude_paths:
+			path = os.path.realpath(path)
+			paths += [path, os.path.dirname(path)]
+
+		for path in self._preset_export_paths:
+			path     = os.path.realpath(path)
+			stem     = os.path.splitext(os.path.basename(path))[0]
+			dest_dir = os.path.dirname(path)
+			paths.append(path)
+			if os.path.isdir(dest_dir):
+				paths += [os.path.join(dest_dir, name) for name in os.listdir(dest_dir) if os.path.splitext(name)[0] == stem]
+
+		return paths
+
+	def export_artifacts(self, dest, since):
+		'''The files an export produced: the export itself and anything next to it
+		sharing its name that was written after `since` (e.g. the .pck of a non
+		embedded executable).
+		'''
+		stem = os.path.splitext(os.path.basename(dest))[0]
+
+		artifacts = [dest]
+		dest_dir  = os.path.dirname(dest)
+		for name in sorted(os.listdir(dest_dir)):
+			path = os.path.join(dest_dir, name)
+			if path == dest or os.path.splitext(name)[0] != stem or not os.path.isfile(path):
+				continue
+			if os.path.getmtime(path) >= since - 1:
+				artifacts.append(path)
+
+		return artifacts
+
+	def parse_godot_line(self, stream_name, line):
+		kind, value = self.export_log.feed(stream_name, line)
+
+		timeline = self._godot_timeline
+		if timeline != None:
+			line_time = self._supervisor.line_time if self._supervisor else time.perf_counter()
+			if timeline["first_line"] == None:
+				timeline["first_line"] = line_time
+			if kind == GodotExportLog.SAVEPACK:
+				timeline["files"].append((value, line_time))
+			elif line.startswith("savepack: end"):
+				timeline["pack_end"] = line_time
+
+		if kind == GodotExportLog.SAVEPACK and self._file_hooks:
+			self.plugins.file_packed(self, value)
+
+	def print_progress(self, export_log):
+		if export_log.phase == "startup":
+			return
+
+		done = int(50 * export_log.step / export_log.steps) if export_log.steps else 0
+		done = min(50, done)
+		sys.stdout.write('\r{phase:<7}[{bar}{rest}] {files} files, {errors} errors'.format(
+			phase=export_log.phase, bar='█' * done, rest='.' * (50 - done), files=len(export_log.files), errors=export_log.error_count))
+		sys.stdout.flush()
+
+	def cancel(self):
+		'''Aborts a running export from another thread.
+		'''
+		supervisor = self._supervisor
+		if supervisor:
+			supervisor.cancel()
+
 	def gen_base_export_preset(self):
 		pass
 
 
+class GodotMultiExporter:
+	'''Exports several presets of one project at the same time. Every preset gets
+	its own GodotExporter working in an isolated workspace, so their export
+	configurations and import caches can't interfere with each other.
+
+	The plugins are loaded once for the batch. Their project wide hooks,
+	pre_export and post_export, run once: before the first Godot run and after
+	the last one, with the GodotMultiExporter in place of an exporter. It has
+	the `project_path` and the `processed_files` of all presets, and the
+	`exporters` of the presets. The per preset hooks run for every preset.
+	'''
+
+	def __init__(self, presets, export_dest, jobs=None, plugin_paths=(), tracer=None, **exporter_args):
+		self.presets       = list(dict.fromkeys(presets))
+		self.export_dest   = export_dest
+		self.jobs          = jobs or len(presets)
+		self.tracer        = tracer or GodotTracer(enabled=False)
+		self.project_path  = exporter_args.get("project_path")
+		self.exporter_args = exporter_args
+
+		self.plugins = GodotExporterPlugins(plugin_paths, tracer=self.tracer)
+		self.plugins.call("on_load")
+
+		self.exporters = {}
+		for preset in presets:
+			self.exporters[preset] = GodotExporter(preset=preset, export_dest=self.preset_export_dest(preset), isolated=True, tracer=self.tracer,
+			                                       plugins=self.plugins.share({ "preset": preset }), project_hooks=False,
+			                                       exclude_paths=[self.preset_export_dest(other) for other in self.presets], **exporter_args)
+
+	@property
+	def processed_files(self):
+		'''Files Godot stored in the packs of all presets, each listed once.
+		'''
+		files = GodotPackedFiles()
+		for exporter in self.exporters.values():
+			files.update(exporter.processed_files)
+
+		return files
+
+	def validate(self):
+		'''Checks the arguments shared by the presets.
+		'''
+		return self.exporters[self.presets[0]].validate()
+
+	def preset_export_dest(self, preset):
+		'''`export_dest` may contain a {preset} placeholder. Without one each preset
+		is exported into a sub directory named after it.
+		'''
+		safe_preset = GodotExporter.safe_preset_name(preset)
+		if "{preset}" in self.export_dest:
+			return self.export_dest.replace("{preset}", safe_preset)
+
+		if len(self.presets) == 1:
+			return self.export_dest
+
+		return os.path.join(os.path.dirname(self.export_dest), safe_preset, os.path.basename(self.export_dest))
+
+	def export(self):
+		'''Runs the exports and returns a report with the outcome of every preset.
+		'''
+		start_time = time.perf_counter()
+
+		try:
+			# Plugins change the project itself here, the presets must not run
+			# these side by side
+			if self.plugins.has("pre_export"):
+				with self.tracer.span("pre_export"):
+					self.plugins.call("pre_export", self)
+
+			with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as executor:
+				results = list(executor.map(self.__export_preset, self.presets))
+
+			success = all(result["success"] for result in results)
+			if success and self.plugins.has("post_export"):
+				with self.tracer.span("post_export"):
+					self.plugins.call("post_export", self)
+			self.plugins.print_timings()
+		finally:
+			self.plugins.close()
+
+		report = {
+			"seconds":      time.perf_counter() - start_time,
+			"success":      success,
+			"plugin_hooks": self.plugins.timings(),
+			"presets":      results,
+		}
+
+		return report
+
+	def __export_preset(self, preset):
+		start_time = time.perf_counter()
+
+		result = {
+			"preset":          preset,
+			"export_dest":     self.preset_export_dest(preset),
+			"success":         False,
+			"error":           None,
+			"seconds":         0.0,
+			"processed_files": [],
+			"godot_errors":    [],
+			"godot_warnings":  0,
+			"plugin_hooks":    [],
+			"package":         None,
+			"import_cache":    None,
+			"cached":          False,
+		}
+
+		try:
+			exporter = self.exporters[preset]
+
+			result["success"]         = exporter.export() == True
+			result["processed_files"] = exporter.processed_files
+			result["godot_errors"]    = exporter.godot_errors
+			result["godot_warnings"]  = exporter.export_log.warning_count
+			result["plugin_hooks"]    = exporter.plugins.timings()
+			result["package"]         = exporter.package_manifest
+			result["import_cache"]    = exporter.import_stats
+			result["cached"]          = exporter.cached
+		except Exception as e:
+			result["error"] = "{kind}: {error}".format(kind=e.__class__.__name__, error=e)
+
+		result["seconds"] = time.perf_counter() - start_time
+
+		return result
+
+	def cancel(self):
+		for exporter in list(self.exporters.values()):
+			exporter.cancel()
+
+	@staticmethod
+	def print_report(report):
+		print("[+] Exported {count} presets in {seconds:.2f}s".format(count=len(report["presets"]), seconds=report["seconds"]))
+		for i, result in enumerate(report["presets"]):
+			line = "{preset}: {status} in {seconds:.2f}s, {files} files, {errors} errors".format(
+				preset=result["preset"], status=("cached" if result.get("cached") else "ok") if result["success"] else "FAILED", seconds=result["seconds"],
+				files=len(result["processed_files"]), errors=len(result["godot_errors"]))
+			if result["error"]:
+				line += " (" + result["error"] + ")"
+			print((" └── " if i == len(report["presets"]) - 1 else " ├── ") + line)
+
+
 if __name__ == '__main__':
 	class Error(Exception):
 		pass
@@ -194,31 +655,140 @@ if __name__ == '__main__':
 	parser = argparse.ArgumentParser(prog='godot-exporter', description='godot-exporter is a command line Godot exporter for advanced Godot users.')
 	parser.add_argument('-v', '--version',        action='version',              version='%(prog)s version ' + GodotExporter.version)
 	parser.add_argument('--pack-only',            action='store_true',           help='Only export the pack file which can be .pck/.zip (defaults to off)')
-	parser.add_argument('--export-template-path', required=True, type=file_path, help='Path to the Godot export template')
+	parser.add_argument('--export-template-path',                type=file_path, help='Path to the Godot export template')
+	parser.add_argument('--template-version',                    type=str,       help='Instead of --export-template-path, use the export templates godot-cli --download-templates downloaded for this Godot version')
+	parser.add_argument('--template-release',                    type=str,       help='Release of the export templates (defaults to stable)', default='stable')
+	parser.add_argument('--template',                            type=str,       help='Name of the export template to use, e.g. linux_x11_64_release (defaults to the one for the preset\'s platform)')
 	parser.add_argument('--rcedit-path',                         type=file_path, help='(Windows only) Path to the rcedit binary')
 	parser.add_argument('--project-path',         required=True, type=dir_path,  help='Directory in which the Godot project sits')
-	parser.add_argument('--preset',               required=True, type=str,       help='Which preset to use when exporting')
-	parser.add_argument('--out',                  required=True, type=str,       help='Output directory for the final game/application')
-	parser.add_argument('--plugin',               required=True, type=str,       help='Plugin path')
+	parser.add_argument('--preset',               required=True, type=str,       help='Which preset to use when exporting, repeat to export several presets in parallel', action='append')
+	parser.add_argument('--out',                  required=True, type=str,       help='Output directory for the final game/application, may contain {preset} when exporting several presets')
+	parser.add_argument('--jobs',                                type=int,       help='How many presets to export at the same time')
+	parser.add_argument('--report',                              type=str,       help='Write a JSON report of the export(s) to this path')
+	parser.add_argument('--plugin',               required=True, type=str,       help='Plugin path, repeat to run several plugins in order', action='append')
+	parser.add_argument('--timeout',                             type=float,     help='Give up on the export if Godot takes longer than this many seconds')
+	parser.add_argument('--in-place',             action='store_true',           help='Modify export_presets.cfg inside the project during the export instead of exporting from a private workspace')
+	parser.add_argument('--no-cache',             action='store_true',           help='Always run Godot, don\'t look up or store exports in the export cache')
+	parser.add_argument('--explain-cache',        action='store_true',           help='Print why the export cache missed')
+	parser.add_argument('--cache-path',                          type=str,       help='Directory of the export cache (defaults to data/export_cache)')
+	parser.add_argument('--no-import-cache',      action='store_true',           help='Let Godot import every asset the project\'s import directory doesn\'t have up to date, don\'t use or fill the import cache')
+	parser.add_argument('--import-cache-path',                   type=str,       help='Directory of the import cache (defaults to data/import_cache)')
+	parser.add_argument('--import-cache-remote',                 type=str,       help='Import cache shared between machines: a directory, or a module defining an ImportCacheRemote class')
+	parser.add_argument('--trace',                               type=str,       help='Write the timing of every export phase and packed file to this path as Chrome trace events')
+	parser.add_argument('--trace-summary',                       type=str,       help='Write a JSON summary of the export timing to this path')
+	parser.add_argument('--log-dir',                             type=str,       help='Write Godot\'s output and the packed file list of every preset to this directory instead of keeping them in memory')
+	parser.add_argument('--no-progress',          action='store_true',           help='Don\'t draw a progress bar while Godot packs the export')
+	parser.add_argument('--package',              choices=GodotPackager.formats, help='Pack the output directory of every preset into a zip or tar.gz next to it, with a JSON manifest of the artifacts\' sizes and SHA-256')
+	parser.add_argument('--package-jobs',                        type=int,       help='Compression threads when packaging (defaults to the number of CPUs)')
+	parser.add_argument('--workspace-mode',       choices=['overlay', 'mirror'], default='overlay', help='overlay symlinks the project into the workspace, mirror hardlinks every file. Either way import data is copied')
 	group = parser.add_mutually_exclusive_group(required=True)
 	group.add_argument('--godot-path', type=file_path,    help='Path of the Godot binary that will be doing the exporting')
 	group.add_argument('--godot-version', type=file_path, help='Which Godot version to use. This will be downloaded if not already done so.')
 	args = parser.parse_args()
 
-	godot_exporter = GodotExporter(
-		plugin_path              = args.plugin,
+	export_cache = None
+	if not args.no_cache:
+		config = GodotToolkitConfig()
+		export_cache = GodotExportCache(args.cache_path or config.get_adjusted_path("godot_exporter", "export_cache_path"),
+		                                hash_jobs   = config.get_int("godot_exporter", "export_cache_hash_jobs", 8),
+		                                max_entries = config.get_int("godot_exporter", "export_cache_max_entries", 20))
+
+	import_cache = None
+	if not args.no_import_cache:
+		config = GodotToolkitConfig()
+		remote = args.import_cache_remote or config.get("godot_exporter", "import_cache_remote")
+		try:
+			remote = GodotImportCache.load_remote(remote) if remote else None
+		except ValueError as e:
+			print("[-] " + str(e))
+			exit()
+		import_cache = GodotImportCache(args.import_cache_path or config.get_adjusted_path("godot_exporter", "import_cache_path"),
+		                                remote     = remote,
+		                                jobs       = config.get_int("godot_exporter", "export_cache_hash_jobs", 8),
+		                                file_index = export_cache.file_index if export_cache else None)
+
+	tracer = GodotTracer(enabled=bool(args.trace or args.trace_summary))
+
+	exporter_args = dict(
+		plugin_paths             = args.plugin,
 		godot_bin_path           = args.godot_path,
 		godot_version_string     = args.godot_version,
 		export_template_bin_path = args.export_template_path,
 		rcedit_bin_path          = args.rcedit_path,
 		project_path             = args.project_path,
-		preset                   = args.preset,
 		pack_only                = args.pack_only,
-		export_dest              = args.out)
+		timeout                  = args.timeout,
+		workspace_mode           = args.workspace_mode,
+		export_cache             = export_cache,
+		explain_cache            = args.explain_cache,
+		import_cache             = import_cache,
+		tracer                   = tracer,
+		log_dir                  = args.log_dir,
+		package                  = args.package,
+		package_jobs             = args.package_jobs,
+		template_version         = args.template_version,
+		template_release         = args.template_release,
+		template_name            = args.template)
+
+	def write_trace():
+		if not tracer.enabled:
+			return
+
+		summary = tracer.summary()
+		GodotTracer.print_summary(summary)
+		if args.trace:
+			tracer.write_chrome_trace(args.trace)
+		if args.trace_summary:
+			with open(args.trace_summary, 'w') as f:
+				json.dump(summary, f, indent=4)
+
+	if len(args.preset) > 1:
+		if args.in_place:
+			print("[-] --in-place can't be used when exporting several presets")
+			exit()
+
+		multi_exporter = GodotMultiExporter(args.preset, args.out, jobs=args.jobs, **exporter_args)
+
+		# Validate command line arguments
+		if not multi_exporter.validate():
+			exit()
+
+		report = multi_exporter.export()
+		GodotMultiExporter.print_report(report)
+		write_trace()
+
+		if args.report:
+			with open(args.report, 'w') as f:
+				json.dump(report, f, indent=4, default=list)
+
+		if not report["success"]:
+			sys.exit(1)
+		exit()
+
+	godot_exporter = GodotExporter(preset=args.preset[0], export_dest=args.out, isolated=not args.in_place,
+	                               progress=sys.stdout.isatty() and not args.no_progress, **exporter_args)
 
 	# Validate command line arguments
 	if not godot_exporter.validate():
 		exit()
 
 	# Commit to export
-	godot_exporter.export()
\ No newline at end of file
+	success = godot_exporter.export()
+	write_trace()
+
+	if args.report:
+		with open(args.report, 'w') as f:
+			json.dump({
+				"preset":          godot_exporter.preset,
+				"success":         success,
+				"cached":          godot_exporter.cached,
+				"processed_files": godot_exporter.processed_files,
+				"godot_errors":    godot_exporter.godot_errors,
+				"godot_warnings":  godot_exporter.export_log.warning_count,
+				"plugin_hooks":    godot_exporter.plugins.timings(),
+				"package":         godot_exporter.package_manifest,
+				"import_cache":    godot_exporter.import_stats,
+			}, f, indent=4, default=list)
+
+	if not success:
+		sys.exit(1)
@@ -0,0 +1,227 @@
+"""Loading exporter plugins and running their hooks.
+"""
+
+import os, time, threading, importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from godot_trace import GodotTracer
+
+
+class GodotExporterPlugins():
+	'''The plugins of an export, in the order they were given. A plugin is a
+	module defining an ExporterPlugin (or ExportPlugin) class with any of the
+	hooks below, every hook is called on every plugin that has it:
+
+	  * on_load()
+	  * pre_export(exporter)
+	  * modify_export_config(exporter, section, config)
+	  * on_file_packed(exporter, path), for every file as Godot stores it in the
+	    pack, or as it's restored from the export cache
+	  * post_export(exporter)
+
+	Hooks run one plugin after the other on the exporting thread. A plugin can
+	list hooks that don't depend on the other plugins or on the export waiting
+	for them in `independent_hooks`; those run on a worker thread of the plugin
+	instead, in order, overlapping with the other plugins and with Godot. call()
+	waits for them before returning, on_file_packed is only waited for by
+	wait().
+
+		class ExporterPlugin():
+			independent_hooks = ("on_file_packed",)
+
+	Every call is timed, see timings(), and recorded in the tracer.
+
+	Presets exported together share the plugin instances, see share(). A
+	plugin's hooks never run at the same time, whichever preset calls them.
+	'''
+
+	hooks           = ("on_load", "pre_export", "modify_export_config", "on_file_packed", "post_export")
+	class_names     = ("ExporterPlugin", "ExportPlugin")
+	plugin_category = "plugin"
+
+	# Imported plugin modules by path and mtime, a process exporting several
+	# times (the daemon) imports every plugin once
+	__modules      = {}
+	__modules_lock = threading.Lock()
+
+	def __init__(self, plugin_paths=(), tracer=None, trace_args=None, shared=None):
+		self.tracer     = tracer or GodotTracer(enabled=False)
+		self.trace_args = trace_args or {}
+
+		self.plugins = []
+
+		self.__timings = {}
+		self.__lock    = threading.Lock()
+		self.__workers = {}
+		self.__pending = {}
+		self.__error   = None
+
+		if shared != None:
+			self.plugins        = shared.plugins
+			self.__plugin_locks = shared.__plugin_locks
+		else:
+			for path in plugin_paths:
+				plugin = self.load(path)
+				if plugin != None:
+					self.plugins.append((os.path.splitext(os.path.basename(path))[0], plugin))
+
+			self.__plugin_locks = { name: threading.RLock() for name, plugin in self.plugins }
+
+		self.__has = { hook: any(hasattr(plugin, hook) for name, plugin in self.plugins) for hook in self.hooks }
+
+	def share(self, trace_args=None):
+		'''Another GodotExporterPlugins running the same plugin instances, with
+		its own worker threads and timings, e.g. for one preset of a batch. The
+		plugins aren't loaded again and on_load isn't called.
+		'''
+		return GodotExporterPlugins(tracer=self.tracer, trace_args=trace_args, shared=self)
+
+	@classmethod
+	def load(cls, path):
+		'''Imports the plugin module at `path` and returns an instance of its plugin
+		class, None if it has none.
+		'''
+		print("[+] Attempting to load exporter plugin from " + path)
+		if not os.path.isfile(path):
+			print("[-] Could not find exporter plugin " + path)
+			return None
+
+		module = cls.load_module(path)
+
+		for class_name in cls.class_names:
+			if hasattr(module, class_name):
+				print("[+] Successfully loaded exporter plugin")
+				return getattr(module, class_name)()
+
+		print("[-] Could not load exporter plugin. Module has no ExporterPlugin class defined.")
+		return None
+
+	@classmethod
+	def load_module(cls, path):
+		'''Imports the plugin module at `path`, or returns the module imported
+		before if the file didn't change since.
+		'''
+		key = (os.path.realpath(path), os.stat(path).st_mtime_ns)
+		with cls.__modules_lock:
+			if key in cls.__modules:
+				return cls.__modules[key]
+
+		module_name = "godot_exporter_plugin_" + "".join(c if c.isalnum() else "_" for c in os.path.splitext(os.path.basename(path))[0])
+		spec   = importlib.util.spec_from_file_location(module_name, path)
+		module = importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(module)
+
+		with cls.__modules_lock:
+			cls.__modules[key] = module
+
+		return module
+
+	def has(self, hook):
+		return self.__has.get(hook, False)
+
+	def call(self, hook, *args):
+		'''Runs `hook` on every plugin that has it and returns once all of them
+		are done. The first exception a hook raised is raised again.
+		'''
+		waiting = []
+		for name, plugin in self.plugins:
+			if not hasattr(plugin, hook):
+				continue
+
+			if hook in getattr(plugin, "independent_hooks", ()):
+				waiting.append(self.__submit(name, plugin, hook, args))
+			else:
+				self.__run(name, plugin, hook, args)
+
+		for future in waiting:
+			future.result()
+
+		self.__raise_error()
+
+	def file_packed(self, exporter, path):
+		'''Hands a packed file to the on_file_packed hooks without waiting for the
+		independent ones. Errors are held back until wait(), this runs while
+		Godot's output is being read.
+		'''
+		for name, plugin in self.plugins:
+			if not hasattr(plugin, "on_file_packed"):
+				continue
+
+			if "on_file_packed" in getattr(plugin, "independent_hooks", ()):
+				self.__pending[name] = self.__submit(name, plugin, "on_file_packed", (exporter, path))
+			else:
+				self.__run_held(name, plugin, "on_file_packed", (exporter, path))
+
+	def wait(self):
+		'''Waits for every hook still running on a worker thread.
+		'''
+		pending = list(self.__pending.values())
+		self.__pending = {}
+
+		# Workers run a plugin's calls in order, the last one finishing means
+		# all of them did
+		for future in pending:
+			future.result()
+
+		self.__raise_error()
+
+	def close(self):
+		'''Stops the worker threads once their queued hooks ran.
+		'''
+		for worker in self.__workers.values():
+			worker.shutdown()
+		self.__workers = {}
+		self.__pending = {}
+
+	def timings(self):
+		'''[{plugin, hook, calls, seconds, max_seconds}] in plugin order.
+		'''
+		with self.__lock:
+			return [dict(plugin=name, hook=hook, **timing) for (name, hook), timing in self.__timings.items()]
+
+	def print_timings(self):
+		timings = self.timings()
+		if not timings:
+			return
+
+		print("[+] Plugin hooks")
+		for i, timing in enumerate(timings):
+			print((" └── " if i == len(timings) - 1 else " ├── ") + "{plugin}.{hook}: {calls} calls, {seconds:.3f}s, slowest {max_seconds:.3f}s".format(**timing))
+
+	def __submit(self, name, plugin, hook, args):
+		worker = self.__workers.get(name)
+		if worker == None:
+			worker = self.__workers[name] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="plugin-" + name)
+
+		return worker.submit(self.__run_held, name, plugin, hook, args)
+
+	def __run_held(self, name, plugin, hook, args):
+		'''Runs a hook, keeping the first error for __raise_error().
+		'''
+		try:
+			self.__run(name, plugin, hook, args)
+		except Exception as e:
+			with self.__lock:
+				if self.__error == None:
+					self.__error = e
+
+	def __run(self, name, plugin, hook, args):
+		with self.__plugin_locks[name]:
+			start = time.perf_counter()
+			try:
+				getattr(plugin, hook)(*args)
+			finally:
+				end = time.perf_counter()
+				with self.__lock:
+					timing = self.__timings.setdefault((name, hook), { "calls": 0, "seconds": 0.0, "max_seconds": 0.0 })
+					timing["calls"]      += 1
+					timing["seconds"]    += end - start
+					timing["max_seconds"] = max(timing["max_seconds"], end - start)
+
+				self.tracer.complete(name + "." + hook, start, end, self.plugin_category, dict(self.trace_args, plugin=name))
+
+	def __raise_error(self):
+		with self.__lock:
+			error, self.__error = self.__error, None
+
+		if error != None:
+			raise error
@@ -0,0 +1,156 @@
+"""Persisted index of file content hashes.
+"""
+
+import os, json, time, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+from godot_file_lock import GodotFileLock
+
+
+class GodotFileIndex():
+	'''Remembers the SHA-256 of files along with their size, mtime and inode so a
+	file that hasn't been touched since it was last hashed isn't read again.
+
+	A file modified within `racy_window` seconds of being hashed is hashed again
+	next time, its mtime alone can't tell a later write in the same tick apart.
+	Entries for files that haven't been looked at for `max_age` seconds are
+	dropped when the index is saved.
+	'''
+
+	racy_window = 2.0
+	max_age     = 30 * 24 * 60 * 60
+
+	def __init__(self, index_path, jobs=8, chunk_size=1024*1024):
+		self.index_path = index_path
+		self.lock_path  = index_path + ".lock"
+		self.jobs       = max(1, jobs)
+		self.chunk_size = chunk_size
+
+		self.hits         = 0
+		self.misses       = 0
+		self.hashed_bytes = 0
+
+		self.__entries     = {}
+		self.__updated     = {}
+		self.__thread_lock = threading.Lock()
+
+		self.load()
+
+	def load(self):
+		with self.__thread_lock:
+			self.__entries = self.__read()
+
+	def hash_files(self, paths):
+		'''Returns {path: sha256} for every path, only hashing the files whose
+		stat doesn't match the index. Hashing happens on `jobs` threads.
+		'''
+		hashes  = {}
+		pending = []
+		now     = time.time()
+
+		for path in paths:
+			st = os.stat(path)
+			key = os.path.realpath(path)
+			with self.__thread_lock:
+				entry = self.__entries.get(key)
+
+			if entry and self.__entry_matches(entry, st):
+				hashes[path] = entry["sha256"]
+				self.__touch(key, entry, now)
+				self.hits += 1
+			else:
+				pending.append((path, key, st))
+
+		def hash_one(item):
+			path, key, st = item
+			sha256 = self.hash_file(path)
+			entry = {
+				"size":      st.st_size,
+				"mtime_ns":  st.st_mtime_ns,
+				"ino":       st.st_ino,
+				"sha256":    sha256,
+				"hashed_at": time.time(),
+			}
+			self.__touch(key, entry, now)
+			return path, sha256
+
+		if len(pending) > 1 and self.jobs > 1:
+			with ThreadPoolExecutor(max_workers=min(self.jobs, len(pending))) as executor:
+				results = list(executor.map(hash_one, pending))
+		else:
+			results = [hash_one(item) for item in pending]
+
+		for path, sha256 in results:
+			hashes[path] = sha256
+		self.misses += len(pending)
+
+		return hashes
+
+	def hash_file(self, path):
+		hasher = hashlib.sha256()
+		with open(path, 'rb') as f:
+			while True:
+				data = f.read(self.chunk_size)
+				if not data:
+					break
+				hasher.update(data)
+				with self.__thread_lock:
+					self.hashed_bytes += len(data)
+
+		return hasher.hexdigest()
+
+	def save(self):
+		'''Merges this process' updates into the index on disk.
+		'''
+		with self.__thread_lock:
+			updated = dict(self.__updated)
+			self.__updated = {}
+
+		if not updated:
+			return
+
+		with GodotFileLock(self.lock_path):
+			entries = self.__read()
+			entries.update(updated)
+
+			cutoff = time.time() - self.max_age
+			entries = { path: entry for path, entry in entries.items() if entry.get("seen", 0) >= cutoff }
+
+			index_dir = os.path.dirname(self.index_path)
+			if index_dir and not os.path.isdir(index_dir):
+				os.makedirs(index_dir, exist_ok=True)
+
+			tmp_path = "{path}.{pid}.tmp".format(path=self.index_path, pid=os.getpid())
+			with open(tmp_path, 'w') as f:
+				json.dump(entries, f, separators=(',', ':'))
+				f.flush()
+				os.fsync(f.fileno())
+			os.replace(tmp_path, self.index_path)
+
+		with self.__thread_lock:
+			self.__entries = entries
+
+	def __entry_matches(self, entry, st):
+		if entry.get("size") != st.st_size or entry.get("mtime_ns") != st.st_mtime_ns or entry.get("ino") != st.st_ino:
+			return False
+
+		# Written in the same moment it was hashed, might have changed again since
+		if st.st_mtime_ns / 1e9 >= entry.get("hashed_at", 0) - self.racy_window:
+			return False
+
+		return True
+
+	def __touch(self, key, entry, now):
+		entry = dict(entry, seen=now)
+		with self.__thread_lock:
+			self.__entries[key] = entry
+			self.__updated[key] = entry
+
+	def __read(self):
+		if not os.path.isfile(self.index_path):
+			return {}
+
+		try:
+			with open(self.index_path, 'r') as f:
+				return json.load(f)
+		except ValueError:
+			return {}
@@ -0,0 +1,94 @@
+"""Advisory file locks shared between processes using the same data directory.
+"""
+
+import os, time
+
+if os.name == "nt":
+	import msvcrt
+else:
+	import fcntl
+
+
+class LockTimeout(Exception):
+	pass
+
+
+class GodotFileLock():
+	'''Exclusive lock on `path` (usually "<shared file>.lock"). Works across
+	processes and across threads that each hold their own GodotFileLock.
+
+		with GodotFileLock(cache_path + ".lock"):
+			...
+	'''
+
+	poll_interval = 0.1
+
+	def __init__(self, path, timeout=None):
+		self.path    = path
+		self.timeout = timeout
+
+		self.__fd = None
+
+	def acquire(self, blocking=True):
+		'''Takes the lock. Returns False if `blocking` is off and somebody else holds
+		it, raises LockTimeout if it couldn't be taken within `timeout` seconds.
+		'''
+		if self.__fd != None:
+			raise RuntimeError("{path} is already held by this lock object".format(path=self.path))
+
+		lock_dir = os.path.dirname(self.path)
+		if lock_dir and not os.path.exists(lock_dir):
+			os.makedirs(lock_dir, exist_ok=True)
+
+		fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+
+		start_time = time.monotonic()
+		while True:
+			if self.__try_lock(fd):
+				self.__fd = fd
+				return True
+
+			if not blocking:
+				os.close(fd)
+				return False
+
+			if self.timeout != None and time.monotonic() - start_time > self.timeout:
+				os.close(fd)
+				raise LockTimeout("Timed out waiting for {path}".format(path=self.path))
+
+			time.sleep(self.poll_interval)
+
+	def release(self):
+		if self.__fd == None:
+			return
+
+		if os.name == "nt":
+			os.lseek(self.__fd, 0, os.SEEK_SET)
+			msvcrt.locking(self.__fd, msvcrt.LK_UNLCK, 1)
+		else:
+			fcntl.flock(self.__fd, fcntl.LOCK_UN)
+
+		os.close(self.__fd)
+		self.__fd = None
+
+	def is_held(self):
+		return self.__fd != None
+
+	def __try_lock(self, fd):
+		try:
+			if os.name == "nt":
+				os.lseek(fd, 0, os.SEEK_SET)
+				msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+			else:
+				fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except OSError:
+			return False
+
+		return True
+
+	def __enter__(self):
+		self.acquire()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.release()
\ No newline at end of file
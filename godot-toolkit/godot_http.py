@@ -0,0 +1,163 @@
+"""Small keep-alive HTTP client used by the catalogue scraper.
+"""
+
+import http.client, threading, time, socket
+from urllib.parse import urlsplit, urljoin
+
+
+class GodotHttpError(Exception):
+	'''`status` is the HTTP status of a response the server refused the request
+	with, None when there was no usable response.
+	'''
+
+	def __init__(self, message, status=None):
+		super().__init__(message)
+		self.status = status
+
+
+class GodotHttpResponse():
+	def __init__(self, url, status, headers, body):
+		self.url     = url
+		self.status  = status
+		self.headers = headers
+		self.body    = body
+
+	def header(self, name, default=None):
+		return self.headers.get(name.lower(), default)
+
+
+class GodotHttpPool():
+	'''Hands out one persistent connection per (thread, host) so that many requests
+	to the same mirror reuse a single TCP/TLS session. Requests that fail with a
+	network error or a 5xx status are retried with exponential backoff.
+	'''
+
+	max_redirects = 5
+	chunk_size    = 64 * 1024
+
+	def __init__(self, timeout=30, retries=3, backoff=0.5):
+		self.timeout = timeout
+		self.retries = retries
+		self.backoff = backoff
+
+		# Number of requests put on the wire, including retries
+		self.request_count = 0
+
+		self.__local           = threading.local()
+		self.__all_lock        = threading.Lock()
+		self.__all_connections = []
+
+	def __get_connection(self, scheme, netloc):
+		if not hasattr(self.__local, "connections"):
+			self.__local.connections = {}
+
+		key = (scheme, netloc)
+		if key not in self.__local.connections:
+			if scheme == "https":
+				self.__local.connections[key] = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+			else:
+				self.__local.connections[key] = http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+			with self.__all_lock:
+				self.__all_connections.append(self.__local.connections[key])
+
+		return self.__local.connections[key]
+
+	def __drop_connection(self, scheme, netloc):
+		connections = getattr(self.__local, "connections", {})
+		connection = connections.pop((scheme, netloc), None)
+		if connection:
+			connection.close()
+			with self.__all_lock:
+				if connection in self.__all_connections:
+					self.__all_connections.remove(connection)
+
+	def close(self):
+		'''Closes every connection opened by the pool, across all threads. A thread
+		that uses the pool afterwards simply opens a new connection.
+		'''
+		with self.__all_lock:
+			connections, self.__all_connections = self.__all_connections, []
+
+		for connection in connections:
+			connection.close()
+
+		self.__local = threading.local()
+
+	def request(self, url, headers=None, on_chunk=None, on_headers=None):
+		'''GETs `url` and returns a GodotHttpResponse. Follows redirects, returns
+		2xx and 304 responses and raises GodotHttpError for anything else.
+
+		If `on_chunk` is given the body of a 2xx response is handed to it piece by
+		piece as it is read off the socket and the returned response has no body.
+		`on_headers` gets the (lower cased) headers of that response before the
+		first chunk, e.g. to pick the charset to decode it with.
+		'''
+		for redirect in range(self.max_redirects + 1):
+			response = self.__request_with_retries(url, headers or {}, on_chunk, on_headers)
+
+			if response.status in (301, 302, 303, 307, 308):
+				location = response.header("location")
+				if not location:
+					raise GodotHttpError("Redirect without location from {url}".format(url=url))
+				url = urljoin(url, location)
+				continue
+
+			if response.status >= 400:
+				raise GodotHttpError("HTTP {status} while fetching {url}".format(status=response.status, url=url), status=response.status)
+
+			return response
+
+		raise GodotHttpError("Too many redirects while fetching {url}".format(url=url))
+
+	def __request_with_retries(self, url, headers, on_chunk, on_headers):
+		split = urlsplit(url)
+		path  = split.path or "/"
+		if split.query:
+			path += "?" + split.query
+
+		last_error = None
+		streamed   = False
+		for attempt in range(self.retries + 1):
+			if attempt > 0:
+				time.sleep(self.backoff * (2 ** (attempt - 1)))
+
+			connection = self.__get_connection(split.scheme, split.netloc)
+			with self.__all_lock:
+				self.request_count += 1
+			try:
+				connection.request("GET", path, headers=headers)
+				raw = connection.getresponse()
+
+				if on_chunk and 200 <= raw.status < 300:
+					body = None
+					if on_headers:
+						on_headers({ k.lower(): v for k, v in raw.getheaders() })
+					for chunk in iter(lambda: raw.read(self.chunk_size), b""):
+						streamed = True
+						on_chunk(chunk)
+				else:
+					body = raw.read()
+			except (http.client.HTTPException, socket.timeout, OSError) as e:
+				# A kept-alive socket may have been closed by the server, start over
+				# on a fresh connection.
+				self.__drop_connection(split.scheme, split.netloc)
+				last_error = e
+
+				# The consumer has already seen part of the body, replaying it is
+				# not something we can do behind its back.
+				if streamed:
+					break
+				continue
+
+			response_headers = { k.lower(): v for k, v in raw.getheaders() }
+			if raw.will_close:
+				self.__drop_connection(split.scheme, split.netloc)
+
+			if raw.status >= 500:
+				last_error = GodotHttpError("HTTP {status} while fetching {url}".format(status=raw.status, url=url))
+				continue
+
+			return GodotHttpResponse(url, raw.status, response_headers, body)
+
+		raise GodotHttpError("Giving up on {url}: {error}".format(url=url, error=last_error))
\ No newline at end of file
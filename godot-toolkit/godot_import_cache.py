@@ -0,0 +1,309 @@
+"""Cache of Godot's imported assets shared between checkouts and machines.
+"""
+
+import os, re, abc, time, shutil, hashlib, threading, importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from godot_file_index import GodotFileIndex
+
+
+class GodotImportCacheRemote(abc.ABC):
+	'''Interface of a store shared between machines, e.g. a bucket or an HTTP
+	cache. Entries are small directories of the files Godot imported one asset
+	into, named by their key. A remote is a module defining an ImportCacheRemote
+	class with these two methods, see --import-cache-remote.
+	'''
+
+	@abc.abstractmethod
+	def fetch(self, key, dest_dir):
+		'''Copies the files of entry `key` into the empty directory `dest_dir`.
+		Returns False if the store doesn't have the entry.
+		'''
+		pass
+
+	@abc.abstractmethod
+	def upload(self, key, src_dir):
+		'''Stores the files in `src_dir` as entry `key`. Entries never change, one
+		that is already stored can be skipped.
+		'''
+		pass
+
+
+class GodotImportCacheDirectoryRemote(GodotImportCacheRemote):
+	'''A remote living in a directory, e.g. a network mount every CI agent sees.
+	'''
+
+	def __init__(self, path):
+		self.path = path
+
+	def fetch(self, key, dest_dir):
+		entry_dir = os.path.join(self.path, key[:2], key)
+		if not os.path.isdir(entry_dir):
+			return False
+
+		for name in os.listdir(entry_dir):
+			shutil.copy2(os.path.join(entry_dir, name), os.path.join(dest_dir, name))
+
+		return True
+
+	def upload(self, key, src_dir):
+		entry_dir = os.path.join(self.path, key[:2], key)
+		if os.path.isdir(entry_dir):
+			return
+
+		tmp_dir = "{path}.{pid}.{thread}.tmp".format(path=entry_dir, pid=os.getpid(), thread=threading.get_ident())
+		shutil.copytree(src_dir, tmp_dir)
+		try:
+			os.replace(tmp_dir, entry_dir)
+		except OSError:
+			# Somebody else uploaded it in the meantime
+			shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class GodotImportCache():
+	'''Keeps what Godot imported every asset of a project into, so a fresh
+	checkout doesn't import everything again during the export. An asset's
+	entry holds the files in the import directory (.import, .godot/imported
+	for Godot 4) named after it, the imported resources and the .md5 file that
+	tells Godot they are up to date. It's keyed on:
+
+	  * the content of the source asset
+	  * the content of its .import file, the import settings
+	  * its path in the project, the imported files are named after it
+	  * the Godot binary
+
+	restore() copies the entries of every asset whose key is in the cache into
+	the directory Godot exports from, assets the cache doesn't know are left to
+	Godot, and save() stores those once the export succeeded. Entries are kept
+	in `cache_path` and, when there is one, fetched from and uploaded to a
+	GodotImportCacheRemote shared with other machines.
+	'''
+
+	format_version = "1"
+
+	ignored_dirs = (".git", ".svn", ".hg", ".import", ".godot")
+
+	# Imported files are named <source file name>-<md5 of its res:// path>.<ext>
+	imported_re = re.compile(r'^(.+-[0-9a-f]{32}\.)')
+
+	def __init__(self, cache_path, remote=None, jobs=8, file_index=None):
+		self.cache_path = cache_path
+		self.remote     = remote
+		self.jobs       = max(1, jobs)
+		self.file_index = file_index or GodotFileIndex(os.path.join(cache_path, "file_index.json"), jobs=jobs)
+
+	@staticmethod
+	def load_remote(spec):
+		'''A remote from the command line: a directory, or the path of a module
+		defining an ImportCacheRemote class.
+		'''
+		if os.path.isdir(spec):
+			return GodotImportCacheDirectoryRemote(spec)
+
+		if not os.path.isfile(spec):
+			raise ValueError("Import cache remote {spec} is neither a directory nor a module".format(spec=spec))
+
+		module_spec = importlib.util.spec_from_file_location("godot_import_cache_remote", spec)
+		module      = importlib.util.module_from_spec(module_spec)
+		module_spec.loader.exec_module(module)
+
+		if not hasattr(module, "ImportCacheRemote"):
+			raise ValueError("Import cache remote {spec} has no ImportCacheRemote class defined".format(spec=spec))
+
+		return module.ImportCacheRemote()
+
+	@staticmethod
+	def import_dir(project_path):
+		'''Where Godot keeps imported resources, relative to the project.
+		'''
+		if os.path.isdir(os.path.join(project_path, ".godot")):
+			return os.path.join(".godot", "imported")
+
+		project_file = os.path.join(project_path, "project.godot")
+		if os.path.isfile(project_file):
+			with open(project_file, 'r', encoding="utf-8", errors="replace") as f:
+				for line in f:
+					if line.startswith("config_version="):
+						if line.split("=", 1)[1].strip().isdigit() and int(line.split("=", 1)[1]) >= 5:
+							return os.path.join(".godot", "imported")
+						break
+
+		return ".import"
+
+	def scan(self, project_path, godot_bin_path):
+		'''Lists the imported assets of a project, [{path, prefix, key}].
+		'''
+		project_path = os.path.realpath(project_path)
+
+		sources = []
+		for root, dirs, files in os.walk(project_path):
+			dirs[:] = sorted(d for d in dirs if d not in self.ignored_dirs)
+			for f in files:
+				if f.endswith(".import") and len(f) > len(".import") and os.path.isfile(os.path.join(root, f[:-len(".import")])):
+					sources.append(os.path.join(root, f[:-len(".import")]))
+
+		hashes = self.file_index.hash_files([godot_bin_path] + sources + [source + ".import" for source in sources])
+		self.file_index.save()
+
+		assets = []
+		for source in sources:
+			res_path = "res://" + os.path.relpath(source, project_path).replace(os.sep, "/")
+
+			hasher = hashlib.sha256()
+			hasher.update("\0".join([self.format_version, hashes[godot_bin_path], res_path, hashes[source], hashes[source + ".import"]]).encode("utf-8"))
+
+			assets.append({
+				"path":   res_path,
+				"prefix": os.path.basename(source) + "-" + hashlib.md5(res_path.encode("utf-8")).hexdigest() + ".",
+				"key":    hasher.hexdigest(),
+			})
+
+		return assets
+
+	def restore(self, project_path, working_dir, godot_bin_path):
+		'''Puts the cached imports of the project's assets into `working_dir`.
+		Returns the restore, to be handed to save() after the export, with the
+		`assets` and how many were `restored`, `current` (the working directory
+		already had them) and `missing` from the cache.
+		'''
+		start_time = time.perf_counter()
+
+		import_dir = self.import_dir(project_path)
+		dest_dir   = os.path.join(working_dir, import_dir)
+		assets     = self.scan(project_path, godot_bin_path)
+
+		if assets and not os.path.isdir(dest_dir):
+			os.makedirs(dest_dir)
+		existing = self.__imported_files(dest_dir) if os.path.isdir(dest_dir) else {}
+
+		def restore_one(asset):
+			if not self.__fetch(asset["key"]):
+				return "missing"
+
+			entry_dir = self.__entry_dir(asset["key"])
+			names = os.listdir(entry_dir)
+			if self.__is_current(entry_dir, dest_dir, names, existing.get(asset["prefix"], ())):
+				return "current"
+
+			for name in names:
+				tmp_path = os.path.join(dest_dir, "{name}.{pid}.{thread}.tmp".format(name=name, pid=os.getpid(), thread=threading.get_ident()))
+				shutil.copy2(os.path.join(entry_dir, name), tmp_path)
+				os.replace(tmp_path, os.path.join(dest_dir, name))
+
+			return "restored"
+
+		with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+			states = list(executor.map(restore_one, assets))
+
+		for asset, state in zip(assets, states):
+			asset["state"] = state
+
+		return {
+			"import_dir": import_dir,
+			"assets":     assets,
+			"restored":   states.count("restored"),
+			"current":    states.count("current"),
+			"missing":    states.count("missing"),
+			"stored":     0,
+			"seconds":    time.perf_counter() - start_time,
+		}
+
+	def save(self, restore, working_dir):
+		'''Stores the imports of the assets the cache didn't have after Godot
+		imported them in `working_dir`. Returns how many were stored.
+		'''
+		dest_dir = os.path.join(working_dir, restore["import_dir"])
+		existing = self.__imported_files(dest_dir) if os.path.isdir(dest_dir) else {}
+
+		def save_one(asset):
+			names = existing.get(asset["prefix"], ())
+
+			# Without its .md5 file Godot would import the asset again anyway
+			if asset["state"] != "missing" or not any(name.endswith(".md5") for name in names):
+				return False
+
+			return self.__store(asset["key"], dest_dir, names)
+
+		with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+			restore["stored"] = sum(1 for stored in executor.map(save_one, restore["assets"]) if stored)
+
+		return restore["stored"]
+
+	def __entry_dir(self, key):
+		return os.path.join(self.cache_path, "entries", key[:2], key)
+
+	def __fetch(self, key):
+		'''Whether the entry is in the local store, fetching it from the remote
+		if it isn't.
+		'''
+		entry_dir = self.__entry_dir(key)
+		if os.path.isdir(entry_dir):
+			return True
+		if self.remote == None:
+			return False
+
+		tmp_dir = "{path}.{pid}.{thread}.tmp".format(path=entry_dir, pid=os.getpid(), thread=threading.get_ident())
+		os.makedirs(tmp_dir)
+		try:
+			if not self.remote.fetch(key, tmp_dir):
+				return False
+
+			try:
+				os.replace(tmp_dir, entry_dir)
+			except OSError:
+				# Fetched by another export at the same time
+				pass
+		finally:
+			if os.path.isdir(tmp_dir):
+				shutil.rmtree(tmp_dir, ignore_errors=True)
+
+		return True
+
+	def __store(self, key, src_dir, names):
+		entry_dir = self.__entry_dir(key)
+		if os.path.isdir(entry_dir):
+			return False
+
+		tmp_dir = "{path}.{pid}.{thread}.tmp".format(path=entry_dir, pid=os.getpid(), thread=threading.get_ident())
+		os.makedirs(tmp_dir)
+		try:
+			for name in names:
+				shutil.copy2(os.path.join(src_dir, name), os.path.join(tmp_dir, name))
+
+			try:
+				os.replace(tmp_dir, entry_dir)
+			except OSError:
+				return False
+		finally:
+			if os.path.isdir(tmp_dir):
+				shutil.rmtree(tmp_dir, ignore_errors=True)
+
+		if self.remote != None:
+			self.remote.upload(key, entry_dir)
+
+		return True
+
+	def __imported_files(self, import_dir):
+		'''{prefix: [file names]} of the files in the import directory.
+		'''
+		files = {}
+		for name in os.listdir(import_dir):
+			match = self.imported_re.match(name)
+			if match:
+				files.setdefault(match.group(1), []).append(name)
+
+		return files
+
+	def __is_current(self, entry_dir, dest_dir, names, existing):
+		if not set(names).issubset(existing):
+			return False
+
+		for name in names:
+			if not name.endswith(".md5"):
+				continue
+
+			# The .md5 file holds the hashes of the source and the imported files
+			with open(os.path.join(entry_dir, name), 'rb') as a, open(os.path.join(dest_dir, name), 'rb') as b:
+				if a.read() != b.read():
+					return False
+
+		return True
@@ -1,32 +1,58 @@
 """A Godot version manager
 """
 
-import json, urllib, os, platform, sys, zipfile, shutil, datetime
-from urllib.request import urlopen
-import urllib.request
-from distutils.version import LooseVersion
+import os, sys, shutil, time, stat, threading
 
+# The catalogue, the downloader and zipfile pull in the HTTP stacks and
+# compression modules, they are imported by the commands that need them so
+# local commands start quickly.
 from godot_toolkit_config import GodotToolkitConfig
-from godot_binaries_cache import GodotBinariesCache
-from godot_binaries_cache import VersionOrReleaseError
-from godot_binaries_manifest import GodotBinariesManifest
 from godot_sys_arch import GodotSystemArch
 from godot_sys_arch import UnknownSysArch
+from godot_file_lock import GodotFileLock
 
-try:
-	import requests
-except:
-	print("[-] requests Python module needs to be installed. Install it with `pip install requests`")
-	exit()
+
+class _BatchProgress():
+	'''Aggregate progress bar over several concurrent downloads.
+	'''
+
+	def __init__(self, count):
+		self.count    = count
+		self.finished = 0
+		self.items    = {}
+		self.lock     = threading.Lock()
+
+	def update(self, key, downloaded, total):
+		with self.lock:
+			self.items[key] = (downloaded, total)
+			self.__draw()
+
+	def finish(self, key):
+		with self.lock:
+			self.finished += 1
+			self.__draw()
+
+	def __draw(self):
+		downloaded = sum(item[0] for item in self.items.values())
+		total      = sum(item[1] or item[0] for item in self.items.values())
+
+		done = int(50*downloaded/total) if total else 0
+		sys.stdout.write('\r[{}{}] {finished}/{count} done, {downloaded:.1f}/{total:.1f} MiB'.format(
+			'█' * done, '.' * (50-done), finished=self.finished, count=self.count,
+			downloaded=downloaded / (1024*1024), total=total / (1024*1024)))
+		sys.stdout.flush()
 
 
 class GodotManager():
 	version = "0.1"
 
-	def __init__(self):
+	def __init__(self, auto_recache=True, sync=False):
 		self.godot_toolkit_config = GodotToolkitConfig()
-		self.manifest             = GodotBinariesManifest()
-		self.cache                = GodotBinariesCache()
+
+		# Whether loading the catalogue may refresh it when it's stale, and
+		# whether to wait for that refresh instead of running it in the background
+		self.auto_recache = auto_recache
+		self.sync         = sync
 
 		self.binaries_dir = self.godot_toolkit_config.get_adjusted_path("godot_cli", "godot_binaries_path")
 		self.download_tmp = self.godot_toolkit_config.get_adjusted_path("godot_cli", "download_tmp")
@@ -34,51 +60,368 @@ class GodotManager():
 		if not os.path.exists(self.download_tmp):
 			os.makedirs(self.download_tmp)
 
+		self.__manifest   = None
+		self.__cache      = None
+		self.__downloader = None
+
+	@property
+	def manifest(self):
+		if self.__manifest == None:
+			from godot_binaries_manifest import GodotBinariesManifest
+			if GodotBinariesManifest.resident != None:
+				self.__manifest = GodotBinariesManifest.resident
+			else:
+				self.__manifest = GodotBinariesManifest()
+
+		return self.__manifest
+
+	@property
+	def cache(self):
+		'''The catalogue of available versions, loaded on first use.
+		'''
+		if self.__cache == None:
+			from godot_binaries_cache import GodotBinariesCache
+			if GodotBinariesCache.resident != None:
+				self.__cache = GodotBinariesCache.resident
+				if self.auto_recache:
+					self.__cache.revalidate(self.sync)
+			else:
+				self.__cache = GodotBinariesCache(suppress_recache=not self.auto_recache, sync=self.sync)
+
+		return self.__cache
+
+	@property
+	def downloader(self):
+		if self.__downloader == None:
+			from godot_downloader import GodotDownloader
+			self.__downloader = GodotDownloader(
+				connections      = self.godot_toolkit_config.get_int("godot_cli", "download_connections", 1),
+				min_segment_size = self.godot_toolkit_config.get_int("godot_cli", "download_min_segment_size", 8*1024*1024),
+				chunk_size       = self.godot_toolkit_config.get_int("godot_cli", "download_chunk_size", 1024*1024),
+				timeout          = self.godot_toolkit_config.get_float("godot_cli", "download_timeout", 60),
+				retries          = self.godot_toolkit_config.get_int("godot_cli", "download_retries", 3))
+
+		return self.__downloader
+
 	def download_version(self, version="latest", release="stable", sys_arch: GodotSystemArch=GodotSystemArch.from_current_os()):
-		file_download_url = None
-		file_name         = None
+		result = self.__download_and_install(version, release, sys_arch, progress=self.print_progress)
+		if result["status"] == "failed":
+			print("An error occurred while downloading {version}: {error}".format(version=version, error=result["error"]))
+			return False
+
+		if result["status"] == "present":
+			print("Already have this version")
+
+		return True
+
+	def download_templates(self, version="latest", release="stable"):
+		'''Downloads the export templates archive (.tpz) of a version into the binaries
+		store, where it's kept as it is and registered in the manifest along with
+		the list of its members. The exporter extracts the templates it needs from
+		it, see GodotExportTemplates. Returns a dict with the `status` (installed,
+		present or failed), `error` and bytes `fetched`.
+		'''
+		import zipfile
+		from godot_binaries_cache import VersionOrReleaseError
+		from godot_downloader import DownloadError
+
+		try:
+			version, release = self.cache.resolve(version, release)
+			file_download_url, file_name = self.cache.construct_templates_url(version, release)
+		except VersionOrReleaseError as e:
+			return { "status": "failed", "error": str(e), "fetched": 0 }
+
+		if self.manifest.get_templates_path(version, release):
+			return { "status": "present", "error": None, "fetched": 0 }
+
+		full_tpz_path = os.path.join(self.download_tmp, file_name)
+
+		download_lock = GodotFileLock(full_tpz_path + ".lock")
+		if not download_lock.acquire(blocking=False):
+			print("[+] Waiting for another process downloading {file_name}".format(file_name=file_name))
+			download_lock.acquire()
+
 		try:
+			self.manifest.load_manifest()
+			if self.manifest.get_templates_path(version, release):
+				return { "status": "present", "error": None, "fetched": 0 }
+
+			try:
+				result = self.downloader.download(file_download_url, full_tpz_path, progress=self.print_progress)
+			except DownloadError as e:
+				return { "status": "failed", "error": str(e), "fetched": 0 }
+			finally:
+				sys.stdout.write('\n')
+
+			# The central directory lists every member without decompressing any
+			try:
+				with zipfile.ZipFile(full_tpz_path, 'r') as zip_ref:
+					members = { member.filename: member.file_size for member in zip_ref.infolist() if not member.is_dir() }
+			except zipfile.BadZipFile as e:
+				os.remove(full_tpz_path)
+				return { "status": "failed", "error": "{file_name} is not a valid archive: {error}".format(file_name=file_name, error=e), "fetched": result["fetched"] }
+
+			blob_relative_path = self.manifest.add_blob(full_tpz_path, result["sha256"], ".tpz")
+			self.manifest.add_installed_templates(version, release, blob_relative_path, result["sha256"], members)
+		finally:
+			download_lock.release()
+
+		print("[+] Installed export templates of {version} {release}: {count} templates, {mib:.1f} MiB".format(
+			version=version, release=release, count=len(members), mib=result["size"] / (1024*1024)))
+
+		return { "status": "installed", "error": None, "fetched": result["fetched"] }
+
+	def download_batch(self, entries, jobs=4):
+		'''Downloads and installs a list of (version, release, sys_arch) entries. Every
+		entry is resolved against the catalogue up front, entries that are already in
+		the manifest are skipped and the rest are fetched by up to `jobs` workers.
+		Prints aggregate progress and a summary, returns the per entry results.
+		'''
+		from godot_binaries_cache import VersionOrReleaseError
+
+		start_time = time.perf_counter()
+
+		results = []
+		queue   = []
+		seen    = set()
+		for version, release, sys_arch in entries:
+			result = { "version": version, "release": release, "arch": sys_arch.name, "status": None, "error": None, "fetched": 0, "seconds": 0.0 }
+
+			# Specs like latest or 3.1.x are resolved first so that entries naming
+			# the same build are only fetched once
+			try:
+				version, release = self.cache.resolve(version, release)
+				self.cache.construct_download_url(version, release, sys_arch)
+			except VersionOrReleaseError as e:
+				result["status"] = "failed"
+				result["error"]  = str(e)
+
+			if (version, release, sys_arch) in seen:
+				continue
+			seen.add((version, release, sys_arch))
+
+			result["version"] = version
+			result["release"] = release
+			results.append(result)
+
+			if result["status"] == "failed":
+				continue
+
+			expected_sha256 = self.cache.get_download_sha256(version, sys_arch)
+			bin_info = self.manifest.get_binary_info(version, release, sys_arch)
+			if bin_info and (expected_sha256 == None or bin_info.get("source_sha256") == expected_sha256):
+				result["status"] = "present"
+				continue
+
+			queue.append((result, sys_arch))
+
+		print("[+] {total} entries, {present} already installed, {failed} unresolved, {queued} to download".format(
+			total=len(results), present=sum(1 for r in results if r["status"] == "present"),
+			failed=sum(1 for r in results if r["status"] == "failed"), queued=len(queue)))
+
+		progress = _BatchProgress(len(queue))
+
+		def work(item):
+			result, sys_arch = item
+			item_start = time.perf_counter()
+
+			outcome = self.__download_and_install(result["version"], result["release"], sys_arch,
+			                                      progress=lambda downloaded, total: progress.update(id(result), downloaded, total))
+			result.update(outcome)
+			result["seconds"] = time.perf_counter() - item_start
+			progress.finish(id(result))
+
+			return result
+
+		if queue:
+			from concurrent.futures import ThreadPoolExecutor
+			with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+				list(executor.map(work, queue))
+			sys.stdout.write('\n')
+
+		self.print_batch_summary(results, time.perf_counter() - start_time)
+
+		return results
+
+	def print_batch_summary(self, results, seconds):
+		print("[+] Batch summary")
+		for result in results:
+			line = "{version:<10} {release:<10} {arch:<22} {status:<9}".format(**result)
+			if result["status"] in ("installed", "reused"):
+				throughput = result["fetched"] / result["seconds"] / (1024*1024) if result["seconds"] > 0 else 0
+				line += " {mib:8.1f} MiB {seconds:7.2f}s {throughput:7.1f} MiB/s".format(mib=result["fetched"] / (1024*1024), seconds=result["seconds"], throughput=throughput)
+			elif result["status"] == "failed":
+				line += " " + str(result["error"])
+			print(" ├── " + line if result is not results[-1] else " └── " + line)
+
+		fetched = sum(result["fetched"] for result in results)
+		print("[+] Fetched {mib:.1f} MiB in {seconds:.2f}s ({throughput:.1f} MiB/s), {failed} failed".format(
+			mib=fetched / (1024*1024), seconds=seconds, throughput=fetched / seconds / (1024*1024) if seconds > 0 else 0,
+			failed=sum(1 for r in results if r["status"] == "failed")))
+
+	def __download_and_install(self, version, release, sys_arch, progress=None):
+		'''Returns a dict with the `status` (installed, reused, present or failed),
+		`error` and bytes `fetched`.
+		'''
+		from godot_binaries_cache import VersionOrReleaseError
+		from godot_downloader import DownloadError
+
+		try:
+			version, release = self.cache.resolve(version, release)
 			file_download_url, file_name = self.cache.construct_download_url(version, release, sys_arch)
 		except VersionOrReleaseError as e:
-			print("An error occurred while downloading {version}: {error}".format(version=version, error=e))
-			return False
+			return { "status": "failed", "error": str(e), "fetched": 0 }
+
+		expected_sha256 = self.cache.get_download_sha256(version, sys_arch)
 
 		# Check to see if we don't already have the requested file downloaded
 		bin_info = self.manifest.get_binary_info(version, release, sys_arch)
-		if bin_info:
-			print("Already have this version")
-			return True
+		if bin_info and (expected_sha256 == None or bin_info.get("source_sha256") == expected_sha256):
+			return { "status": "present", "error": None, "fetched": 0 }
+
+		# The same archive may already be installed under another name
+		if expected_sha256:
+			known = self.manifest.find_binary_by_sha256(source_sha256=expected_sha256)
+			if known:
+				print("[+] Identical binary already stored, reusing it")
+				self.manifest.add_installed_binary(version, release, sys_arch, known["bin"], sha256=known["sha256"], source_sha256=expected_sha256)
+				return { "status": "reused", "error": None, "fetched": 0 }
+
+		full_zip_path = os.path.join(self.download_tmp, file_name)
+
+		# Only one process downloads a given file, everybody else waits for it and
+		# then finds the binary in the manifest.
+		download_lock = GodotFileLock(full_zip_path + ".lock")
+		if not download_lock.acquire(blocking=False):
+			print("[+] Waiting for another process downloading {file_name}".format(file_name=file_name))
+			download_lock.acquire()
+
+		try:
+			self.manifest.load_manifest()
+			bin_info = self.manifest.get_binary_info(version, release, sys_arch)
+			if bin_info and (expected_sha256 == None or bin_info.get("source_sha256") == expected_sha256):
+				return { "status": "present", "error": None, "fetched": 0 }
+
+			try:
+				result = self.downloader.download(file_download_url, full_zip_path, progress=progress, expected_sha256=expected_sha256)
+			except DownloadError as e:
+				return { "status": "failed", "error": str(e), "fetched": 0 }
+			finally:
+				if progress == self.print_progress:
+					sys.stdout.write('\n')
+
+			# Pull the gold out of the archive and straight into the binaries directory
+			self.install(full_zip_path, version, release, sys_arch, source_sha256=result["sha256"])
+
+			# Remove intermediate files
+			if os.path.exists(full_zip_path):
+				os.remove(full_zip_path)
+		finally:
+			download_lock.release()
+
+		return { "status": "installed", "error": None, "fetched": result["fetched"] }
+
+	def install(self, archive_path, version, release, sys_arch: GodotSystemArch, source_sha256=None):
+		'''Installs the Godot binary from a downloaded archive into the binaries store
+		and registers it in the manifest. Only the binary member is decompressed and it
+		is hashed while being written once, to a temporary file inside the store which
+		is then renamed to its content address. Archives that aren't zips (nightly
+		AppImages) are moved as they are. Returns a dict of install stats.
+		'''
+		import zipfile, hashlib
+
+		start_time = time.perf_counter()
 
-		with open(os.path.join(self.download_tmp, file_name), 'wb') as f:
-			response = requests.get(file_download_url, stream=True)
-			total = response.headers.get('content-length')
+		binary_name = sys_arch.get_formatted_binary_name(version, release)
+		extension   = self.manifest.binary_extension(binary_name)
+		blobs_dir   = os.path.join(self.binaries_dir, "blobs")
+		tmp_path    = os.path.join(blobs_dir, "{name}.{pid}.tmp".format(name=binary_name, pid=os.getpid()))
 
-			if total is None:
-				f.write(response.content)
+		if not os.path.exists(blobs_dir):
+			os.makedirs(blobs_dir)
+
+		# Nothing to write if this exact archive was installed before
+		known = self.manifest.find_binary_by_sha256(source_sha256=source_sha256) if source_sha256 else None
+		if known:
+			self.manifest.add_installed_binary(version, release, sys_arch, known["bin"], sha256=known["sha256"], source_sha256=source_sha256)
+			print("[+] Installed {name}: identical to an already stored binary".format(name=binary_name))
+			return { "path": os.path.join(self.binaries_dir, known["bin"]), "bytes_written": 0, "extract_bytes_before": 0, "seconds": time.perf_counter() - start_time, "sha256": known["sha256"] }
+
+		bytes_written        = 0
+		extract_bytes_before = 0
+		try:
+			if zipfile.is_zipfile(archive_path):
+				with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+					members = [member for member in zip_ref.infolist() if not member.is_dir()]
+					if not members:
+						raise zipfile.BadZipFile("{archive} contains no files".format(archive=archive_path))
+
+					# The editor binary dwarfs anything else that ships alongside it
+					member = max(members, key=lambda m: m.file_size)
+
+					hasher = hashlib.sha256()
+					with zip_ref.open(member) as src, open(tmp_path, 'wb') as dst:
+						for data in iter(lambda: src.read(1024*1024), b""):
+							hasher.update(data)
+							dst.write(data)
+						bytes_written = dst.tell()
+					sha256 = hasher.hexdigest()
+
+					# What unzip() + add_binary() write for the same archive
+					extract_bytes_before = sum(m.file_size for m in members) + member.file_size
 			else:
-				downloaded = 0
-				total = int(total)
-				for data in response.iter_content(chunk_size=max(int(total/1000), 1024*1024)):
-					downloaded += len(data)
-					f.write(data)
-					done = int(50*downloaded/total)
-					sys.stdout.write('\r[{}{}]'.format('█' * done, '.' * (50-done)))
-					sys.stdout.flush()
-		sys.stdout.write('\n')
+				shutil.move(archive_path, tmp_path)
+				extract_bytes_before = os.path.getsize(tmp_path)
 
-		full_zip_path = os.path.join(self.download_tmp, file_name)
+				# The archive is the binary, so its hash is the content address
+				sha256 = source_sha256 or self.__sha256_file(tmp_path)
+
+			mode = os.stat(tmp_path).st_mode
+			os.chmod(tmp_path, mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+			deduplicated = self.manifest.has_blob(sha256, extension)
+			blob_relative_path = self.manifest.add_blob(tmp_path, sha256, extension)
+		finally:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+
+		self.manifest.add_installed_binary(version, release, sys_arch, blob_relative_path, sha256=sha256, source_sha256=source_sha256)
+
+		stats = {
+			"path":                 os.path.join(self.binaries_dir, blob_relative_path),
+			"bytes_written":        bytes_written,
+			"extract_bytes_before": extract_bytes_before,
+			"seconds":              time.perf_counter() - start_time,
+			"sha256":               sha256,
+		}
+
+		print("[+] Installed {name}: {written:.1f} MiB written in {seconds:.2f}s (extract and copy would write {before:.1f} MiB){dedup}".format(
+			name=binary_name, written=bytes_written / (1024*1024), seconds=stats["seconds"], before=extract_bytes_before / (1024*1024),
+			dedup=", deduplicated against an identical stored binary" if deduplicated else ""))
+
+		return stats
+
+	def __sha256_file(self, path):
+		import hashlib
 
-		# Unzip and retrieve the gold inside
-		binary_filename = self.unzip(file_name)
+		hasher = hashlib.sha256()
+		with open(path, 'rb') as f:
+			for data in iter(lambda: f.read(1024*1024), b""):
+				hasher.update(data)
 
-		# Ingest the binary into the manifest
-		self.manifest.add_binary(version, release, sys_arch, os.path.join(full_zip_path + ".unzip", binary_filename))
+		return hasher.hexdigest()
 
-		# Remove intermediate files
-		os.remove(full_zip_path)
-		shutil.rmtree(full_zip_path + ".unzip")
+	def print_progress(self, downloaded, total):
+		if total:
+			done = int(50*downloaded/total)
+			sys.stdout.write('\r[{}{}]'.format('█' * done, '.' * (50-done)))
+		else:
+			sys.stdout.write('\r[{:.1f} MiB]'.format(downloaded / (1024*1024)))
+		sys.stdout.flush()
 
 	def unzip(self, src_filename):
+		import zipfile
+
 		zip_full_path = os.path.join(self.download_tmp, src_filename)
 		unzip_dest_path = os.path.join(self.download_tmp, src_filename + ".unzip")
 
@@ -96,36 +439,186 @@ class GodotManager():
 
 		return binary_filename
 
-	def recache(self):
-		self.cache.recache()
+	@staticmethod
+	def expand_batch_specs(specs):
+		'''Turns batch entries like "3.1,3.2/stable,rc1/linux,win64" into the list of
+		(version, release, sys_arch) combinations they describe. Release defaults to
+		stable and arch to the current system.
+		'''
+		entries = []
+		for spec in specs:
+			parts    = spec.replace(" ", "/").split("/")
+			versions = parts[0].split(",")
+			releases = parts[1].split(",") if len(parts) > 1 and parts[1] else ["stable"]
+			archs    = parts[2].split(",") if len(parts) > 2 and parts[2] else [None]
+
+			for version in versions:
+				for release in releases:
+					for arch in archs:
+						try:
+							sys_arch = GodotSystemArch.from_os_string(arch)
+						except UnknownSysArch:
+							raise UnknownSysArch(arch)
+						entries.append((version, release, sys_arch))
+
+		return entries
+
+	def recache(self, full=False):
+		self.cache.recache(full)
+
+	def describe_versions(self, spec="*"):
+		'''Versions matching `spec` with their releases and the architectures
+		those are published for (None where unknown), straight from the version
+		index without touching the network.
+		'''
+		index = self.cache.version_index
+
+		versions = []
+		for version in index.select(spec):
+			versions.append({
+				"version":  version,
+				"releases": [{ "release": release, "channel": index.release_channel(release), "arches": index.arches(version, release) } for release in index.releases(version)],
+			})
+
+		return versions
+
+	def print_versions(self, versions, with_releases=False):
+		print("[+] {n} versions, catalogue from {date}".format(n=len(versions), date=self.cache.get_cache().get("last_cache_datetime")))
+		for entry in versions:
+			last   = entry is versions[-1]
+			prefix = " └── " if last else " ├── "
+			releases = entry["releases"]
+
+			if not with_releases:
+				print(prefix + "{version:<10} {n:>3} releases{latest}".format(version=entry["version"], n=len(releases),
+				      latest=", latest " + releases[-1]["release"] if releases else ""))
+				continue
+
+			print(prefix + entry["version"])
+			for release in releases:
+				arches = ", ".join(release["arches"]) if release["arches"] != None else "architectures unknown"
+				print(("     " if last else " │   ") + (" └── " if release is releases[-1] else " ├── ") + "{release:<10} {arches}".format(release=release["release"], arches=arches))
 		
 
 if __name__ == '__main__':
 	import argparse
 	parser = argparse.ArgumentParser(prog='godot-cli', description='A CLI application that allows management and launch control over Godot versions.')
 	parser.add_argument('-v', '--version',             action='version',              version='%(prog)s version ' + GodotManager.version)
-	parser.add_argument('--avail-versions',            action='store_true',           help='Check what versions are available.')
-	parser.add_argument('--avail-releases',            action='store_true',           help='Check which releases of a specific version are available.')
-	parser.add_argument('--recache',                   action='store_true',           help='Check which releases of a specific version are available.')
-	parser.add_argument('--download',                  action='store_true',           help='Check which releases of a specific version are available.')
-	parser.add_argument('downloadversion', nargs='?', default="latest")
+	parser.add_argument('--avail-versions',            action='store_true',           help='List the available versions, optionally only those matching a spec like 3.1.x or ">=3.0,<3.2".')
+	parser.add_argument('--avail-releases',            action='store_true',           help='List the releases of the versions matching a spec (latest by default) and the architectures they are published for.')
+	parser.add_argument('--resolve',                   action='store_true',           help='Print the version and release a spec stands for, the download URL and the installed binary, if any.')
+	parser.add_argument('--json',                      action='store_true',           help='Print --avail-versions, --avail-releases and --resolve as JSON.')
+	parser.add_argument('--recache',                   action='store_true',           help='Refresh the catalogue of available versions, only rescraping what changed.')
+	parser.add_argument('--full-recache',              action='store_true',           help='Rebuild the catalogue of available versions from scratch.')
+	parser.add_argument('--sync',                      action='store_true',           help='Wait for a stale catalogue to be refreshed instead of refreshing it in the background.')
+	parser.add_argument('--download',                  action='store_true',           help='Download and install a version of Godot.')
+	parser.add_argument('--download-templates',        action='store_true',           help='Download the export templates of a version of Godot for godot-exporter --template-version.')
+	parser.add_argument('--batch',                     nargs='+', metavar='ENTRY',    help='Download several versions at once. Each entry is version[/release[/arch]], comma separated lists expand into every combination, e.g. 3.1,3.1.1/stable/linux,win64')
+	parser.add_argument('--batch-file',                type=str,                      help='File with one batch entry per line, lines starting with # are ignored.')
+	parser.add_argument('--jobs',                      type=int,                      help='Concurrent downloads in batch mode.')
+	parser.add_argument('--serve',                     action='store_true',           help='Run a caching mirror of the download server for other machines to use as base_dl_url.')
+	parser.add_argument('--host',                      type=str,                      help='Address the mirror listens on.')
+	parser.add_argument('--port',                      type=int,                      help='Port the mirror listens on.')
+	parser.add_argument('downloadversion', nargs='?', default=None)
 	parser.add_argument('downloadrelease', nargs='?', default="stable")
 	parser.add_argument('downloadarch', nargs='?', default=None)
 	args = parser.parse_args()
 
-	godot_manager = GodotManager()
+	if args.serve == True:
+		from godot_mirror import GodotMirror
 
-	if args.recache == True:
+		config = GodotToolkitConfig()
+		mirror = GodotMirror(
+			config.get_adjusted_path("godot_mirror", "mirror_path"),
+			config.get("godot_cli", "base_dl_url"),
+			nightly_urls = [config.get("godot_nightly", key) for key in ("manifest_url", "dl_url_linux", "dl_url_win64", "dl_url_win32", "dl_url_osx")],
+			listing_ttl  = config.get_float("godot_mirror", "mirror_listing_ttl", 600),
+			timeout      = config.get_float("godot_cli", "download_timeout", 60),
+			retries      = config.get_int("godot_cli", "download_retries", 3))
+		mirror.serve(args.host or config.get("godot_mirror", "mirror_host"), args.port or config.get_int("godot_mirror", "mirror_port", 8060))
+		quit()
+
+	# --recache refreshes the catalogue itself, no point doing it twice. Listings
+	# are answered offline from whatever catalogue there is.
+	listing = args.avail_versions or args.avail_releases or args.resolve
+	godot_manager = GodotManager(auto_recache=not (args.recache or args.full_recache or listing), sync=args.sync)
+
+	if args.recache == True or args.full_recache == True:
 		print("[+] Recaching")
-		godot_manager.unzip("Godot_v3.1-rc3_x11.64.zip", "")
+		godot_manager.recache(full=args.full_recache)
+
+	if listing:
+		from godot_version_index import VersionSpecError
 
-	if args.avail_versions == True:
-		print("TODO")
+		if "last_cache_datetime" not in godot_manager.cache.get_cache():
+			print("[-] There is no catalogue yet, build it with --recache")
+			sys.exit(1)
+
+		if args.resolve == True:
+			from godot_binaries_cache import VersionOrReleaseError
+
+			try:
+				sys_arch = GodotSystemArch.from_os_string(args.downloadarch)
+				version, release = godot_manager.cache.resolve(args.downloadversion or "latest", args.downloadrelease)
+				url, file_name = godot_manager.cache.construct_download_url(version, release, sys_arch)
+			except (VersionOrReleaseError, UnknownSysArch) as e:
+				print("[-] {error}".format(error=e))
+				sys.exit(1)
+
+			resolved = { "version": version, "release": release, "arch": sys_arch.to_file_suffix(), "url": url, "path": godot_manager.manifest.get_binary_path(version, release, sys_arch) }
+			if args.json == True:
+				import json
+				print(json.dumps(resolved, indent=4))
+			else:
+				print("{version} {release} {arch} {url} {path}".format(**dict(resolved, path=resolved["path"] or "-")))
+			quit()
+
+		spec = args.downloadversion or ("*" if args.avail_versions else "latest")
+		try:
+			versions = godot_manager.describe_versions(spec)
+		except VersionSpecError as e:
+			print("[-] {error}".format(error=e))
+			sys.exit(1)
+
+		if args.json == True:
+			import json
+			catalogue = godot_manager.cache.get_cache()
+			print(json.dumps({ "catalogue": catalogue.get("last_cache_datetime"), "versions": versions, "nightly": catalogue["versions"].get("nightly") }, indent=4))
+		else:
+			godot_manager.print_versions(versions, with_releases=args.avail_releases)
 		quit()
 
+	if args.batch or args.batch_file:
+		specs = list(args.batch or [])
+		if args.batch_file:
+			with open(args.batch_file, 'r') as f:
+				specs += [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+
+		try:
+			entries = GodotManager.expand_batch_specs(specs)
+		except UnknownSysArch as e:
+			print("Unknown arch {arch}".format(arch=e))
+			quit()
+
+		jobs = args.jobs or godot_manager.godot_toolkit_config.get_int("godot_cli", "download_jobs", 4)
+		results = godot_manager.download_batch(entries, jobs)
+		if any(result["status"] == "failed" for result in results):
+			sys.exit(1)
+
 	if args.download == True:
 		try:
 			sys_arch = GodotSystemArch.from_os_string(args.downloadarch)
-			godot_manager.download_version(args.downloadversion, args.downloadrelease, sys_arch)
 		except UnknownSysArch as e:
-			print("Unknown arch {arch}".format(arch=args.downloadarch))
\ No newline at end of file
+			print("Unknown arch {arch}".format(arch=args.downloadarch))
+			sys.exit(1)
+
+		if not godot_manager.download_version(args.downloadversion or "latest", args.downloadrelease, sys_arch):
+			sys.exit(1)
+
+	if args.download_templates == True:
+		result = godot_manager.download_templates(args.downloadversion or "latest", args.downloadrelease)
+		if result["status"] == "failed":
+			print("[-] An error occurred while downloading the export templates of {version}: {error}".format(version=args.downloadversion or "latest", error=result["error"]))
+			sys.exit(1)
+		if result["status"] == "present":
+			print("Already have these export templates")
\ No newline at end of file
@@ -0,0 +1,554 @@
+"""Caching mirror of the Godot download server for a local network.
+"""
+
+import os, re, json, time, html, hashlib, threading, posixpath
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from email.utils import formatdate
+
+from godot_http import GodotHttpPool, GodotHttpError
+from godot_dir_listing import GodotDirListingParser, GodotDirListingRow
+from godot_file_lock import GodotFileLock
+
+
+class _Flight():
+	def __init__(self):
+		self.done    = threading.Event()
+		self.started = threading.Event()
+		self.result  = None
+		self.error   = None
+		self.stream  = None
+
+
+class _ObjectStream():
+	'''An object on its way from upstream into the cache. Of its `size` bytes the
+	first `written` have reached `tmp_path`, which is moved to `object_path`
+	once complete.
+	'''
+
+	def __init__(self, object_path, tmp_path, size, last_modified):
+		self.object_path   = object_path
+		self.tmp_path      = tmp_path
+		self.size          = size
+		self.last_modified = last_modified
+		self.written       = 0
+		self.finished      = False
+		self.failed        = False
+		self.changed       = threading.Condition()
+
+	def open(self):
+		'''Opens the data received so far, wherever it is by now.
+		'''
+		with self.changed:
+			if self.failed:
+				raise GodotHttpError("Fetching {path} from upstream failed".format(path=self.object_path))
+			return open(self.object_path if self.finished else self.tmp_path, 'rb')
+
+	def wait_for(self, offset, timeout=1):
+		'''Waits until byte `offset` arrived, returns how many bytes are there.
+		'''
+		with self.changed:
+			while self.written <= offset and not self.finished:
+				self.changed.wait(timeout)
+			if self.failed:
+				raise GodotHttpError("Fetching {path} from upstream failed".format(path=self.object_path))
+			return self.written
+
+	def update(self, written=None, finished=False, failed=False):
+		with self.changed:
+			if written != None:
+				self.written = written
+			self.finished = self.finished or finished or failed
+			self.failed   = self.failed or failed
+			self.changed.notify_all()
+
+
+class GodotMirror():
+	'''Serves the layout of `upstream_url` from a local cache so build agents can
+	point `base_dl_url` at it. Nightly files are served under /nightly/<file name>
+	for every URL in `nightly_urls`.
+
+	Directory listings are kept as parsed rows and rendered as lighttpd style
+	pages, so GodotBinariesCache scrapes the mirror just like the real server.
+	They and the nightly files are revalidated upstream once they are older than
+	`listing_ttl` seconds, and served stale if upstream can't be reached.
+	Versioned archives never change and are fetched exactly once.
+
+	Concurrent misses for the same object share one upstream fetch, within the
+	process through a single flight and across processes through a file lock.
+	An object that isn't cached at all is streamed to the clients asking for it
+	while it downloads, so a cold fetch of a large archive doesn't keep them
+	waiting for the whole file. Upstream 4xx answers are passed on, other
+	upstream failures are answered with 502.
+	'''
+
+	range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+	def __init__(self, mirror_path, upstream_url, nightly_urls=(), listing_ttl=600, timeout=60, retries=3):
+		self.mirror_path  = mirror_path
+		self.upstream_url = upstream_url.rstrip("/")
+		self.nightly_urls = { posixpath.basename(url): url for url in nightly_urls if url }
+		self.listing_ttl  = listing_ttl
+
+		self.objects_dir  = os.path.join(mirror_path, "objects")
+		self.listings_dir = os.path.join(mirror_path, "listings")
+
+		self.http = GodotHttpPool(timeout=timeout, retries=retries)
+
+		self.stats = { "requests": 0, "hits": 0, "misses": 0, "upstream_fetches": 0, "stale": 0 }
+
+		self.__flights      = {}
+		self.__flights_lock = threading.Lock()
+		self.__stats_lock   = threading.Lock()
+
+	def serve(self, host="0.0.0.0", port=8060):
+		server = self.create_server(host, port)
+		print("[+] Mirroring {upstream} on http://{host}:{port}/ (cache in {path})".format(
+			upstream=self.upstream_url, host=host, port=server.server_address[1], path=self.mirror_path))
+		if self.nightly_urls:
+			print("[+] Nightly files under /nightly/: " + ", ".join(sorted(self.nightly_urls)))
+
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			server.server_close()
+			self.http.close()
+
+	def create_server(self, host, port):
+		class Handler(_GodotMirrorHandler):
+			mirror = self
+
+		return ThreadingHTTPServer((host, port), Handler)
+
+	def resolve(self, path):
+		'''Works out what a request path refers to. Returns one of
+		("listing", rel_dir), ("redirect", location), ("object", rel_path,
+		upstream_url, mutable) or None for paths outside the mirror.
+		'''
+		path = path.split("?", 1)[0]
+		segments = [segment for segment in path.split("/") if segment]
+		if any(segment in (".", "..") or "\\" in segment for segment in segments):
+			return None
+
+		if segments[:1] == ["nightly"]:
+			if len(segments) == 2 and segments[1] in self.nightly_urls:
+				return ("object", "nightly/" + segments[1], self.nightly_urls[segments[1]], True)
+			return None
+
+		rel_path = "/".join(segments)
+		if path.endswith("/") or not segments:
+			return ("listing", rel_path)
+
+		# Directories are asked for without the trailing slash, the parent's
+		# listing tells them apart from files.
+		parent = "/".join(segments[:-1])
+		try:
+			rows = self.get_listing(parent)
+		except GodotHttpError:
+			rows = []
+
+		for row in rows:
+			if row.href.rstrip("/") == segments[-1] or row.name == segments[-1]:
+				if row.type == "Directory" or row.href.endswith("/"):
+					return ("redirect", "/" + rel_path + "/")
+				break
+
+		return ("object", rel_path, self.upstream_url + "/" + rel_path, False)
+
+	def get_listing(self, rel_dir):
+		'''Returns the rows of the upstream listing of `rel_dir`.
+		'''
+		listing_path = os.path.join(self.listings_dir, *(rel_dir.split("/") + ["index.json"])) if rel_dir else os.path.join(self.listings_dir, "index.json")
+
+		listing = self.__read_json(listing_path)
+		if listing and time.time() - listing["fetched"] < self.listing_ttl:
+			self.count("hits")
+			return [GodotDirListingRow(*row) for row in listing["rows"]]
+
+		listing = self.__single_flight(listing_path, lambda flight: self.__refresh_listing(rel_dir, listing_path))
+		return [GodotDirListingRow(*row) for row in listing["rows"]]
+
+	def get_object(self, rel_path, upstream_url, mutable):
+		'''Returns (file path, metadata) of a cached file, fetching it first if
+		needed.
+		'''
+		object_path = os.path.join(self.objects_dir, *rel_path.split("/"))
+
+		meta = self.__read_json(object_path + ".json")
+		if meta and os.path.isfile(object_path) and (not mutable or time.time() - meta["fetched"] < self.listing_ttl):
+			self.count("hits")
+			return object_path, meta
+
+		meta = self.__single_flight(object_path, lambda flight: self.__refresh_object(object_path, upstream_url, mutable, flight))
+		return object_path, meta
+
+	def open_object(self, rel_path, upstream_url, mutable):
+		'''Like get_object() but returns (file path, metadata, stream). An object
+		that isn't cached yet comes back as an _ObjectStream, and no metadata, as
+		soon as upstream starts sending it.
+		'''
+		object_path = os.path.join(self.objects_dir, *rel_path.split("/"))
+		if os.path.isfile(object_path):
+			# Cached, at most to be revalidated
+			object_path, meta = self.get_object(rel_path, upstream_url, mutable)
+			return object_path, meta, None
+
+		flight = self.__single_flight(object_path, lambda flight: self.__refresh_object(object_path, upstream_url, mutable, flight), wait=False)
+		flight.started.wait()
+		if flight.stream == None:
+			flight.done.wait()
+			if flight.error:
+				raise flight.error
+			return object_path, flight.result, None
+
+		return object_path, None, flight.stream
+
+	def render_listing(self, rel_dir, rows):
+		title = html.escape("/" + rel_dir + ("/" if rel_dir else ""))
+		out = [
+			'<?xml version="1.0" encoding="utf-8"?>\n'
+			'<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">\n'
+			'<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en">\n'
+			'<head>\n<title>Index of ' + title + '</title>\n</head>\n<body>\n<h2>Index of ' + title + '</h2>\n'
+			'<div class="list">\n<table summary="Directory Listing" cellpadding="0" cellspacing="0">\n'
+			'<thead><tr><th class="n">Name</th><th class="m">Last Modified</th><th class="s">Size</th><th class="t">Type</th></tr></thead>\n'
+			'<tbody>\n'
+		]
+		for row in rows:
+			is_dir = row.type == "Directory"
+			out.append('<tr{cls}><td class="n"><a href="{href}">{name}</a>{slash}</td><td class="m">{mtime}</td><td class="s">{size}</td><td class="t">{type}</td></tr>\n'.format(
+				cls=' class="d"' if is_dir else "", href=html.escape(row.href), name=html.escape(row.name), slash="/" if is_dir else "",
+				mtime=html.escape(row.mtime), size=html.escape(row.size), type=html.escape(row.type)))
+		out.append('</tbody>\n</table>\n</div>\n<div class="foot">godot-cli mirror</div>\n</body>\n</html>\n')
+
+		return "".join(out).encode("utf-8")
+
+	def __refresh_listing(self, rel_dir, listing_path):
+		with GodotFileLock(listing_path + ".lock"):
+			# Somebody else may have refreshed it while we waited for the lock
+			listing = self.__read_json(listing_path)
+			if listing and time.time() - listing["fetched"] < self.listing_ttl:
+				self.count("hits")
+				return listing
+
+			self.count("misses")
+
+			headers = {}
+			if listing and listing.get("etag"):
+				headers["If-None-Match"] = listing["etag"]
+			if listing and listing.get("last_modified"):
+				headers["If-Modified-Since"] = listing["last_modified"]
+
+			rows   = []
+			parser = GodotDirListingParser(rows.append)
+			url    = self.upstream_url + "/" + rel_dir + ("/" if rel_dir else "")
+			try:
+				self.count("upstream_fetches")
+				response = self.http.request(url, headers=headers, on_chunk=parser.feed, on_headers=parser.set_headers)
+			except GodotHttpError as e:
+				if listing:
+					print("[!] {error}, serving the cached listing".format(error=e))
+					self.count("stale")
+					return listing
+				raise
+
+			if response.status == 304:
+				listing["fetched"] = time.time()
+			else:
+				parser.close()
+				listing = {
+					"rows":          [list(row) for row in rows],
+					"etag":          response.header("etag"),
+					"last_modified": response.header("last-modified"),
+					"fetched":       time.time(),
+				}
+
+			self.__write_json(listing_path, listing)
+
+			return listing
+
+	def __refresh_object(self, object_path, upstream_url, mutable, flight):
+		with GodotFileLock(object_path + ".lock"):
+			meta = self.__read_json(object_path + ".json")
+			if meta and os.path.isfile(object_path) and (not mutable or time.time() - meta["fetched"] < self.listing_ttl):
+				self.count("hits")
+				return meta
+
+			self.count("misses")
+
+			headers = {}
+			if meta and os.path.isfile(object_path):
+				if meta.get("upstream_etag"):
+					headers["If-None-Match"] = meta["upstream_etag"]
+				if meta.get("upstream_last_modified"):
+					headers["If-Modified-Since"] = meta["upstream_last_modified"]
+
+			tmp_path = "{path}.{pid}.{thread}.tmp".format(path=object_path, pid=os.getpid(), thread=threading.get_ident())
+			if not os.path.isdir(os.path.dirname(object_path)):
+				os.makedirs(os.path.dirname(object_path), exist_ok=True)
+
+			# Without a cached copy the clients get the file as it arrives, as long
+			# as upstream tells its size
+			stream = None
+			def on_headers(response_headers):
+				nonlocal stream
+				size = response_headers.get("content-length", "")
+				if stream == None and not headers and size.isdigit():
+					stream = flight.stream = _ObjectStream(object_path, tmp_path, int(size), response_headers.get("last-modified"))
+					flight.started.set()
+
+			hasher  = hashlib.sha256()
+			written = 0
+			try:
+				with open(tmp_path, 'wb') as f:
+					def on_chunk(data):
+						nonlocal written
+						f.write(data)
+						hasher.update(data)
+						written += len(data)
+						if stream:
+							f.flush()
+							stream.update(written)
+
+					try:
+						self.count("upstream_fetches")
+						response = self.http.request(upstream_url, headers=headers, on_chunk=on_chunk, on_headers=on_headers)
+					except GodotHttpError as e:
+						if meta and os.path.isfile(object_path):
+							print("[!] {error}, serving the cached file".format(error=e))
+							self.count("stale")
+							return meta
+						raise
+
+				if response.status == 304:
+					meta["fetched"] = time.time()
+				else:
+					if stream and written != stream.size:
+						raise GodotHttpError("Upstream sent {written} of {size} bytes of {url}".format(written=written, size=stream.size, url=upstream_url))
+
+					# Readers reopen the data under its new name once it's finished
+					if stream:
+						with stream.changed:
+							os.replace(tmp_path, object_path)
+							stream.update(finished=True)
+					else:
+						os.replace(tmp_path, object_path)
+					meta = {
+						"url":                    upstream_url,
+						"sha256":                 hasher.hexdigest(),
+						"size":                   os.path.getsize(object_path),
+						"upstream_etag":          response.header("etag"),
+						"upstream_last_modified": response.header("last-modified"),
+						"fetched":                time.time(),
+					}
+					print("[+] Fetched {url} ({size:.1f} MiB)".format(url=upstream_url, size=meta["size"] / (1024*1024)))
+			finally:
+				if stream and not stream.finished:
+					stream.update(failed=True)
+				if os.path.exists(tmp_path):
+					os.remove(tmp_path)
+
+			self.__write_json(object_path + ".json", meta)
+
+			return meta
+
+	def __single_flight(self, key, fn, wait=True):
+		'''Runs `fn(flight)` once for all threads asking for `key` at the same time,
+		they all get its result. Without `wait` the flight runs on a thread of
+		its own and is returned right away.
+		'''
+		with self.__flights_lock:
+			flight = self.__flights.get(key)
+			leader = flight == None
+			if leader:
+				flight = self.__flights[key] = _Flight()
+
+		if leader:
+			if wait:
+				self.__fly(key, flight, fn)
+			else:
+				threading.Thread(target=self.__fly, args=(key, flight, fn), daemon=True).start()
+
+		if not wait:
+			return flight
+
+		flight.done.wait()
+		if flight.error:
+			raise flight.error
+
+		return flight.result
+
+	def __fly(self, key, flight, fn):
+		try:
+			flight.result = fn(flight)
+		except Exception as e:
+			flight.error = e
+		finally:
+			with self.__flights_lock:
+				del self.__flights[key]
+			flight.started.set()
+			flight.done.set()
+
+	def count(self, stat):
+		with self.__stats_lock:
+			self.stats[stat] += 1
+
+	def __read_json(self, path):
+		if not os.path.isfile(path):
+			return None
+
+		try:
+			with open(path, 'r') as f:
+				return json.load(f)
+		except ValueError:
+			return None
+
+	def __write_json(self, path, data):
+		if not os.path.isdir(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+
+		tmp_path = "{path}.{pid}.{thread}.tmp".format(path=path, pid=os.getpid(), thread=threading.get_ident())
+		with open(tmp_path, 'w') as f:
+			json.dump(data, f)
+		os.replace(tmp_path, path)
+
+
+class _GodotMirrorHandler(BaseHTTPRequestHandler):
+	protocol_version        = "HTTP/1.1"
+	disable_nagle_algorithm = True
+	server_version          = "godot-cli-mirror"
+
+	mirror = None
+
+	def do_GET(self):
+		self.__handle(send_body=True)
+
+	def do_HEAD(self):
+		self.__handle(send_body=False)
+
+	def log_message(self, format, *args):
+		pass
+
+	def __handle(self, send_body):
+		self.mirror.count("requests")
+
+		target = self.mirror.resolve(self.path)
+		if target == None:
+			return self.__send_simple(404, "Not found")
+
+		try:
+			if target[0] == "redirect":
+				self.send_response(301)
+				self.send_header("Location", target[1])
+				self.send_header("Content-Length", "0")
+				self.end_headers()
+			elif target[0] == "listing":
+				body = self.mirror.render_listing(target[1], self.mirror.get_listing(target[1]))
+				self.send_response(200)
+				self.send_header("Content-Type", "text/html; charset=utf-8")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				if send_body:
+					self.wfile.write(body)
+			else:
+				object_path, meta, stream = self.mirror.open_object(target[1], target[2], target[3])
+				if stream:
+					self.__send_stream(stream, send_body)
+				else:
+					self.__send_file(object_path, meta, send_body)
+		except GodotHttpError as e:
+			# A build upstream doesn't have is not found here either
+			if e.status != None and 400 <= e.status < 500:
+				self.__send_simple(e.status, str(e))
+			else:
+				self.__send_simple(502, str(e))
+
+	def __send_file(self, object_path, meta, send_body):
+		etag          = '"' + meta["sha256"] + '"'
+		last_modified = meta.get("upstream_last_modified") or formatdate(os.path.getmtime(object_path), usegmt=True)
+
+		byte_range = self.__send_headers(meta["size"], etag, last_modified)
+		if byte_range == None:
+			return
+
+		start, end = byte_range
+		if send_body and end >= start:
+			with open(object_path, 'rb') as f:
+				self.wfile.flush()
+				self.connection.sendfile(f, start, end - start + 1)
+
+	def __send_stream(self, stream, send_body):
+		'''Sends an object that is still being fetched, each part as soon as it
+		arrived from upstream. Its checksum isn't known yet, so there is no ETag.
+		'''
+		f = stream.open()
+		try:
+			byte_range = self.__send_headers(stream.size, None, stream.last_modified)
+			if byte_range == None or not send_body:
+				return
+
+			offset, end = byte_range
+			while offset <= end:
+				try:
+					available = stream.wait_for(offset)
+				except GodotHttpError:
+					# Too late for an error status, hang up on a short body instead
+					self.close_connection = True
+					return
+
+				f.seek(offset)
+				data = f.read(min(available, end + 1) - offset)
+				self.wfile.write(data)
+				offset += len(data)
+		finally:
+			f.close()
+
+	def __send_headers(self, size, etag, last_modified):
+		'''Sends the status and headers of a file of `size` bytes, 206 for a
+		satisfiable Range. Returns the (start, end) byte range to send, None if
+		there is nothing to send.
+		'''
+		start, end = 0, size - 1
+		partial    = False
+
+		range_header = self.headers.get("Range")
+		if_range     = self.headers.get("If-Range")
+		if range_header and (not if_range or if_range in (etag, last_modified)):
+			match = GodotMirror.range_re.match(range_header.strip())
+			if match and (match.group(1) or match.group(2)):
+				if match.group(1):
+					start = int(match.group(1))
+					end   = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+				else:
+					start = max(0, size - int(match.group(2)))
+
+				if start > end or start >= size:
+					self.send_response(416)
+					self.send_header("Content-Range", "bytes */{size}".format(size=size))
+					self.send_header("Content-Length", "0")
+					self.end_headers()
+					return None
+				partial = True
+
+		self.send_response(206 if partial else 200)
+		self.send_header("Content-Type", "application/octet-stream")
+		self.send_header("Content-Length", str(end - start + 1))
+		self.send_header("Accept-Ranges", "bytes")
+		if etag:
+			self.send_header("ETag", etag)
+		if last_modified:
+			self.send_header("Last-Modified", last_modified)
+		if partial:
+			self.send_header("Content-Range", "bytes {start}-{end}/{size}".format(start=start, end=end, size=size))
+		self.end_headers()
+
+		return start, end
+
+	def __send_simple(self, status, message):
+		body = message.encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "text/plain; charset=utf-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
@@ -0,0 +1,310 @@
+"""Packaging of export artifacts: parallel compression, checksums and a manifest.
+"""
+
+import os, json, time, zlib, struct, hashlib, tarfile, collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _deflate_block(data, zdict, level, last):
+	if zdict:
+		compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict)
+	else:
+		compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9)
+
+	return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class _ParallelDeflate():
+	'''One raw deflate stream compressed in blocks on several threads, like pigz
+	does: each block is primed with the last 32 KiB of the block before it and
+	ends on a sync flush, so the compressed blocks simply concatenate. zlib lets
+	go of the GIL while compressing, the threads really run in parallel.
+	'''
+
+	window_size = 32 * 1024
+
+	def __init__(self, write, executor, level, block_size, max_pending):
+		self.write_compressed = write
+		self.executor         = executor
+		self.level            = level
+		self.block_size       = block_size
+		self.max_pending      = max_pending
+
+		self.crc             = 0
+		self.size            = 0
+		self.compressed_size = 0
+
+		self.__buffer  = bytearray()
+		self.__tail    = b""
+		self.__pending = collections.deque()
+
+	def write(self, data):
+		self.crc   = zlib.crc32(data, self.crc)
+		self.size += len(data)
+
+		self.__buffer += data
+		while len(self.__buffer) >= self.block_size:
+			block = bytes(self.__buffer[:self.block_size])
+			del self.__buffer[:self.block_size]
+			self.__submit(block, last=False)
+
+	def close(self):
+		self.__submit(bytes(self.__buffer), last=True)
+		self.__buffer = bytearray()
+		while self.__pending:
+			self.__write_next()
+
+	def __submit(self, block, last):
+		self.__pending.append(self.executor.submit(_deflate_block, block, self.__tail, self.level, last))
+		self.__tail = (self.__tail + block)[-self.window_size:]
+
+		# Blocks are written in order, keep only a few in flight so memory
+		# stays bounded no matter how large the input
+		while len(self.__pending) > self.max_pending:
+			self.__write_next()
+
+	def __write_next(self):
+		compressed = self.__pending.popleft().result()
+		self.compressed_size += len(compressed)
+		self.write_compressed(compressed)
+
+
+class _HashingFile():
+	'''Writes to `f` while hashing and counting what goes through.
+	'''
+
+	def __init__(self, f):
+		self.f      = f
+		self.sha256 = hashlib.sha256()
+		self.offset = 0
+
+	def write(self, data):
+		self.f.write(data)
+		self.sha256.update(data)
+		self.offset += len(data)
+		return len(data)
+
+
+class _HashingReader():
+	'''Reads `f` for tarfile while hashing what it reads.
+	'''
+
+	def __init__(self, f):
+		self.f      = f
+		self.sha256 = hashlib.sha256()
+
+	def read(self, size=-1):
+		data = self.f.read(size)
+		self.sha256.update(data)
+		return data
+
+
+class _GzipStream():
+	'''File object for tarfile's streaming mode that gzips what is written to it
+	with a _ParallelDeflate.
+	'''
+
+	def __init__(self, out, executor, level, block_size, max_pending):
+		self.out = out
+		self.out.write(b"\x1f\x8b\x08\x00" + struct.pack("<I", int(time.time())) + b"\x00\x03")
+
+		self.deflate = _ParallelDeflate(out.write, executor, level, block_size, max_pending)
+
+	def write(self, data):
+		self.deflate.write(data)
+		return len(data)
+
+	def close(self):
+		self.deflate.close()
+		self.out.write(struct.pack("<II", self.deflate.crc, self.deflate.size & 0xFFFFFFFF))
+
+
+class _ZipStream():
+	'''Minimal zip writer that never seeks: every member is followed by a data
+	descriptor with its CRC and sizes, which are only known once it has been
+	compressed. Switches to ZIP64 records where sizes or offsets need them.
+	'''
+
+	zip64_limit = 0xFFFFFFFF
+
+	def __init__(self, out, executor, level, block_size, max_pending):
+		self.out         = out
+		self.executor    = executor
+		self.level       = level
+		self.block_size  = block_size
+		self.max_pending = max_pending
+
+		self.__entries = []
+
+	def add(self, path, arcname, chunk_size):
+		'''Compresses the file at `path` into the archive. Returns its SHA-256 and
+		size, hashed from the same reads that feed the compressor.
+		'''
+		stat   = os.stat(path)
+		name   = arcname.replace(os.sep, "/").encode("utf-8")
+		offset = self.out.offset
+
+		# Compression may grow incompressible data a little, leave some room
+		zip64 = stat.st_size >= self.zip64_limit - (stat.st_size >> 6) - 1024 * 1024
+		mtime = time.localtime(stat.st_mtime)
+		dos_time = (mtime.tm_hour << 11) | (mtime.tm_min << 5) | (mtime.tm_sec // 2)
+		dos_date = (max(mtime.tm_year, 1980) - 1980) << 9 | (mtime.tm_mon << 5) | mtime.tm_mday
+
+		# Bit 3: sizes follow in a data descriptor, bit 11: UTF-8 names
+		flags   = 0x0808
+		version = 45 if zip64 else 20
+		extra   = struct.pack("<HHQQ", 0x0001, 16, 0, 0) if zip64 else b""
+		self.out.write(struct.pack("<IHHHHHIIIHH", 0x04034b50, version, flags, 8, dos_time, dos_date, 0,
+		                           0xFFFFFFFF if zip64 else 0, 0xFFFFFFFF if zip64 else 0, len(name), len(extra)) + name + extra)
+
+		sha256  = hashlib.sha256()
+		deflate = _ParallelDeflate(self.out.write, self.executor, self.level, self.block_size, self.max_pending)
+		with open(path, 'rb') as f:
+			for chunk in iter(lambda: f.read(chunk_size), b""):
+				sha256.update(chunk)
+				deflate.write(chunk)
+		deflate.close()
+
+		if zip64:
+			self.out.write(struct.pack("<IIQQ", 0x08074b50, deflate.crc, deflate.compressed_size, deflate.size))
+		else:
+			self.out.write(struct.pack("<IIII", 0x08074b50, deflate.crc, deflate.compressed_size, deflate.size))
+
+		self.__entries.append({
+			"name": name, "version": version, "flags": flags, "time": dos_time, "date": dos_date, "crc": deflate.crc,
+			"compressed_size": deflate.compressed_size, "size": deflate.size, "offset": offset, "mode": stat.st_mode,
+		})
+
+		return sha256.hexdigest(), deflate.size
+
+	def close(self):
+		directory_offset = self.out.offset
+		for entry in self.__entries:
+			zip64_fields = []
+			size            = entry["size"]
+			compressed_size = entry["compressed_size"]
+			offset          = entry["offset"]
+			if size >= self.zip64_limit:
+				zip64_fields.append(size)
+				size = 0xFFFFFFFF
+			if compressed_size >= self.zip64_limit:
+				zip64_fields.append(compressed_size)
+				compressed_size = 0xFFFFFFFF
+			if offset >= self.zip64_limit:
+				zip64_fields.append(offset)
+				offset = 0xFFFFFFFF
+
+			extra = struct.pack("<HH" + "Q" * len(zip64_fields), 0x0001, 8 * len(zip64_fields), *zip64_fields) if zip64_fields else b""
+			version = 45 if zip64_fields else entry["version"]
+			self.out.write(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, (3 << 8) | version, version, entry["flags"], 8,
+			                           entry["time"], entry["date"], entry["crc"], compressed_size, size, len(entry["name"]),
+			                           len(extra), 0, 0, 0, (entry["mode"] & 0xFFFF) << 16, offset) + entry["name"] + extra)
+
+		directory_size = self.out.offset - directory_offset
+		count          = len(self.__entries)
+		if count >= 0xFFFF or directory_offset >= self.zip64_limit or directory_size >= self.zip64_limit:
+			zip64_end_offset = self.out.offset
+			self.out.write(struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, (3 << 8) | 45, 45, 0, 0, count, count, directory_size, directory_offset))
+			self.out.write(struct.pack("<IIQI", 0x07064b50, 0, zip64_end_offset, 1))
+			self.out.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, 0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0))
+		else:
+			self.out.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, count, count, directory_size, directory_offset, 0))
+
+
+class GodotPackager():
+	'''Packs the output directory of an export into a zip or tar.gz and writes a
+	JSON manifest with the size and SHA-256 of every artifact and of the package.
+
+	Files are streamed straight from the output directory into the package, no
+	staging copies. Compression runs on `jobs` threads in blocks of `block_size`
+	bytes, and every artifact is hashed from the same reads that feed the
+	compressor, so hashing overlaps with compression instead of needing another
+	pass over the files.
+
+		manifest = GodotPackager("zip").package("out/Linux_X11", "out/Linux_X11.zip")
+	'''
+
+	formats    = ("zip", "tar.gz")
+	extensions = { "zip": ".zip", "tar.gz": ".tar.gz" }
+
+	chunk_size = 1024 * 1024
+
+	def __init__(self, package_format="zip", jobs=None, level=6, block_size=1024 * 1024):
+		if package_format not in self.formats:
+			raise ValueError("Unknown package format {format}".format(format=package_format))
+
+		self.package_format = package_format
+		self.jobs           = jobs or os.cpu_count() or 1
+		self.level          = level
+		self.block_size     = block_size
+
+	def package_path(self, source_dir):
+		'''Where the package of `source_dir` goes by default: next to it.
+		'''
+		return os.path.realpath(source_dir) + self.extensions[self.package_format]
+
+	def package(self, source_dir, package_path=None, manifest_path=None, extra=None):
+		'''Packs every file below `source_dir`. Returns the manifest, which is also
+		written to `manifest_path` (by default next to the package). `extra` is
+		merged into the manifest.
+		'''
+		start_time    = time.perf_counter()
+		source_dir    = os.path.realpath(source_dir)
+		package_path  = package_path or self.package_path(source_dir)
+		manifest_path = manifest_path or package_path + ".manifest.json"
+
+		paths = []
+		for root, dirs, files in os.walk(source_dir):
+			dirs.sort()
+			for name in sorted(files):
+				path = os.path.join(root, name)
+				if os.path.realpath(path) not in (os.path.realpath(package_path), os.path.realpath(manifest_path)):
+					paths.append(path)
+
+		package_dir = os.path.dirname(os.path.realpath(package_path))
+		os.makedirs(package_dir, exist_ok=True)
+
+		artifacts = []
+		tmp_path  = "{path}.{pid}.tmp".format(path=package_path, pid=os.getpid())
+		try:
+			with ThreadPoolExecutor(max_workers=self.jobs) as executor, open(tmp_path, 'wb') as f:
+				out = _HashingFile(f)
+				if self.package_format == "zip":
+					archive = _ZipStream(out, executor, self.level, self.block_size, self.jobs * 2)
+					for path in paths:
+						sha256, size = archive.add(path, os.path.relpath(path, source_dir), self.chunk_size)
+						artifacts.append({ "path": os.path.relpath(path, source_dir).replace(os.sep, "/"), "size": size, "sha256": sha256 })
+					archive.close()
+				else:
+					stream = _GzipStream(out, executor, self.level, self.block_size, self.jobs * 2)
+					with tarfile.open(fileobj=stream, mode="w|", format=tarfile.PAX_FORMAT, bufsize=self.chunk_size) as tar:
+						for path in paths:
+							tarinfo = tar.gettarinfo(path, os.path.relpath(path, source_dir).replace(os.sep, "/"))
+							with open(path, 'rb') as artifact:
+								reader = _HashingReader(artifact)
+								tar.addfile(tarinfo, reader)
+							artifacts.append({ "path": tarinfo.name, "size": tarinfo.size, "sha256": reader.sha256.hexdigest() })
+					stream.close()
+		except BaseException:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+			raise
+
+		os.replace(tmp_path, package_path)
+
+		manifest = dict(extra or {})
+		manifest["artifacts"] = artifacts
+		manifest["package"]   = {
+			"path":    os.path.basename(package_path),
+			"format":  self.package_format,
+			"size":    out.offset,
+			"sha256":  out.sha256.hexdigest(),
+			"seconds": time.perf_counter() - start_time,
+		}
+
+		tmp_manifest_path = manifest_path + ".tmp"
+		with open(tmp_manifest_path, 'w') as f:
+			json.dump(manifest, f, indent=4)
+		os.replace(tmp_manifest_path, manifest_path)
+
+		return manifest
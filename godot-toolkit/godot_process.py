@@ -0,0 +1,114 @@
+"""Supervision of a child Godot process.
+"""
+
+import subprocess, threading, queue, time
+
+
+class GodotProcessTimeout(Exception):
+	pass
+
+
+class GodotProcessCancelled(Exception):
+	pass
+
+
+class GodotProcessSupervisor():
+	'''Runs a process and drains its stdout and stderr on two reader threads, so
+	neither pipe can fill up and stall the child. Lines are handed to
+	`on_line(stream_name, line)` on the calling thread as soon as they arrive and
+	run() returns the moment both pipes close and the process exits.
+
+	`start_time` is when the process was launched and, during on_line,
+	`line_time` is when the line was read off the pipe (both time.perf_counter()).
+	'''
+
+	_eof    = object()
+	_cancel = object()
+
+	def __init__(self, args, cwd=None, on_line=None, timeout=None, encoding="utf-8"):
+		self.args     = args
+		self.cwd      = cwd
+		self.on_line  = on_line
+		self.timeout  = timeout
+		self.encoding = encoding
+
+		self.process    = None
+		self.start_time = None
+		self.line_time  = None
+
+		self.__queue     = queue.Queue()
+		self.__cancelled = threading.Event()
+
+	def run(self):
+		'''Starts the process and supervises it until it exits. Returns the exit code,
+		raises GodotProcessTimeout or GodotProcessCancelled after killing the process.
+		'''
+		deadline = time.monotonic() + self.timeout if self.timeout else None
+
+		self.start_time = time.perf_counter()
+		self.process = subprocess.Popen(self.args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=self.cwd)
+
+		readers = [
+			threading.Thread(target=self.__read, args=("stdout", self.process.stdout), daemon=True),
+			threading.Thread(target=self.__read, args=("stderr", self.process.stderr), daemon=True),
+		]
+		for reader in readers:
+			reader.start()
+
+		open_streams = len(readers)
+		try:
+			while open_streams > 0:
+				remaining = deadline - time.monotonic() if deadline else None
+				if remaining != None and remaining <= 0:
+					raise GodotProcessTimeout("Godot did not finish within {timeout}s".format(timeout=self.timeout))
+
+				try:
+					item = self.__queue.get(timeout=remaining)
+				except queue.Empty:
+					continue
+
+				if item is self._cancel:
+					raise GodotProcessCancelled("Godot run was cancelled")
+
+				stream_name, line, line_time = item
+				if line is self._eof:
+					open_streams -= 1
+				elif self.on_line:
+					self.line_time = line_time
+					self.on_line(stream_name, line)
+
+			remaining = deadline - time.monotonic() if deadline else None
+			try:
+				return self.process.wait(timeout=remaining)
+			except subprocess.TimeoutExpired:
+				raise GodotProcessTimeout("Godot did not exit within {timeout}s".format(timeout=self.timeout))
+		except (GodotProcessTimeout, GodotProcessCancelled):
+			self.__kill()
+			raise
+		finally:
+			for reader in readers:
+				reader.join(timeout=1)
+
+	def cancel(self):
+		'''Stops a running supervisor from any thread, run() then kills the process.
+		'''
+		if not self.__cancelled.is_set():
+			self.__cancelled.set()
+			self.__queue.put(self._cancel)
+
+	def __read(self, stream_name, stream):
+		try:
+			for raw in iter(stream.readline, b""):
+				self.__queue.put((stream_name, raw.decode(self.encoding, errors="replace").rstrip("\r\n"), time.perf_counter()))
+		finally:
+			stream.close()
+			self.__queue.put((stream_name, self._eof, time.perf_counter()))
+
+	def __kill(self):
+		if self.process and self.process.poll() is None:
+			self.process.terminate()
+			try:
+				self.process.wait(timeout=5)
+			except subprocess.TimeoutExpired:
+				self.process.kill()
+				self.process.wait()
\ No newline at end of file
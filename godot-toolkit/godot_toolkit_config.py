@@ -3,7 +3,7 @@ try:
 	import ConfigParser as configparser
 except:
 	import configparser
-import os
+import os, json
 
 
 class GodotToolkitConfig():
@@ -13,7 +13,39 @@ class GodotToolkitConfig():
 			"download_tmp"              : "data/tmp",
 			"godot_catalogue_cache_path": "data/cache.json",
 			"default_launch_version"    : "3.1.1",
-			"base_dl_url"               : "https://downloads.tuxfamily.org/godotengine"
+			"base_dl_url"               : "https://downloads.tuxfamily.org/godotengine",
+			"scrape_concurrency"        : 8,
+			"scrape_timeout"            : 30,
+			"scrape_retries"            : 3,
+			"scrape_retry_backoff"      : 0.5,
+			"download_connections"      : 4,
+			"download_min_segment_size" : 8 * 1024 * 1024,
+			"download_chunk_size"       : 1024 * 1024,
+			"download_timeout"          : 60,
+			"download_retries"          : 3,
+			"download_jobs"             : 4,
+			"manifest_compact"          : False,
+			"blob_gc_grace_period"      : 60 * 60,
+			"catalogue_stale_after"     : 24 * 60 * 60,
+			"catalogue_max_staleness"   : 7 * 24 * 60 * 60,
+			"catalogue_refresh_interval": 10 * 60
+		},
+		"godot_mirror": {
+			"mirror_path"               : "data/mirror",
+			"mirror_host"               : "0.0.0.0",
+			"mirror_port"               : 8060,
+			"mirror_listing_ttl"        : 600
+		},
+		"godot_daemon": {
+			"daemon_socket_path"        : "data/godot-daemon.sock",
+			"daemon_start_timeout"      : 10
+		},
+		"godot_exporter": {
+			"export_cache_path"         : "data/export_cache",
+			"export_cache_hash_jobs"    : 8,
+			"export_cache_max_entries"  : 20,
+			"import_cache_path"         : "data/import_cache",
+			"import_cache_remote"       : ""
 		},
 		"godot_nightly":
 		{
@@ -25,19 +57,53 @@ class GodotToolkitConfig():
 		}
 	}
 
+	# Settings changed with set(), handed down to child processes through
+	# overrides_env so they see the same configuration
+	__overrides   = {}
+	overrides_env = "GODOT_TOOLKIT_CONFIG_OVERRIDES"
+
+	# godot-toolkit.cfg is read by the first GodotToolkitConfig of a process
+	__file_loaded = False
+
 	def __init__(self):
-		script_dir = os.path.dirname(os.path.realpath(__file__))
-		config_path = os.path.realpath(os.path.join(script_dir, "..", "godot-toolkit.cfg"))
+		if not GodotToolkitConfig.__file_loaded:
+			GodotToolkitConfig.__file_loaded = True
+
+			script_dir = os.path.dirname(os.path.realpath(__file__))
+			self.load_file(os.path.realpath(os.path.join(script_dir, "..", "godot-toolkit.cfg")))
 
-		flat_config = {}
+		# Overrides of the parent process win over the config file
+		for section, values in json.loads(os.environ.get(self.overrides_env, "{}")).items():
+			for key, value in values.items():
+				self.set(section, key, value)
+
+	def load_file(self, config_path):
+		'''Overwrites the defaults with the settings found in an ini style config
+		file. Settings go in the section they belong to, e.g. base_dl_url in
+		[godot_cli], settings in any other section (like [godot]) are looked up
+		by their name.
+		'''
+		owners = {}
 		for section in self.__config:
 			for key in self.__config[section]:
-				flat_config[key] = self.__config[section][key]
+				owners.setdefault(key, section)
+
+		parser = configparser.ConfigParser(interpolation=None)
+		parser.optionxform = str
+		parser.read(config_path)
 
-		# Now overwrite the class variables with the ones found
-		# in the config.
-		__config = configparser.ConfigParser(flat_config)
-		__config.read(config_path)
+		for section in parser.sections():
+			for key, value in parser.items(section):
+				if section not in self.__config:
+					section_name = owners.get(key, section)
+				else:
+					section_name = section
+
+				# Settings changed with set() stay as they are
+				if key in self.__overrides.get(section_name, {}):
+					continue
+
+				self.__config.setdefault(section_name, {})[key] = value
 
 	def get(self, section, key):
 		if section in self.__config:
@@ -46,6 +112,31 @@ class GodotToolkitConfig():
 
 		return None
 
+	def set(self, section, key, value):
+		'''Overrides a setting for every GodotToolkitConfig in this process.
+		'''
+		self.__config.setdefault(section, {})[key] = value
+		self.__overrides.setdefault(section, {})[key] = value
+
+	def overrides(self):
+		'''Every setting changed with set(), as {section: {key: value}}.
+		'''
+		return { section: dict(values) for section, values in self.__overrides.items() }
+
+	def get_int(self, section, key, default=0):
+		value = self.get(section, key)
+		if value == None:
+			return default
+
+		return int(value)
+
+	def get_float(self, section, key, default=0.0):
+		value = self.get(section, key)
+		if value == None:
+			return default
+
+		return float(value)
+
 	def get_adjusted_path(self, section, key):
 		if section in self.__config:
 			if key in self.__config[section]:
@@ -0,0 +1,122 @@
+"""Timing of export phases, written as Chrome trace events.
+"""
+
+import os, json, time, threading
+
+
+class _NullSpan():
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		pass
+
+
+class _Span():
+	def __init__(self, tracer, name, category, args):
+		self.tracer   = tracer
+		self.name     = name
+		self.category = category
+		self.args     = args
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.tracer.complete(self.name, self.start, time.perf_counter(), self.category, self.args)
+
+
+class GodotTracer():
+	'''Collects timed events from any number of threads.
+
+		with tracer.span("prep_export_preset", preset="Linux/X11"):
+			...
+
+	A disabled tracer hands out one shared no-op span and drops everything else
+	right away, so instrumented code costs next to nothing when tracing is off.
+	The events can be written in the Chrome trace event format (open them in
+	chrome://tracing or Perfetto) and rolled up into a summary per preset.
+	'''
+
+	phase_category = "phase"
+	file_category  = "file"
+
+	_null_span = _NullSpan()
+
+	def __init__(self, enabled=True):
+		self.enabled = enabled
+
+		self.__events = []
+		self.__origin = time.perf_counter()
+		self.__lock   = threading.Lock()
+
+	def span(self, name, category=phase_category, **args):
+		if not self.enabled:
+			return self._null_span
+
+		return _Span(self, name, category, args)
+
+	def complete(self, name, start, end, category=phase_category, args=None):
+		'''Records an event that ran from `start` to `end` (time.perf_counter()
+		values).
+		'''
+		if not self.enabled:
+			return
+
+		event = {
+			"name": name,
+			"cat":  category,
+			"ph":   "X",
+			"ts":   (start - self.__origin) * 1e6,
+			"dur":  max(0.0, end - start) * 1e6,
+			"pid":  os.getpid(),
+			"tid":  threading.get_ident(),
+			"args": args or {},
+		}
+		with self.__lock:
+			self.__events.append(event)
+
+	def events(self):
+		with self.__lock:
+			return list(self.__events)
+
+	def write_chrome_trace(self, path):
+		with open(path, 'w') as f:
+			json.dump({ "traceEvents": self.events(), "displayTimeUnit": "ms" }, f)
+
+	def summary(self, slowest_files=20):
+		'''Seconds spent in every phase and the slowest packed files, per preset.
+		'''
+		presets = {}
+		for event in self.events():
+			preset  = event["args"].get("preset", "")
+			seconds = event["dur"] / 1e6
+			summary = presets.setdefault(preset, { "phases": {}, "files": 0, "file_seconds": 0.0, "slowest_files": [] })
+
+			if event["cat"] == self.file_category:
+				summary["files"]        += 1
+				summary["file_seconds"] += seconds
+				summary["slowest_files"].append({ "file": event["name"], "seconds": seconds })
+			else:
+				summary["phases"][event["name"]] = summary["phases"].get(event["name"], 0.0) + seconds
+
+		for summary in presets.values():
+			summary["slowest_files"].sort(key=lambda entry: entry["seconds"], reverse=True)
+			del summary["slowest_files"][slowest_files:]
+
+		return { "presets": presets }
+
+	def write_summary(self, path, slowest_files=20):
+		with open(path, 'w') as f:
+			json.dump(self.summary(slowest_files), f, indent=4)
+
+	@staticmethod
+	def print_summary(summary):
+		for preset, preset_summary in sorted(summary["presets"].items()):
+			print("[+] Export timing" + (" of " + preset if preset else ""))
+			for phase, seconds in preset_summary["phases"].items():
+				print(" ├── {phase}: {seconds:.3f}s".format(phase=phase, seconds=seconds))
+			slowest = preset_summary["slowest_files"][:3]
+			print(" └── {files} files packed in {seconds:.3f}s".format(files=preset_summary["files"], seconds=preset_summary["file_seconds"]) +
+			      (", slowest: " + ", ".join("{file} ({seconds:.3f}s)".format(**entry) for entry in slowest) if slowest else ""))
@@ -0,0 +1,155 @@
+"""Sorted index of the catalogue for version and release queries.
+"""
+
+import re, bisect
+
+
+class VersionSpecError(Exception):
+	pass
+
+
+class GodotVersionIndex():
+	'''Pre-sorted view of the catalogue, built once per refresh and stored in
+	cache.json along with it:
+
+	  * the versions in ascending order and their numeric sort keys
+	  * the releases of every version, oldest first and stable last
+	  * the newest release of every channel (dev, alpha, beta, rc, stable)
+	  * the architectures a release can be downloaded for, where it's known
+
+	Version specs are either a version, `latest`, a wildcard like `3.1.x` or
+	comma separated comparisons like `>=3.0,<3.2`. They are answered by
+	bisecting the sort keys, `latest` and the newest release of a channel are
+	plain lookups.
+	'''
+
+	format_version = 1
+	channels       = ("dev", "alpha", "beta", "rc", "stable")
+
+	release_re    = re.compile(r'^([a-z]+)(\d*)$')
+	comparison_re = re.compile(r'^(>=|<=|>|<|==|=)?\s*(\d+(?:\.\d+)*)(\.[x*])?$')
+
+	def __init__(self, index):
+		self.index = index
+
+	@classmethod
+	def build(cls, catalogue):
+		versions = sorted((version for version in catalogue.get("versions", {}) if version != "nightly"), key=cls.version_key)
+
+		index = {
+			"format":   cls.format_version,
+			"versions": versions,
+			"keys":     [cls.version_key(version) for version in versions],
+			"releases": {},
+			"latest":   {},
+			"arches":   {},
+		}
+
+		for version in versions:
+			releases = catalogue["versions"][version].get("releases") or {}
+			names    = sorted(releases, key=cls.release_key)
+
+			index["releases"][version] = names
+			index["latest"][version]   = { cls.release_channel(name): name for name in names if cls.release_channel(name) != None }
+			index["arches"][version]   = { name: releases[name].get("arches") for name in names }
+
+		return cls(index)
+
+	@classmethod
+	def version_key(cls, version):
+		return [int(part) for part in version.split(".") if part.isdigit()]
+
+	@classmethod
+	def release_channel(cls, release):
+		match = cls.release_re.match(release)
+		if match and match.group(1) in cls.channels:
+			return match.group(1)
+
+		return None
+
+	@classmethod
+	def release_key(cls, release):
+		match = cls.release_re.match(release)
+		if match == None or match.group(1) not in cls.channels:
+			return [-1, 0, release]
+
+		return [cls.channels.index(match.group(1)), int(match.group(2) or 0), release]
+
+	def versions(self):
+		return list(self.index["versions"])
+
+	def latest(self):
+		versions = self.index["versions"]
+		return versions[-1] if versions else None
+
+	def select(self, spec):
+		'''Every version matching `spec`, oldest first.
+		'''
+		versions = self.index["versions"]
+		keys     = self.index["keys"]
+
+		if spec in ("", "*", "all"):
+			return list(versions)
+		if spec == "latest":
+			return versions[-1:]
+
+		low, high = 0, len(keys)
+		for part in spec.split(","):
+			match = self.comparison_re.match(part.strip())
+			if match == None:
+				raise VersionSpecError("Invalid version spec {spec}".format(spec=spec))
+
+			operator, version, wildcard = match.groups()
+			key = self.version_key(version)
+
+			if wildcard:
+				if operator not in (None, "=", "=="):
+					raise VersionSpecError("Invalid version spec {spec}".format(spec=spec))
+
+				# 3.1.x covers everything from 3.1 up to, but not including, 3.2
+				low  = max(low,  bisect.bisect_left(keys, key))
+				high = min(high, bisect.bisect_left(keys, key[:-1] + [key[-1] + 1]))
+			elif operator in (None, "=", "=="):
+				low  = max(low,  bisect.bisect_left(keys, key))
+				high = min(high, bisect.bisect_right(keys, key))
+			elif operator == ">=":
+				low  = max(low,  bisect.bisect_left(keys, key))
+			elif operator == ">":
+				low  = max(low,  bisect.bisect_right(keys, key))
+			elif operator == "<=":
+				high = min(high, bisect.bisect_right(keys, key))
+			elif operator == "<":
+				high = min(high, bisect.bisect_left(keys, key))
+
+		return versions[low:high]
+
+	def resolve_version(self, spec):
+		'''The newest version matching `spec`, None if there is none.
+		'''
+		if spec in self.index["releases"]:
+			return spec
+
+		versions = self.select(spec)
+		return versions[-1] if versions else None
+
+	def releases(self, version):
+		return list(self.index["releases"].get(version, []))
+
+	def resolve_release(self, version, release):
+		'''Resolves a release name, a channel (`rc` is the newest rc) or `latest`
+		to a release of `version`. Returns None if there is no such release.
+		'''
+		releases = self.index["releases"].get(version, [])
+		if release in releases:
+			return release
+
+		if release == "latest":
+			return releases[-1] if releases else None
+
+		return self.index["latest"].get(version, {}).get(release)
+
+	def arches(self, version, release):
+		'''File suffixes (x11.64, win64.exe, ...) `release` of `version` is
+		published for, None if the release directory wasn't listed.
+		'''
+		return self.index["arches"].get(version, {}).get(release)
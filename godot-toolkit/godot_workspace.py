@@ -0,0 +1,171 @@
+"""Throwaway views of a Godot project that exports can modify freely.
+"""
+
+import os, shutil, tempfile
+
+
+class GodotWorkspace():
+	'''A private view of a project directory that an export can modify freely.
+	Files that need to differ from the project must be changed with
+	replace_file(), which breaks any link before writing.
+
+	Godot writes during an export: it rewrites the import caches (.import,
+	.godot) and the .import files next to the assets it imports, in place, and
+	adds .import files for new assets. Those are always copied into the
+	workspace, never linked, so the project's copies stay untouched.
+
+	In "mirror" mode every other file is hardlinked where the filesystem allows
+	it and copied otherwise. In "overlay" mode, the default, directories with
+	nothing Godot imports are symlinked back into the project as a whole, so
+	the workspace only holds the directories Godot may write to. Those are real
+	directories whose files are symlinked.
+	'''
+
+	private_dirs = (".import", ".godot")
+	ignored_dirs = (".git", ".svn", ".hg")
+
+	# Extensions of the files Godot imports, a directory holding any of them
+	# gets .import files written into it
+	imported_extensions = (
+		".png", ".jpg", ".jpeg", ".webp", ".svg", ".svgz", ".bmp", ".tga", ".hdr", ".exr", ".dds", ".ktx",
+		".wav", ".ogg", ".mp3",
+		".dae", ".gltf", ".glb", ".obj", ".fbx", ".escn", ".blend",
+		".ttf", ".otf", ".woff", ".woff2", ".fnt", ".font",
+		".csv", ".translation",
+	)
+
+	def __init__(self, project_path, parent_dir=None, mode="overlay"):
+		self.project_path = os.path.realpath(project_path)
+		self.parent_dir   = parent_dir
+		self.mode         = mode
+		self.path         = None
+
+		self.linked_files = 0
+		self.copied_files = 0
+		self.symlinks     = 0
+
+	def create(self):
+		# Hardlinks only work within one filesystem, so by default the workspace
+		# sits next to the project.
+		parent_dir = self.parent_dir or os.path.dirname(self.project_path)
+		self.path = tempfile.mkdtemp(prefix="." + os.path.basename(self.project_path) + ".workspace-", dir=parent_dir)
+
+		if self.mode == "overlay":
+			self.__overlay_dir(self.project_path, self.path, self.__importing_dirs())
+		else:
+			self.__mirror_tree(self.project_path, self.path)
+
+		return self.path
+
+	@classmethod
+	def is_imported(cls, name):
+		'''Whether Godot imports a file of this name, or writes it when importing.
+		'''
+		return name.endswith(".import") or os.path.splitext(name)[1].lower() in cls.imported_extensions
+
+	def __importing_dirs(self):
+		'''The directories of the project Godot may write .import files into,
+		along with every directory above them.
+		'''
+		importing = set()
+		for src_dir, dirs, files in os.walk(self.project_path):
+			dirs[:] = [d for d in dirs if d not in self.ignored_dirs and d not in self.private_dirs]
+			if any(self.is_imported(f) for f in files):
+				path = src_dir
+				while path not in importing and path.startswith(self.project_path):
+					importing.add(path)
+					path = os.path.dirname(path)
+
+		return importing
+
+	def __overlay_dir(self, src_dir, dst_dir, importing):
+		for name in os.listdir(src_dir):
+			if name in self.ignored_dirs:
+				continue
+
+			src_path = os.path.join(src_dir, name)
+			dst_path = os.path.join(dst_dir, name)
+			if os.path.isdir(src_path) and not os.path.islink(src_path):
+				if src_dir == self.project_path and name in self.private_dirs:
+					self.__mirror_tree(src_path, dst_path)
+				elif src_path in importing:
+					os.makedirs(dst_path)
+					self.__overlay_dir(src_path, dst_path, importing)
+				else:
+					self.__symlink(src_path, dst_path)
+			elif name.endswith(".import"):
+				self.__copy_file(src_path, dst_path)
+			else:
+				self.__symlink(src_path, dst_path)
+
+	def __symlink(self, src_path, dst_path):
+		try:
+			os.symlink(src_path, dst_path, target_is_directory=os.path.isdir(src_path))
+			self.symlinks += 1
+		except OSError:
+			# No symlink support (e.g. Windows without the privilege)
+			if os.path.isdir(src_path):
+				self.__mirror_tree(src_path, dst_path)
+			else:
+				self.__mirror_file(src_path, dst_path)
+
+	def __mirror_tree(self, src_root, dst_root):
+		if not os.path.exists(dst_root):
+			os.makedirs(dst_root)
+
+		for src_dir, dirs, files in os.walk(src_root):
+			dst_dir = os.path.join(dst_root, os.path.relpath(src_dir, src_root))
+
+			dirs[:] = [d for d in dirs if d not in self.ignored_dirs]
+			for d in list(dirs):
+				if os.path.islink(os.path.join(src_dir, d)):
+					os.symlink(os.readlink(os.path.join(src_dir, d)), os.path.join(dst_dir, d), target_is_directory=True)
+					dirs.remove(d)
+				else:
+					os.makedirs(os.path.join(dst_dir, d), exist_ok=True)
+
+			# Godot writes to the import caches and the .import files in place
+			private = os.path.relpath(src_dir, self.project_path).split(os.sep)[0] in self.private_dirs
+			for f in files:
+				if private or f.endswith(".import"):
+					self.__copy_file(os.path.join(src_dir, f), os.path.join(dst_dir, f))
+				else:
+					self.__mirror_file(os.path.join(src_dir, f), os.path.join(dst_dir, f))
+
+	def replace_file(self, rel_path, content):
+		'''Writes `content` to `rel_path` inside the workspace without touching the
+		project's copy of the file.
+		'''
+		dst_path = os.path.join(self.path, rel_path)
+		if os.path.lexists(dst_path):
+			os.remove(dst_path)
+
+		mode = 'wb' if isinstance(content, bytes) else 'w'
+		with open(dst_path, mode) as f:
+			f.write(content)
+
+	def cleanup(self):
+		if self.path and os.path.isdir(self.path):
+			shutil.rmtree(self.path, ignore_errors=True)
+		self.path = None
+
+	def __mirror_file(self, src_path, dst_path):
+		try:
+			os.link(src_path, dst_path)
+			self.linked_files += 1
+			return
+		except OSError:
+			pass
+
+		self.__copy_file(src_path, dst_path)
+
+	def __copy_file(self, src_path, dst_path):
+		shutil.copy2(src_path, dst_path)
+		self.copied_files += 1
+
+	def __enter__(self):
+		self.create()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.cleanup()
\ No newline at end of file
@@ -0,0 +1,74 @@
+"""GodotBinariesCache scraping the recorded listings from a local server.
+"""
+
+import os, json, unittest, contextlib, io
+
+from toolkit_fixtures import ToolkitScratch
+
+from godot_binaries_cache import GodotBinariesCache
+
+
+class BinariesCacheScrapeTest(unittest.TestCase):
+	def setUp(self):
+		self.scratch = ToolkitScratch()
+		self.server  = self.scratch.server
+
+	def tearDown(self):
+		self.scratch.close()
+
+	def recache(self, concurrency, full=True):
+		self.scratch.config.set("godot_cli", "scrape_concurrency", concurrency)
+		with contextlib.redirect_stdout(io.StringIO()):
+			cache = GodotBinariesCache(suppress_recache=True)
+			cache.recache(full=full)
+
+		with open(cache.cache_path, 'r') as f:
+			catalogue = json.load(f)
+		del catalogue["last_cache_datetime"]
+
+		return catalogue
+
+	def test_concurrent_scrape_matches_serial(self):
+		serial     = self.recache(1)
+		concurrent = self.recache(8)
+
+		self.assertEqual(serial, concurrent)
+		self.assertEqual(sorted(self.scratch.tree.versions), sorted(v for v in serial["versions"] if v != "nightly"))
+		self.assertIn("x11.64", serial["versions"]["3.1.1"]["releases"]["stable"]["arches"])
+		self.assertEqual(serial["versions"]["nightly"]["commit"], "0123456789abcdef")
+
+	def test_serial_scrape_keeps_one_connection(self):
+		self.recache(1)
+
+		# The index, every version directory and the nightly manifest
+		self.assertEqual(self.server.count(), 2 + len(self.scratch.tree.versions))
+		self.assertEqual(self.server.connections(), 1)
+
+	def test_concurrent_scrape_is_bounded(self):
+		self.recache(4)
+
+		self.assertEqual(self.server.count(), 2 + len(self.scratch.tree.versions))
+		self.assertLessEqual(self.server.connections(), 5)
+
+	def test_server_errors_are_retried(self):
+		self.server.fail("/godotengine/3.2/", times=2)
+		self.server.fail("/godotengine/", times=1)
+
+		catalogue = self.recache(8)
+
+		self.assertEqual(self.server.count(), 5 + len(self.scratch.tree.versions))
+		self.assertIn("stable", catalogue["versions"]["3.2"]["releases"])
+
+	def test_unchanged_index_is_not_rescraped(self):
+		self.recache(8)
+		before = self.server.count()
+
+		catalogue = self.recache(8, full=False)
+
+		# Only the index and the nightly manifest, both answered with 304
+		self.assertEqual(self.server.count() - before, 2)
+		self.assertIn("stable", catalogue["versions"]["3.2"]["releases"])
+
+
+if __name__ == '__main__':
+	unittest.main()
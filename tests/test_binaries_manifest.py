@@ -0,0 +1,151 @@
+"""GodotBinariesManifest saving and reloading, and instances sharing one
+binaries directory standing in for separate processes.
+"""
+
+import os, json, time, hashlib, unittest
+
+from toolkit_fixtures import ToolkitScratch
+
+from godot_binaries_manifest import GodotBinariesManifest
+from godot_sys_arch import GodotSystemArch
+
+
+class BinariesManifestTest(unittest.TestCase):
+	def setUp(self):
+		self.scratch = ToolkitScratch()
+
+	def tearDown(self):
+		self.scratch.close()
+
+	def binary(self, name, data):
+		binary_path = os.path.join(self.scratch.path, name)
+		with open(binary_path, 'wb') as f:
+			f.write(data)
+
+		return binary_path
+
+	def blob(self, manifest, version):
+		return manifest.get_binary_info(version, "stable", GodotSystemArch.OS_LINUX64)["bin"]
+
+	def blob_exists(self, manifest, blob_relative_path):
+		return os.path.isfile(os.path.join(manifest.binaries_dir, blob_relative_path))
+
+	def age(self, manifest, blob_relative_path, seconds):
+		blob_path = os.path.join(manifest.binaries_dir, blob_relative_path)
+		then = time.time() - seconds
+		os.utime(blob_path, (then, then))
+
+	def test_save_and_reload(self):
+		manifest = GodotBinariesManifest()
+		manifest.add_binary("3.2", "stable", GodotSystemArch.OS_LINUX64, self.binary("linux", b"linux"))
+		manifest.add_binary("3.2", "rc1", GodotSystemArch.OS_WIN64, self.binary("windows", b"windows"))
+
+		templates_path = self.binary("templates.tpz", b"templates")
+		templates_blob = manifest.add_blob(templates_path, "ab" * 32, ".tpz")
+		manifest.add_installed_templates("3.2", "stable", templates_blob, "ab" * 32, { "templates/version.txt": 10 })
+
+		reloaded = GodotBinariesManifest()
+		for version, release, sys_arch in (("3.2", "stable", GodotSystemArch.OS_LINUX64), ("3.2", "rc1", GodotSystemArch.OS_WIN64)):
+			self.assertEqual(reloaded.get_binary_info(version, release, sys_arch), manifest.get_binary_info(version, release, sys_arch))
+			with open(reloaded.get_binary_path(version, release, sys_arch), 'rb') as f:
+				self.assertEqual(hashlib.sha256(f.read()).hexdigest(), reloaded.get_binary_info(version, release, sys_arch)["sha256"])
+
+		self.assertTrue(reloaded.get_binary_info("3.2", "rc1", GodotSystemArch.OS_WIN64)["bin"].endswith(".exe"))
+		self.assertEqual(reloaded.get_binary_info("3.2", "rc1", GodotSystemArch.OS_LINUX64), None)
+		self.assertEqual(reloaded.find_binary_by_sha256(sha256=hashlib.sha256(b"linux").hexdigest())["bin"], self.blob(manifest, "3.2"))
+		self.assertEqual(reloaded.get_templates_info("3.2", "stable")["members"], { "templates/version.txt": 10 })
+		self.assertEqual(reloaded.get_templates_path("3.2", "stable"), os.path.join(reloaded.binaries_dir, templates_blob))
+
+		# Nothing but the manifest and the blobs is left behind
+		self.assertEqual(sorted(os.listdir(manifest.binaries_dir)), ["blobs", "manifest.json", "manifest.json.lock"])
+
+	def test_batch_saves_once(self):
+		manifest = GodotBinariesManifest()
+		with manifest.batch():
+			manifest.add_binary("3.2", "stable", GodotSystemArch.OS_LINUX64, self.binary("linux", b"linux"))
+			manifest.add_binary("3.1", "stable", GodotSystemArch.OS_LINUX64, self.binary("older", b"older"))
+
+			with open(manifest.manifest_path, 'r') as f:
+				self.assertEqual(json.load(f), {})
+
+		reloaded = GodotBinariesManifest()
+		self.assertNotEqual(reloaded.get_binary_path("3.2", "stable", GodotSystemArch.OS_LINUX64), None)
+		self.assertNotEqual(reloaded.get_binary_path("3.1", "stable", GodotSystemArch.OS_LINUX64), None)
+
+	def test_saves_merge_other_processes_entries(self):
+		first  = GodotBinariesManifest()
+		second = GodotBinariesManifest()
+
+		first.add_binary("3.2", "stable", GodotSystemArch.OS_LINUX64, self.binary("linux", b"linux"))
+		second.add_binary("3.1", "stable", GodotSystemArch.OS_LINUX64, self.binary("older", b"older"))
+
+		# Each save picked up what the other wrote before
+		self.assertNotEqual(second.get_binary_info("3.2", "stable", GodotSystemArch.OS_LINUX64), None)
+		reloaded = GodotBinariesManifest()
+		self.assertNotEqual(reloaded.get_binary_info("3.2", "stable", GodotSystemArch.OS_LINUX64), None)
+		self.assertNotEqual(reloaded.get_binary_info("3.1", "stable", GodotSystemArch.OS_LINUX64), None)
+
+	def test_compact_manifest(self):
+		self.scratch.config.set("godot_cli", "manifest_compact", True)
+		try:
+			manifest = GodotBinariesManifest()
+			manifest.add_binary("3.2", "stable", GodotSystemArch.OS_LINUX64, self.binary("linux", b"linux"))
+		finally:
+			self.scratch.config.set("godot_cli", "manifest_compact", False)
+
+		with open(manifest.manifest_path, 'r') as f:
+			self.assertNotIn("\n", f.read())
+		self.assertNotEqual(GodotBinariesManifest().get_binary_path("3.2", "stable", GodotSystemArch.OS_LINUX64), None)
+
+	def test_replaced_binaries_are_collected(self):
+		manifest = GodotBinariesManifest()
+		manifest.add_binary("3.2", "stable", GodotSystemArch.OS_LINUX64, self.binary("old", b"old"))
+		old_blob = self.blob(manifest, "3.2")
+		self.age(manifest, old_blob, 2 * 60 * 60)
+
+		manifest.add_binary("3.2", "stable", GodotSystemArch.OS_LINUX64, self.binary("new", b"new"))
+
+		self.assertFalse(self.blob_exists(manifest, old_blob))
+		self.assertTrue(self.blob_exists(manifest, self.blob(manifest, "3.2")))
+
+	def test_blobs_of_unsaved_entries_are_kept(self):
+		first  = GodotBinariesManifest()
+		second = GodotBinariesManifest()
+
+		first.add_binary("3.2", "stable", GodotSystemArch.OS_LINUX64, self.binary("shared", b"shared"))
+		shared_blob = self.blob(first, "3.2")
+		self.age(first, shared_blob, 2 * 60 * 60)
+
+		# The second manifest stores the same binary, but hasn't saved its entry
+		# when the first one replaces the only saved reference to it
+		with second.batch():
+			self.assertEqual(second.add_blob(self.binary("again", b"shared"), os.path.basename(shared_blob)), shared_blob)
+			first.add_binary("3.2", "stable", GodotSystemArch.OS_LINUX64, self.binary("new", b"new"))
+			self.assertTrue(self.blob_exists(first, shared_blob))
+
+			with open(first.manifest_path, 'r') as f:
+				self.assertEqual(json.load(f)["unreferenced_blobs"], [shared_blob])
+
+			second.add_installed_binary("3.1", "stable", GodotSystemArch.OS_LINUX64, shared_blob)
+
+		# Referenced again once the second manifest saves
+		self.assertTrue(self.blob_exists(second, shared_blob))
+		with open(second.manifest_path, 'r') as f:
+			self.assertNotIn("unreferenced_blobs", json.load(f))
+
+	def test_recent_blobs_are_collected_later(self):
+		manifest = GodotBinariesManifest()
+		manifest.add_binary("3.2", "stable", GodotSystemArch.OS_LINUX64, self.binary("old", b"old"))
+		old_blob = self.blob(manifest, "3.2")
+
+		manifest.add_binary("3.2", "stable", GodotSystemArch.OS_LINUX64, self.binary("new", b"new"))
+		self.assertTrue(self.blob_exists(manifest, old_blob))
+
+		self.age(manifest, old_blob, 2 * 60 * 60)
+		GodotBinariesManifest().add_binary("3.3", "stable", GodotSystemArch.OS_LINUX64, self.binary("other", b"other"))
+
+		self.assertFalse(self.blob_exists(manifest, old_blob))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,79 @@
+"""godot-daemon serving clients on a socket in a scratch directory.
+"""
+
+import os, sys, json, time, socket, datetime, subprocess, unittest
+
+from toolkit_fixtures import ToolkitScratch, tests_dir
+
+from godot_toolkit_config import GodotToolkitConfig
+from godot_daemon import GodotDaemonClient
+
+
+@unittest.skipUnless(GodotDaemonClient.supported(), "the daemon needs Unix domain sockets and fork()")
+class DaemonTest(unittest.TestCase):
+	def setUp(self):
+		self.scratch     = ToolkitScratch()
+		self.socket_path = os.path.join(self.scratch.path, "data", "daemon.sock")
+		self.scratch.config.set("godot_daemon", "daemon_socket_path", self.socket_path)
+
+		# A fresh catalogue, nothing is scraped
+		with open(os.path.join(self.scratch.path, "data", "cache.json"), 'w') as f:
+			json.dump({ "versions": {}, "last_cache_datetime": datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%MZ") }, f)
+
+		self.env = dict(os.environ)
+		self.env[GodotToolkitConfig.overrides_env] = json.dumps(self.scratch.config.overrides())
+		self.env.pop(GodotDaemonClient.no_daemon_env, None)
+
+		self.daemon_path = os.path.join(tests_dir, "..", "godot-toolkit", "godot_daemon.py")
+		self.daemon = subprocess.Popen([sys.executable, self.daemon_path, "--foreground"], env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+		self.client = GodotDaemonClient(self.socket_path)
+		start_time = time.monotonic()
+		while self.client.request({ "op": "status" }) == None:
+			self.assertLess(time.monotonic() - start_time, 30, "the daemon didn't start")
+			time.sleep(0.1)
+
+	def tearDown(self):
+		self.client.request({ "op": "stop" })
+		self.daemon.wait(timeout=30)
+		self.scratch.close()
+
+	def connect(self):
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.connect(self.socket_path)
+		return sock
+
+	def test_stuck_clients_dont_hold_up_others(self):
+		silent  = self.connect()
+		partial = self.connect()
+		partial.sendall(b'{"op": "sta')
+
+		try:
+			start = time.monotonic()
+			status = self.client.request({ "op": "status" })
+			self.assertLess(time.monotonic() - start, 1)
+			self.assertEqual(status["pid"], self.daemon.pid)
+		finally:
+			silent.close()
+			partial.close()
+
+	def test_runs_commands_on_the_clients_terminal(self):
+		result = subprocess.run([sys.executable, self.daemon_path, "--client", "godot-cli", "--version"], env=self.env, capture_output=True, timeout=30)
+
+		self.assertEqual(result.returncode, 0)
+		self.assertIn(b"version", result.stdout)
+		self.assertEqual(self.client.request({ "op": "status" })["served"]["other"], 1)
+
+	def test_malformed_request_is_dropped(self):
+		sock = self.connect()
+		try:
+			sock.sendall(b"not json\n")
+			self.assertEqual(sock.recv(1), b"")
+		finally:
+			sock.close()
+
+		self.assertNotEqual(self.client.request({ "op": "status" }), None)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,176 @@
+"""GodotDownloader against local servers with and without Range support.
+"""
+
+import os, json, hashlib, unittest, contextlib, io
+
+from toolkit_fixtures import ToolkitScratch
+
+from godot_downloader import GodotDownloader, DownloadError
+
+
+class _DownloaderTest(unittest.TestCase):
+	ranges = True
+	size   = 1024 * 1024
+
+	def setUp(self):
+		self.scratch = ToolkitScratch(ranges=self.ranges)
+		self.server  = self.scratch.server
+
+		self.data      = os.urandom(self.size)
+		self.path      = "/godotengine/3.2/Godot_v3.2-stable_x11.64.zip"
+		self.url       = self.server.url + self.path
+		self.dest_path = os.path.join(self.scratch.path, "data", "download.zip")
+		self.scratch.tree.add_file(self.path, self.data)
+
+	def tearDown(self):
+		self.scratch.close()
+
+	def download(self, connections=4, retries=3, **kwargs):
+		downloader = GodotDownloader(connections=connections, min_segment_size=64 * 1024, chunk_size=16 * 1024, timeout=10, retries=retries)
+		with contextlib.redirect_stdout(io.StringIO()):
+			return downloader.download(self.url, self.dest_path, **kwargs)
+
+	def ranges_requested(self):
+		return sorted(headers["Range"] for path, headers, client in self.server.requests if path == self.path and "Range" in headers)
+
+	def assertDownloaded(self, data):
+		with open(self.dest_path, 'rb') as f:
+			self.assertEqual(f.read(), data)
+		self.assertFalse(os.path.exists(self.dest_path + ".part"))
+		self.assertFalse(os.path.exists(self.dest_path + ".part.json"))
+
+
+class RangedDownloadTest(_DownloaderTest):
+	def test_segments_download_in_parallel(self):
+		progress = []
+		result = self.download(progress=lambda downloaded, total: progress.append((downloaded, total)))
+
+		self.assertDownloaded(self.data)
+		self.assertEqual(result["sha256"], hashlib.sha256(self.data).hexdigest())
+		self.assertEqual(result["fetched"], self.size)
+		self.assertEqual(progress[-1], (self.size, self.size))
+
+		# The probe and one request per segment
+		self.assertEqual(self.ranges_requested(), sorted(["bytes=0-0", "bytes=0-262143", "bytes=262144-524287", "bytes=524288-786431", "bytes=786432-1048575"]))
+
+	def test_checksum_mismatch(self):
+		with self.assertRaises(DownloadError):
+			self.download(expected_sha256="0" * 64)
+
+		self.assertFalse(os.path.exists(self.dest_path))
+		self.assertFalse(os.path.exists(self.dest_path + ".part"))
+
+	def test_interrupted_download_resumes(self):
+		self.server.truncate(self.path)
+
+		with self.assertRaises(DownloadError):
+			self.download(connections=1, retries=0)
+
+		with open(self.dest_path + ".part.json", 'r') as f:
+			state = json.load(f)
+		done = state["segments"][0]["done"]
+		self.assertGreater(done, 0)
+		self.assertLess(done, self.size)
+
+		result = self.download(connections=1)
+
+		self.assertDownloaded(self.data)
+		self.assertEqual(result["fetched"], self.size - done)
+		self.assertEqual(result["sha256"], hashlib.sha256(self.data).hexdigest())
+		self.assertEqual(self.ranges_requested()[-1], "bytes={start}-{end}".format(start=done, end=self.size - 1))
+
+	def test_resume_from_saved_state(self):
+		etag = '"{digest}"'.format(digest=hashlib.sha1(self.data).hexdigest())
+		done = 100 * 1024
+
+		# Two segments, the first one half done and the second one finished
+		with open(self.dest_path + ".part", 'wb') as f:
+			f.write(self.data[:done])
+			f.write(b"\0" * (self.size // 2 - done))
+			f.write(self.data[self.size // 2:])
+		with open(self.dest_path + ".part.json", 'w') as f:
+			json.dump({ "url": self.url, "total": self.size, "validator": etag, "segments": [
+				{ "start": 0,              "end": self.size // 2 - 1, "done": done },
+				{ "start": self.size // 2, "end": self.size - 1,      "done": self.size // 2 },
+			] }, f)
+
+		result = self.download()
+
+		self.assertDownloaded(self.data)
+		self.assertEqual(result["fetched"], self.size // 2 - done)
+		self.assertEqual(result["sha256"], hashlib.sha256(self.data).hexdigest())
+		self.assertEqual(self.ranges_requested(), sorted(["bytes=0-0", "bytes={start}-{end}".format(start=done, end=self.size // 2 - 1)]))
+
+	def test_saved_state_of_another_file_is_discarded(self):
+		with open(self.dest_path + ".part", 'wb') as f:
+			f.write(b"\0" * self.size)
+		with open(self.dest_path + ".part.json", 'w') as f:
+			json.dump({ "url": self.url, "total": self.size, "validator": '"outdated"', "segments": [
+				{ "start": 0, "end": self.size - 1, "done": self.size // 2 },
+			] }, f)
+
+		result = self.download()
+
+		self.assertDownloaded(self.data)
+		self.assertEqual(result["fetched"], self.size)
+
+	def test_file_changing_during_download_restarts_it(self):
+		changed = os.urandom(self.size)
+
+		# Swap the file right after the probe, the segments then ask with a stale If-Range
+		record = self.server.record
+		def record_and_swap(handler):
+			record(handler)
+			if handler.headers.get("Range") == "bytes=0-0" and self.server.count(self.path) == 1:
+				self.scratch.tree.add_file(self.path, changed)
+		self.server.record = record_and_swap
+
+		result = self.download(connections=2)
+
+		self.assertDownloaded(changed)
+		self.assertEqual(result["sha256"], hashlib.sha256(changed).hexdigest())
+		self.assertTrue(any("If-Range" in headers for path, headers, client in self.server.requests))
+
+	def test_partial_probe_without_total(self):
+		self.server.unknown_total = True
+
+		result = self.download()
+
+		self.assertDownloaded(self.data)
+		self.assertEqual(result["fetched"], self.size)
+		self.assertEqual(result["sha256"], hashlib.sha256(self.data).hexdigest())
+
+		# The probe and the whole file without a Range
+		self.assertEqual(self.ranges_requested(), ["bytes=0-0"])
+		self.assertEqual(self.server.count(self.path), 2)
+
+
+class UnrangedDownloadTest(_DownloaderTest):
+	ranges = False
+
+	def test_single_connection_fallback(self):
+		progress = []
+		result = self.download(progress=lambda downloaded, total: progress.append((downloaded, total)))
+
+		self.assertDownloaded(self.data)
+		self.assertEqual(result["sha256"], hashlib.sha256(self.data).hexdigest())
+		self.assertEqual(result["fetched"], self.size)
+		self.assertEqual(progress[-1], (self.size, self.size))
+
+		# The probe's response is the download
+		self.assertEqual(self.server.count(self.path), 1)
+
+	def test_interrupted_download_starts_over(self):
+		self.server.truncate(self.path)
+
+		with self.assertRaises(DownloadError):
+			self.download()
+
+		result = self.download()
+
+		self.assertDownloaded(self.data)
+		self.assertEqual(result["fetched"], self.size)
+
+
+if __name__ == '__main__':
+	unittest.main()
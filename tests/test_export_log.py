@@ -0,0 +1,48 @@
+"""GodotPackedFiles in memory and spilled to SQLite.
+"""
+
+import os, shutil, tempfile, unittest
+
+# Puts godot-toolkit on sys.path
+import toolkit_fixtures
+
+from godot_export_log import GodotPackedFiles
+
+
+class PackedFilesTest(unittest.TestCase):
+	def setUp(self):
+		self.path = tempfile.mkdtemp(prefix="godot-toolkit-test-")
+
+	def tearDown(self):
+		shutil.rmtree(self.path, ignore_errors=True)
+
+	def check_list_like(self, files):
+		paths = ["res://assets/sprite_{i}.png".format(i=i) for i in range(2500)]
+		files.update(paths)
+		files.update(paths[:10])
+		files.flush()
+
+		self.assertEqual(len(files), len(paths))
+		self.assertEqual(files, paths)
+		self.assertEqual(list(files), paths)
+		self.assertEqual(files[0], paths[0])
+		self.assertEqual(files[-1], paths[-1])
+		self.assertEqual(files[1200:1300], paths[1200:1300])
+		self.assertEqual(files[::-700], paths[::-700])
+		self.assertEqual(files[3000:], [])
+		self.assertEqual(files.index(paths[42]), 42)
+		self.assertIn(paths[2000], files)
+		self.assertNotIn("res://missing.png", files)
+
+		with self.assertRaises(IndexError):
+			files[len(paths)]
+
+	def test_in_memory(self):
+		self.check_list_like(GodotPackedFiles())
+
+	def test_spilled(self):
+		self.check_list_like(GodotPackedFiles(os.path.join(self.path, "files.db")))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,63 @@
+"""Remotes of the import cache.
+"""
+
+import os, shutil, tempfile, unittest
+
+# Puts godot-toolkit on sys.path
+import toolkit_fixtures
+
+from godot_import_cache import GodotImportCache, GodotImportCacheRemote, GodotImportCacheDirectoryRemote
+
+
+class ImportCacheRemoteTest(unittest.TestCase):
+	def setUp(self):
+		self.path = tempfile.mkdtemp(prefix="godot-toolkit-test-")
+
+	def tearDown(self):
+		shutil.rmtree(self.path, ignore_errors=True)
+
+	def entry_dir(self, name, files):
+		entry_dir = os.path.join(self.path, name)
+		os.makedirs(entry_dir)
+		for file_name, data in files.items():
+			with open(os.path.join(entry_dir, file_name), 'wb') as f:
+				f.write(data)
+
+		return entry_dir
+
+	def test_directory_remote_round_trip(self):
+		remote = GodotImportCache.load_remote(self.entry_dir("remote", {}))
+		self.assertIsInstance(remote, GodotImportCacheDirectoryRemote)
+
+		key   = "ab" + "0" * 62
+		files = { "sprite.png-0123.stex": b"stex", "sprite.png-0123.md5": b"md5" }
+		remote.upload(key, self.entry_dir("src", files))
+		remote.upload(key, self.entry_dir("again", { "other": b"ignored" }))
+
+		dest_dir = self.entry_dir("dest", {})
+		self.assertTrue(remote.fetch(key, dest_dir))
+		self.assertEqual(sorted(os.listdir(dest_dir)), sorted(files))
+
+		self.assertFalse(remote.fetch("cd" + "0" * 62, self.entry_dir("missing", {})))
+
+	def test_module_remote(self):
+		module_path = os.path.join(self.path, "remote.py")
+		with open(module_path, 'w') as f:
+			f.write("class ImportCacheRemote():\n\tdef fetch(self, key, dest_dir):\n\t\treturn False\n\tdef upload(self, key, src_dir):\n\t\tpass\n")
+
+		self.assertFalse(GodotImportCache.load_remote(module_path).fetch("key", self.path))
+
+		with self.assertRaises(ValueError):
+			GodotImportCache.load_remote(os.path.join(self.path, "missing.py"))
+
+	def test_remotes_implement_both_methods(self):
+		class FetchOnly(GodotImportCacheRemote):
+			def fetch(self, key, dest_dir):
+				return False
+
+		with self.assertRaises(TypeError):
+			FetchOnly()
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,50 @@
+"""godot-cli's exit status for downloads.
+"""
+
+import os, sys, json, subprocess, unittest
+
+from toolkit_fixtures import ToolkitScratch, tests_dir
+
+from godot_toolkit_config import GodotToolkitConfig
+
+
+class ManagerDownloadTest(unittest.TestCase):
+	def setUp(self):
+		self.scratch = ToolkitScratch()
+
+	def tearDown(self):
+		self.scratch.close()
+
+	def run_cli(self, *args):
+		env = dict(os.environ)
+		env[GodotToolkitConfig.overrides_env] = json.dumps(self.scratch.config.overrides())
+
+		manager_path = os.path.join(tests_dir, "..", "godot-toolkit", "godot_manager.py")
+		process = subprocess.run([sys.executable, manager_path, "--sync"] + list(args), env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=120)
+
+		return process.returncode, process.stdout.decode("utf-8", errors="replace")
+
+	def test_download(self):
+		self.scratch.tree.add_godot_archive("3.2", "x11.64")
+
+		returncode, output = self.run_cli("--download", "3.2", "stable", "linux")
+		self.assertEqual(returncode, 0, output)
+
+	def test_failed_download(self):
+		# Listed, but the archive isn't on the server
+		returncode, output = self.run_cli("--download", "3.2", "stable", "linux")
+		self.assertEqual(returncode, 1, output)
+		self.assertIn("An error occurred while downloading 3.2", output)
+
+	def test_unknown_version(self):
+		returncode, output = self.run_cli("--download", "9.9", "stable", "linux")
+		self.assertEqual(returncode, 1, output)
+
+	def test_unknown_arch(self):
+		returncode, output = self.run_cli("--download", "3.2", "stable", "amiga")
+		self.assertEqual(returncode, 1, output)
+		self.assertIn("Unknown arch amiga", output)
+
+
+if __name__ == '__main__':
+	unittest.main()
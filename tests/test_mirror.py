@@ -0,0 +1,223 @@
+"""GodotMirror in front of the fixture server as its upstream.
+"""
+
+import os, time, hashlib, http.client, threading, unittest, contextlib, io
+
+from toolkit_fixtures import ToolkitScratch
+
+from godot_mirror import GodotMirror
+from godot_binaries_cache import GodotBinariesCache
+from godot_dir_listing import GodotDirListingParser
+from godot_downloader import GodotDownloader
+
+
+class MirrorTest(unittest.TestCase):
+	archive_path = "/3.2/Godot_v3.2-stable_x11.64.zip"
+
+	def setUp(self):
+		self.scratch  = ToolkitScratch()
+		self.upstream = self.scratch.server
+		self.archive  = self.scratch.tree.add_godot_archive("3.2", "x11.64")
+
+		self.mirror = GodotMirror(os.path.join(self.scratch.path, "mirror"), self.upstream.url + "/godotengine", timeout=10, retries=0)
+		self.server = self.mirror.create_server("127.0.0.1", 0)
+		self.url    = "http://127.0.0.1:{port}".format(port=self.server.server_address[1])
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self.mirror.http.close()
+		self.scratch.close()
+
+	def get(self, path, headers=None):
+		connection = http.client.HTTPConnection("127.0.0.1", self.server.server_address[1], timeout=10)
+		try:
+			connection.request("GET", path, headers=headers or {})
+			response = connection.getresponse()
+			return response.status, { k.lower(): v for k, v in response.getheaders() }, response.read()
+		finally:
+			connection.close()
+
+	def rows(self, url):
+		rows   = []
+		parser = GodotDirListingParser(rows.append)
+		with contextlib.closing(http.client.HTTPConnection(url.split("/")[2], timeout=10)) as connection:
+			connection.request("GET", "/" + url.split("/", 3)[3])
+			response = connection.getresponse()
+			parser.set_content_type(response.getheader("content-type"))
+			parser.feed(response.read())
+		parser.close()
+
+		return rows
+
+	def recache(self, base_url):
+		self.scratch.config.set("godot_cli", "base_dl_url", base_url)
+		with contextlib.redirect_stdout(io.StringIO()):
+			cache = GodotBinariesCache(suppress_recache=True)
+			cache.recache(full=True)
+
+		catalogue = cache.get_cache()
+		os.remove(cache.cache_path)
+
+		return catalogue["versions"]
+
+	def upstream_archive_path(self):
+		return "/godotengine" + self.archive_path
+
+	def test_listing_rows_match_upstream(self):
+		for rel_dir in ("", "3.2/"):
+			self.assertEqual(self.rows(self.url + "/" + rel_dir), self.rows(self.upstream.url + "/godotengine/" + rel_dir))
+
+	def test_catalogue_through_mirror_matches_upstream(self):
+		direct   = self.recache(self.upstream.url + "/godotengine")
+		mirrored = self.recache(self.url)
+
+		self.assertEqual(mirrored, direct)
+
+	def test_listings_are_cached(self):
+		self.get("/")
+		before = self.upstream.count()
+		self.get("/")
+
+		self.assertEqual(self.upstream.count(), before)
+		self.assertEqual(self.mirror.stats["hits"], 1)
+
+	def test_stale_listing_is_served_when_upstream_fails(self):
+		self.mirror.listing_ttl = 0
+		status, headers, first = self.get("/3.2/")
+
+		self.upstream.fail("/godotengine/3.2/")
+		with contextlib.redirect_stdout(io.StringIO()):
+			status, headers, second = self.get("/3.2/")
+
+		self.assertEqual(status, 200)
+		self.assertEqual(second, first)
+		self.assertEqual(self.mirror.stats["stale"], 1)
+
+	def test_directories_redirect_to_their_listing(self):
+		status, headers, body = self.get("/3.2")
+
+		self.assertEqual(status, 301)
+		self.assertEqual(headers["location"], "/3.2/")
+
+	def test_ranges_are_served_from_the_cache(self):
+		self.get(self.archive_path)
+
+		status, headers, body = self.get(self.archive_path, { "Range": "bytes=100-199" })
+		self.assertEqual(status, 206)
+		self.assertEqual(body, self.archive[100:200])
+		self.assertEqual(headers["content-range"], "bytes 100-199/{size}".format(size=len(self.archive)))
+
+		etag = headers["etag"]
+		self.assertEqual(etag, '"{digest}"'.format(digest=hashlib.sha256(self.archive).hexdigest()))
+
+		status, headers, body = self.get(self.archive_path, { "Range": "bytes=-10" })
+		self.assertEqual(status, 206)
+		self.assertEqual(body, self.archive[-10:])
+
+		status, headers, body = self.get(self.archive_path, { "Range": "bytes=100-199", "If-Range": etag })
+		self.assertEqual(status, 206)
+
+		status, headers, body = self.get(self.archive_path, { "Range": "bytes=100-199", "If-Range": '"outdated"' })
+		self.assertEqual(status, 200)
+		self.assertEqual(body, self.archive)
+
+		status, headers, body = self.get(self.archive_path, { "Range": "bytes={size}-".format(size=len(self.archive)) })
+		self.assertEqual(status, 416)
+
+		# Upstream was only asked for the whole archive, once
+		self.assertEqual(self.upstream.count(self.upstream_archive_path()), 1)
+		self.assertNotIn("Range", self.upstream.requests[-1][1])
+
+	def test_ranged_download_through_mirror(self):
+		dest_path  = os.path.join(self.scratch.path, "data", "download.zip")
+		downloader = GodotDownloader(connections=4, min_segment_size=16 * 1024, chunk_size=16 * 1024, timeout=10)
+		with contextlib.redirect_stdout(io.StringIO()):
+			result = downloader.download(self.url + self.archive_path, dest_path)
+
+		with open(dest_path, 'rb') as f:
+			self.assertEqual(f.read(), self.archive)
+		self.assertEqual(result["sha256"], hashlib.sha256(self.archive).hexdigest())
+		self.assertEqual(self.upstream.count(self.upstream_archive_path()), 1)
+
+	def test_concurrent_misses_share_one_upstream_fetch(self):
+		# Slow upstream, so every request arrives while the first fetch runs
+		self.upstream.delay = 0.2
+
+		bodies = []
+		def fetch():
+			bodies.append(self.get(self.archive_path)[2])
+
+		with contextlib.redirect_stdout(io.StringIO()):
+			threads = [threading.Thread(target=fetch) for i in range(8)]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+
+		self.assertEqual(bodies, [self.archive] * 8)
+		self.assertEqual(self.upstream.count(self.upstream_archive_path()), 1)
+		self.assertEqual(self.upstream.count("/godotengine/3.2/"), 1)
+		self.assertEqual(self.mirror.stats["upstream_fetches"], 2)
+
+	def test_cold_fetch_is_streamed(self):
+		self.archive = self.scratch.tree.add_godot_archive("3.2", "x11.64", size=1024 * 1024)
+		self.upstream.chunk_delay = 0.05
+
+		with contextlib.redirect_stdout(io.StringIO()):
+			connection = http.client.HTTPConnection("127.0.0.1", self.server.server_address[1], timeout=10)
+			try:
+				start = time.monotonic()
+				connection.request("GET", self.archive_path)
+				response = connection.getresponse()
+				first = response.read(1)
+				first_byte = time.monotonic() - start
+				body = first + response.read()
+				total = time.monotonic() - start
+			finally:
+				connection.close()
+
+		self.assertEqual(response.status, 200)
+		self.assertEqual(body, self.archive)
+		self.assertEqual(response.getheader("etag"), None)
+		self.assertLess(first_byte, total / 2)
+
+		# Cached from now on, with its checksum as ETag
+		status, headers, body = self.get(self.archive_path)
+		self.assertEqual(headers["etag"], '"{digest}"'.format(digest=hashlib.sha256(self.archive).hexdigest()))
+		self.assertEqual(self.upstream.count(self.upstream_archive_path()), 1)
+
+	def test_streamed_ranges(self):
+		self.archive = self.scratch.tree.add_godot_archive("3.2", "x11.64", size=1024 * 1024)
+		self.upstream.chunk_delay = 0.01
+
+		dest_path  = os.path.join(self.scratch.path, "data", "download.zip")
+		downloader = GodotDownloader(connections=4, min_segment_size=64 * 1024, chunk_size=16 * 1024, timeout=10)
+		with contextlib.redirect_stdout(io.StringIO()):
+			result = downloader.download(self.url + self.archive_path, dest_path)
+
+		self.assertEqual(result["sha256"], hashlib.sha256(self.archive).hexdigest())
+		self.assertEqual(self.upstream.count(self.upstream_archive_path()), 1)
+
+	def test_missing_files_are_not_found(self):
+		status, headers, body = self.get("/3.2/Godot_v3.2-stable_missing.zip")
+		self.assertEqual(status, 404)
+
+		status, headers, body = self.get("/missing/Godot_v3.2-stable_x11.64.zip")
+		self.assertEqual(status, 404)
+
+	def test_upstream_failures_are_gateway_errors(self):
+		self.upstream.fail(self.upstream_archive_path())
+
+		status, headers, body = self.get(self.archive_path)
+		self.assertEqual(status, 502)
+
+		with contextlib.redirect_stdout(io.StringIO()):
+			status, headers, body = self.get(self.archive_path)
+		self.assertEqual(status, 200)
+		self.assertEqual(body, self.archive)
+
+
+if __name__ == '__main__':
+	unittest.main()
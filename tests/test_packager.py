@@ -0,0 +1,88 @@
+"""GodotPackager output read back with zipfile and tarfile.
+"""
+
+import os, json, shutil, hashlib, zipfile, tarfile, tempfile, unittest
+from unittest import mock
+
+# Puts godot-toolkit on sys.path
+import toolkit_fixtures
+
+import godot_packager
+from godot_packager import GodotPackager
+
+
+class PackagerRoundTripTest(unittest.TestCase):
+	def setUp(self):
+		self.path       = tempfile.mkdtemp(prefix="godot-toolkit-test-")
+		self.source_dir = os.path.join(self.path, "Linux_X11")
+
+		# Spanning several compression blocks, compressible and not, plus an
+		# empty file and a sub directory
+		self.files = {
+			"game.pck":         os.urandom(300 * 1024),
+			"game.x86_64":      b"Godot " * 100 * 1024,
+			"empty.txt":        b"",
+			"data/config.json": b'{ "level": 1 }\n',
+		}
+		for rel_path, data in self.files.items():
+			path = os.path.join(self.source_dir, rel_path)
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			with open(path, 'wb') as f:
+				f.write(data)
+		os.chmod(os.path.join(self.source_dir, "game.x86_64"), 0o755)
+
+	def tearDown(self):
+		shutil.rmtree(self.path, ignore_errors=True)
+
+	def package(self, package_format):
+		packager = GodotPackager(package_format, jobs=4, block_size=64 * 1024)
+		manifest = packager.package(self.source_dir, extra={ "preset": "Linux/X11" })
+		package_path = packager.package_path(self.source_dir)
+
+		# The manifest describes the package and every artifact in it
+		with open(package_path + ".manifest.json", 'r') as f:
+			self.assertEqual(json.load(f), manifest)
+		with open(package_path, 'rb') as f:
+			self.assertEqual(manifest["package"]["sha256"], hashlib.sha256(f.read()).hexdigest())
+		self.assertEqual(manifest["package"]["size"], os.path.getsize(package_path))
+		self.assertEqual(manifest["preset"], "Linux/X11")
+		self.assertEqual({ artifact["path"]: (artifact["size"], artifact["sha256"]) for artifact in manifest["artifacts"] },
+		                 { rel_path: (len(data), hashlib.sha256(data).hexdigest()) for rel_path, data in self.files.items() })
+
+		return package_path
+
+	def check_zip(self):
+		with zipfile.ZipFile(self.package("zip")) as zip_ref:
+			self.assertEqual(zip_ref.testzip(), None)
+			self.assertEqual(sorted(zip_ref.namelist()), sorted(self.files))
+			for rel_path, data in self.files.items():
+				self.assertEqual(zip_ref.read(rel_path), data)
+			self.assertEqual(zip_ref.getinfo("game.x86_64").external_attr >> 16 & 0o777, 0o755)
+
+	def test_zip(self):
+		self.check_zip()
+
+	def test_zip64(self):
+		# Every size and offset past the limit, so all the ZIP64 records are written
+		with mock.patch.object(godot_packager._ZipStream, "zip64_limit", 1000):
+			self.check_zip()
+
+	def test_tar_gz(self):
+		with tarfile.open(self.package("tar.gz"), "r:gz") as tar:
+			self.assertEqual(sorted(tar.getnames()), sorted(self.files))
+			for rel_path, data in self.files.items():
+				self.assertEqual(tar.extractfile(rel_path).read(), data)
+			self.assertEqual(tar.getmember("game.x86_64").mode & 0o777, 0o755)
+
+	def test_package_is_not_packed_into_itself(self):
+		packager = GodotPackager("zip")
+		package_path = os.path.join(self.source_dir, "game.zip")
+		packager.package(self.source_dir, package_path)
+		packager.package(self.source_dir, package_path)
+
+		with zipfile.ZipFile(package_path) as zip_ref:
+			self.assertEqual(sorted(zip_ref.namelist()), sorted(self.files))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,126 @@
+"""GodotProcessSupervisor and GodotExporter driving the stub Godot.
+"""
+
+import os, sys, time, shutil, tempfile, threading, unittest, contextlib, io
+
+from toolkit_fixtures import stub_godot_path, make_stub_project
+
+from godot_process import GodotProcessSupervisor, GodotProcessTimeout, GodotProcessCancelled
+from godot_exporter import GodotExporter
+
+
+class _StubGodotTest(unittest.TestCase):
+	def setUp(self):
+		self.path    = tempfile.mkdtemp(prefix="godot-toolkit-test-")
+		self.environ = dict(os.environ)
+
+	def tearDown(self):
+		os.environ.clear()
+		os.environ.update(self.environ)
+		shutil.rmtree(self.path, ignore_errors=True)
+
+	def stub_env(self, files=0, errors=0, noise=0, sleep=0, exit_code=0):
+		os.environ["STUB_GODOT_FILES"]  = str(files)
+		os.environ["STUB_GODOT_ERRORS"] = str(errors)
+		os.environ["STUB_GODOT_NOISE"]  = str(noise)
+		os.environ["STUB_GODOT_SLEEP"]  = str(sleep)
+		os.environ["STUB_GODOT_EXIT"]   = str(exit_code)
+
+
+class ProcessSupervisorTest(_StubGodotTest):
+	def supervise(self, timeout=60):
+		lines = { "stdout": 0, "stderr": 0 }
+		def on_line(stream_name, line):
+			lines[stream_name] += 1
+
+		supervisor = GodotProcessSupervisor([sys.executable, stub_godot_path, os.path.join(self.path, "game.pck")], on_line=on_line, timeout=timeout)
+		return supervisor, lines
+
+	def test_floods_on_both_streams(self):
+		# Megabytes on each stream, far beyond what a pipe buffers
+		self.stub_env(files=20000, errors=100, noise=20000)
+		supervisor, lines = self.supervise()
+
+		self.assertEqual(supervisor.run(), 0)
+		self.assertEqual(lines["stdout"], 3 + 2 * 20000 + 2)
+		self.assertEqual(lines["stderr"], 2 * 20000 + 2 * 100)
+
+	def test_exit_code(self):
+		self.stub_env(files=10, exit_code=3)
+		supervisor, lines = self.supervise()
+
+		self.assertEqual(supervisor.run(), 3)
+		self.assertEqual(lines["stdout"], 3 + 2 * 10 + 2)
+
+	def test_returns_when_the_process_exits(self):
+		self.stub_env(files=10)
+		supervisor, lines = self.supervise()
+
+		start = time.monotonic()
+		supervisor.run()
+		self.assertLess(time.monotonic() - start, 5)
+
+	def test_timeout_kills_the_process(self):
+		self.stub_env(files=10, noise=10, sleep=30)
+		supervisor, lines = self.supervise(timeout=1)
+
+		start = time.monotonic()
+		with self.assertRaises(GodotProcessTimeout):
+			supervisor.run()
+
+		self.assertLess(time.monotonic() - start, 10)
+		self.assertNotEqual(supervisor.process.poll(), None)
+		self.assertEqual(lines["stdout"], 3 + 2 * 10 + 2)
+
+	def test_cancel_kills_the_process(self):
+		self.stub_env(files=10, sleep=30)
+		supervisor, lines = self.supervise()
+
+		threading.Timer(0.5, supervisor.cancel).start()
+		start = time.monotonic()
+		with self.assertRaises(GodotProcessCancelled):
+			supervisor.run()
+
+		self.assertLess(time.monotonic() - start, 10)
+		self.assertNotEqual(supervisor.process.poll(), None)
+
+
+class ExporterStubGodotTest(_StubGodotTest):
+	def setUp(self):
+		super().setUp()
+
+		self.project_path  = os.path.join(self.path, "project")
+		self.template_path = os.path.join(self.path, "template.bin")
+		self.export_dest   = os.path.join(self.path, "export", "game.pck")
+
+		make_stub_project(self.project_path, self.template_path, assets=1)
+
+	def export(self, timeout=None):
+		self.exporter = GodotExporter(godot_bin_path=stub_godot_path, export_template_bin_path=self.template_path, project_path=self.project_path,
+		                              preset="Linux/X11", export_dest=self.export_dest, timeout=timeout)
+		with contextlib.redirect_stdout(io.StringIO()):
+			return self.exporter.export()
+
+	def test_chatty_export(self):
+		self.stub_env(files=20000, errors=100, noise=20000)
+
+		self.assertTrue(self.export(timeout=120))
+		self.assertEqual(len(self.exporter.processed_files), 2 * 20000)
+		self.assertEqual(self.exporter.export_log.error_count, 100)
+		self.assertTrue(os.path.isfile(self.export_dest))
+
+	def test_failed_export(self):
+		self.stub_env(files=10, exit_code=1)
+
+		self.assertFalse(self.export())
+
+	def test_export_timeout(self):
+		self.stub_env(files=10, sleep=30)
+
+		start = time.monotonic()
+		self.assertFalse(self.export(timeout=1))
+		self.assertLess(time.monotonic() - start, 10)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,90 @@
+"""Several godot-cli processes sharing one data directory, as CI jobs on one
+build host do.
+"""
+
+import os, sys, json, subprocess, unittest
+
+from toolkit_fixtures import ToolkitScratch, tests_dir
+
+from godot_toolkit_config import GodotToolkitConfig
+
+
+class SharedDataDirStressTest(unittest.TestCase):
+	processes = 8
+
+	def setUp(self):
+		self.scratch = ToolkitScratch()
+		self.server  = self.scratch.server
+		self.archive = self.scratch.tree.add_godot_archive("3.2", "x11.64")
+
+		# Slow enough that every process starts while the first one is still at it
+		self.server.delay = 0.02
+
+	def tearDown(self):
+		self.scratch.close()
+
+	def run_cli(self, *args):
+		env = dict(os.environ)
+		env[GodotToolkitConfig.overrides_env] = json.dumps(self.scratch.config.overrides())
+
+		manager_path = os.path.join(tests_dir, "..", "godot-toolkit", "godot_manager.py")
+		processes = [subprocess.Popen([sys.executable, manager_path] + list(args), env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+		             for i in range(self.processes)]
+
+		outputs = []
+		for process in processes:
+			output, _ = process.communicate(timeout=120)
+			self.assertEqual(process.returncode, 0, output.decode("utf-8", errors="replace"))
+			outputs.append(output.decode("utf-8", errors="replace"))
+
+		return outputs
+
+	def read_json(self, *path):
+		with open(os.path.join(self.scratch.path, "data", *path), 'r') as f:
+			return json.load(f)
+
+	def test_one_refresh_and_one_download(self):
+		outputs = self.run_cli("--sync", "--download", "3.2", "stable", "linux")
+
+		# One process built the catalogue and the others picked it up
+		versions = self.scratch.tree.versions
+		self.assertEqual(len([output for output in outputs if "[+] Building cache" in output]), 1)
+		self.assertEqual(self.server.count("/godotengine/"), 1)
+		self.assertEqual(self.server.count("/nightly.json"), 1)
+
+		# Only one process downloaded the archive: a range probe and one segment
+		archive_path = "/godotengine/3.2/Godot_v3.2-stable_x11.64.zip"
+		self.assertEqual(self.server.count(archive_path), 2)
+		self.assertEqual(self.server.count(), 2 + len(versions) + 2)
+
+		catalogue = self.read_json("cache.json")
+		self.assertEqual(sorted(v for v in catalogue["versions"] if v != "nightly"), sorted(versions))
+
+		manifest = self.read_json("godot_bin", "manifest.json")
+		self.assertIn("3.2", json.dumps(manifest))
+
+		tmp_dir = os.path.join(self.scratch.path, "data", "tmp")
+		self.assertEqual([name for name in os.listdir(tmp_dir) if not name.endswith(".lock")], [])
+
+	def test_concurrent_refreshes_of_a_stale_catalogue(self):
+		self.run_cli("--sync", "--download", "3.2", "stable", "linux")
+
+		catalogue = self.read_json("cache.json")
+		catalogue["last_cache_datetime"] = "2000-01-01 00:00Z"
+		with open(os.path.join(self.scratch.path, "data", "cache.json"), 'w') as f:
+			json.dump(catalogue, f)
+		before = self.server.count()
+
+		outputs = self.run_cli("--sync", "--download", "3.2", "stable", "linux")
+
+		# One incremental refresh: the unchanged index and nightly manifest
+		self.assertEqual(len([output for output in outputs if "[+] Refreshing cache" in output]), 1)
+		self.assertEqual(self.server.count() - before, 2)
+		self.assertTrue(all("Already have this version" in output for output in outputs))
+
+		self.assertNotEqual(self.read_json("cache.json")["last_cache_datetime"], "2000-01-01 00:00Z")
+		self.read_json("godot_bin", "manifest.json")
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,94 @@
+"""Version spec and release resolution of GodotVersionIndex.
+"""
+
+import json, unittest
+
+# Puts godot-toolkit on sys.path
+import toolkit_fixtures
+
+from godot_version_index import GodotVersionIndex, VersionSpecError
+
+
+def release(*arches):
+	return { "arches": list(arches) }
+
+
+catalogue = {
+	"versions": {
+		"2.1.6": { "releases": { "stable": release("x11.64") } },
+		"3.0":   { "releases": { "stable": release("x11.64") } },
+		"3.0.6": { "releases": { "stable": release("x11.64", "win64.exe") } },
+		"3.1":   { "releases": { "stable": release("x11.64"), "rc3": release(), "beta11": release(), "alpha5": release() } },
+		"3.1.1": { "releases": { "stable": release("x11.64") } },
+		"3.1.2": { "releases": { "stable": release("x11.64") } },
+		"3.2":   { "releases": { "stable": release("x11.64", "osx.64"), "rc1": release(), "rc2": release(), "beta10": release("x11.64"),
+		                         "beta2": release(), "dev1": release(), "mono": release() } },
+		"3.10":  { "releases": { "beta1": { "arches": None } } },
+		"nightly": { "commit": "0123456789abcdef" },
+	}
+}
+
+
+class VersionIndexTest(unittest.TestCase):
+	def setUp(self):
+		self.index = GodotVersionIndex.build(catalogue)
+
+	def test_versions_are_sorted_numerically(self):
+		self.assertEqual(self.index.versions(), ["2.1.6", "3.0", "3.0.6", "3.1", "3.1.1", "3.1.2", "3.2", "3.10"])
+		self.assertEqual(self.index.latest(), "3.10")
+
+	def test_select(self):
+		cases = {
+			"*":             ["2.1.6", "3.0", "3.0.6", "3.1", "3.1.1", "3.1.2", "3.2", "3.10"],
+			"latest":        ["3.10"],
+			"3.1":           ["3.1"],
+			"==3.0.6":       ["3.0.6"],
+			"3.1.x":         ["3.1", "3.1.1", "3.1.2"],
+			"3.*":           ["3.0", "3.0.6", "3.1", "3.1.1", "3.1.2", "3.2", "3.10"],
+			">=3.0,<3.2":    ["3.0", "3.0.6", "3.1", "3.1.1", "3.1.2"],
+			">3.1.1, <=3.2": ["3.1.2", "3.2"],
+			"<3":            ["2.1.6"],
+			"3.3":           [],
+			">3.2,<3.1":     [],
+		}
+		for spec, versions in cases.items():
+			self.assertEqual(self.index.select(spec), versions, spec)
+
+	def test_invalid_specs(self):
+		for spec in ("three", ">=3.1.x", "3.1,", "~3.1"):
+			with self.assertRaises(VersionSpecError, msg=spec):
+				self.index.select(spec)
+
+	def test_resolve_version(self):
+		self.assertEqual(self.index.resolve_version("3.1"), "3.1")
+		self.assertEqual(self.index.resolve_version("3.1.x"), "3.1.2")
+		self.assertEqual(self.index.resolve_version("<3.2"), "3.1.2")
+		self.assertEqual(self.index.resolve_version("latest"), "3.10")
+		self.assertEqual(self.index.resolve_version("4.x"), None)
+
+	def test_resolve_release(self):
+		self.assertEqual(self.index.releases("3.2"), ["mono", "dev1", "beta2", "beta10", "rc1", "rc2", "stable"])
+		self.assertEqual(self.index.resolve_release("3.2", "rc"), "rc2")
+		self.assertEqual(self.index.resolve_release("3.2", "beta"), "beta10")
+		self.assertEqual(self.index.resolve_release("3.2", "beta2"), "beta2")
+		self.assertEqual(self.index.resolve_release("3.2", "latest"), "stable")
+		self.assertEqual(self.index.resolve_release("3.10", "latest"), "beta1")
+		self.assertEqual(self.index.resolve_release("3.10", "stable"), None)
+		self.assertEqual(self.index.resolve_release("3.3", "stable"), None)
+
+	def test_arches(self):
+		self.assertEqual(self.index.arches("3.2", "stable"), ["x11.64", "osx.64"])
+		self.assertEqual(self.index.arches("3.10", "beta1"), None)
+		self.assertEqual(self.index.arches("3.2", "rc9"), None)
+
+	def test_stored_index(self):
+		# What cache.json holds answers the same way
+		stored = GodotVersionIndex(json.loads(json.dumps(self.index.index)))
+
+		self.assertEqual(stored.select(">=3.0,<3.2"), self.index.select(">=3.0,<3.2"))
+		self.assertEqual(stored.resolve_version("3.1.x"), "3.1.2")
+		self.assertEqual(stored.resolve_release("3.1", "rc"), "rc3")
+
+
+if __name__ == '__main__':
+	unittest.main()
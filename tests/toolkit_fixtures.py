@@ -0,0 +1,230 @@
+"""Shared fixtures of the godot-toolkit tests: a scratch data directory with the
+toolkit config pointing into it and a local HTTP server playing the download
+mirror, built from the recorded listings in benchmarks/fixtures.
+"""
+
+import os, re, io, sys, json, time, shutil, hashlib, zipfile, tempfile, threading
+from http.server import ThreadingHTTPServer
+
+tests_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, "..", "godot-toolkit"))
+sys.path.insert(0, os.path.join(tests_dir, "..", "benchmarks"))
+
+from fixture_support import QuietHandler, fixtures_dir, stub_godot_path, make_stub_project
+from godot_toolkit_config import GodotToolkitConfig
+
+
+class FixtureHandler(QuietHandler):
+	'''Serves the fixture tree like the real mirror: directory listings as pages
+	and files with an ETag, conditional GETs and, unless the server has `ranges`
+	turned off, Range and If-Range support.
+	'''
+
+	range_re = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+	def do_GET(self):
+		self.server.record(self)
+		if self.server.delay:
+			time.sleep(self.server.delay)
+		if self.server.take_failure(self.path):
+			self.send_error(503)
+			return
+
+		super().do_GET()
+
+	def send_head(self):
+		path = self.translate_path(self.path)
+		if not os.path.isfile(path):
+			return super().send_head()
+
+		with open(path, 'rb') as f:
+			data = f.read()
+		etag = '"{digest}"'.format(digest=hashlib.sha1(data).hexdigest())
+
+		if self.headers.get("If-None-Match") == etag:
+			self.send_response(304)
+			self.send_header("ETag", etag)
+			self.end_headers()
+			return None
+
+		status = 200
+		start  = 0
+		end    = len(data) - 1
+		match  = self.range_re.match(self.headers.get("Range", ""))
+		if self.server.ranges and match and self.headers.get("If-Range", etag) == etag:
+			status = 206
+			start  = int(match.group(1))
+			end    = min(int(match.group(2)), end) if match.group(2) else end
+
+		self.send_response(status)
+		self.send_header("Content-Type", self.guess_type(path))
+		self.send_header("Content-Length", str(end - start + 1))
+		self.send_header("ETag", etag)
+		if self.server.ranges:
+			self.send_header("Accept-Ranges", "bytes")
+		if status == 206:
+			self.send_header("Content-Range", "bytes {start}-{end}/{total}".format(start=start, end=end, total="*" if self.server.unknown_total else len(data)))
+		self.end_headers()
+
+		# Announce the whole body but hang up half way through it. Range probes
+		# of a single byte are left alone.
+		body = data[start:end + 1]
+		if len(body) > 1 and self.server.take_truncation(self.path):
+			body = body[:len(body) // 2]
+			self.close_connection = True
+
+		return io.BytesIO(body)
+
+	def copyfile(self, source, outputfile):
+		if not self.server.chunk_delay:
+			return super().copyfile(source, outputfile)
+
+		for data in iter(lambda: source.read(64 * 1024), b""):
+			outputfile.write(data)
+			outputfile.flush()
+			time.sleep(self.server.chunk_delay)
+
+
+class FixtureServer(ThreadingHTTPServer):
+	'''ThreadingHTTPServer on a free localhost port serving `root`. Every request
+	is recorded as (path, headers, client address). Failures and truncated
+	responses can be queued up for a path with fail() and truncate(), `delay`
+	slows every response down, `chunk_delay` trickles bodies out 64 KiB at a
+	time and `unknown_total` leaves the size out of Content-Range.
+	'''
+
+	daemon_threads = True
+
+	def __init__(self, root, ranges=True):
+		super().__init__(("127.0.0.1", 0), lambda *a, **kw: FixtureHandler(*a, directory=root, **kw))
+
+		self.root          = root
+		self.ranges        = ranges
+		self.delay         = 0
+		self.chunk_delay   = 0
+		self.unknown_total = False
+		self.requests      = []
+
+		self.__lock        = threading.Lock()
+		self.__failures    = {}
+		self.__truncations = {}
+
+		threading.Thread(target=self.serve_forever, daemon=True).start()
+
+	@property
+	def url(self):
+		return "http://127.0.0.1:{port}".format(port=self.server_address[1])
+
+	def record(self, handler):
+		with self.__lock:
+			self.requests.append((handler.path, dict(handler.headers), handler.client_address))
+
+	def count(self, path=None):
+		with self.__lock:
+			return len([request for request in self.requests if path == None or request[0] == path])
+
+	def connections(self):
+		with self.__lock:
+			return len(set(request[2] for request in self.requests))
+
+	def fail(self, path, times=1):
+		with self.__lock:
+			self.__failures[path] = self.__failures.get(path, 0) + times
+
+	def truncate(self, path, times=1):
+		with self.__lock:
+			self.__truncations[path] = self.__truncations.get(path, 0) + times
+
+	def take_failure(self, path):
+		return self.__take(self.__failures, path)
+
+	def take_truncation(self, path):
+		return self.__take(self.__truncations, path)
+
+	def close(self):
+		self.shutdown()
+		self.server_close()
+
+	def __take(self, counts, path):
+		with self.__lock:
+			if counts.get(path, 0) > 0:
+				counts[path] -= 1
+				return True
+			return False
+
+
+class FixtureTree():
+	'''Copy of the recorded mirror in a scratch directory. The recorded 3.2
+	listing stands in for the listing of every version in the index, so a full
+	catalogue can be scraped, and nightly.json holds a nightly manifest.
+	'''
+
+	version_re = re.compile(r'<a href="(\d+\.\d+[\d.]*)/">')
+
+	def __init__(self, path):
+		self.path = path
+		self.versions = []
+
+		source = os.path.join(fixtures_dir, "godotengine")
+		shutil.copytree(source, os.path.join(path, "godotengine"))
+
+		with open(os.path.join(source, "index.html"), 'r', encoding="iso-8859-1") as f:
+			self.versions = self.version_re.findall(f.read())
+		with open(os.path.join(source, "3.2", "index.html"), 'r', encoding="iso-8859-1") as f:
+			listing = f.read()
+
+		for version in self.versions:
+			if version != "3.2":
+				page = listing.replace("/godotengine/3.2/", "/godotengine/{version}/".format(version=version))
+				page = page.replace("Godot_v3.2-", "Godot_v{version}-".format(version=version))
+				self.add_file("godotengine/{version}/index.html".format(version=version), page.encode("iso-8859-1"))
+
+		self.add_file("nightly.json", json.dumps({ "commit": "0123456789abcdef", "date": "2020-02-01", "sha256": "0" * 64 }).encode("utf-8"))
+
+	def add_file(self, rel_path, data):
+		file_path = os.path.join(self.path, *rel_path.split("/"))
+		os.makedirs(os.path.dirname(file_path), exist_ok=True)
+		with open(file_path, 'wb') as f:
+			f.write(data)
+
+		return file_path
+
+	def add_godot_archive(self, version, file_suffix, size=256 * 1024):
+		'''Publishes a stable Godot archive of `version` holding a binary of `size`
+		bytes. Returns the archive's bytes.
+		'''
+		binary_name = "Godot_v{version}-stable_{suffix}".format(version=version, suffix=file_suffix)
+
+		buffer = io.BytesIO()
+		with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+			zip_ref.writestr(binary_name, os.urandom(size))
+			zip_ref.writestr("README.txt", "Godot Engine")
+
+		self.add_file("godotengine/{version}/{name}.zip".format(version=version, name=binary_name), buffer.getvalue())
+		return buffer.getvalue()
+
+
+class ToolkitScratch():
+	'''Scratch data directory with a fixture tree served on localhost and the
+	toolkit config pointing at both. The config is process wide, every test
+	sets it up again for its own scratch directory.
+	'''
+
+	def __init__(self, ranges=True):
+		self.path = tempfile.mkdtemp(prefix="godot-toolkit-test-")
+		self.tree = FixtureTree(os.path.join(self.path, "www"))
+		self.server = FixtureServer(self.tree.path, ranges=ranges)
+
+		self.config = GodotToolkitConfig()
+		self.config.set("godot_cli", "base_dl_url",                self.server.url + "/godotengine")
+		self.config.set("godot_cli", "godot_catalogue_cache_path", os.path.join(self.path, "data", "cache.json"))
+		self.config.set("godot_cli", "godot_binaries_path",        os.path.join(self.path, "data", "godot_bin"))
+		self.config.set("godot_cli", "download_tmp",               os.path.join(self.path, "data", "tmp"))
+		self.config.set("godot_cli", "scrape_retry_backoff",       0.01)
+		self.config.set("godot_nightly", "manifest_url",           self.server.url + "/nightly.json")
+
+		os.makedirs(os.path.join(self.path, "data"))
+
+	def close(self):
+		self.server.close()
+		shutil.rmtree(self.path, ignore_errors=True)